@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
-from .models import Marcacion, Empresa, Perfil, SolicitudMarca, Feriado, Vacacion
+from .models import Marcacion, Empresa, Perfil, SolicitudMarca, Feriado, Vacacion, TareaPendiente, DireccionCache, CorreoSaliente, JornadaDiaria, AnimoDiario, TrabajoReporte, EstadoTrabajo, ImportacionNomina
 
 User = get_user_model()
 
@@ -89,3 +89,68 @@ class VacacionAdmin(admin.ModelAdmin):
         return (obj.fin - obj.inicio).days + 1
     dias_duracion.short_description = "Días"
 
+
+@admin.register(TareaPendiente)
+class TareaPendienteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'estado', 'marca', 'intentos', 'ejecutar_desde', 'updated_at')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('ultimo_error', 'created_at', 'updated_at')
+    exclude = ('archivo',)
+
+@admin.register(DireccionCache)
+class DireccionCacheAdmin(admin.ModelAdmin):
+    list_display = ('clave', 'direccion', 'aciertos', 'actualizado')
+    search_fields = ('clave', 'direccion')
+    ordering = ('-aciertos',)
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'asunto', 'destinatario', 'estado', 'intentos', 'ejecutar_desde', 'enviado_en')
+    list_filter = ('estado',)
+    search_fields = ('asunto', 'destinatario')
+    readonly_fields = ('ultimo_error', 'created_at', 'updated_at', 'enviado_en')
+
+@admin.register(EstadoTrabajo)
+class EstadoTrabajoAdmin(admin.ModelAdmin):
+    # Lo maneja `asistencia_scheduler`; borrar la fila fuerza una revisión completa en el próximo tick
+    list_display = ('nombre', 'marca_hasta', 'revisado_hasta', 'dueno', 'lease_hasta', 'ultima_ejecucion', 'ultima_duracion', 'ultimo_resumen')
+    readonly_fields = ('ultimo_error', 'updated_at')
+
+@admin.register(ImportacionNomina)
+class ImportacionNominaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nombre_archivo', 'empresa', 'solicitado_por', 'estado', 'simular', 'progreso', 'created_at', 'terminado_en')
+    list_filter = ('estado',)
+    readonly_fields = ('resumen', 'diferencias', 'error', 'created_at', 'updated_at', 'terminado_en')
+
+@admin.register(JornadaDiaria)
+class JornadaDiariaAdmin(admin.ModelAdmin):
+    # Se calcula desde las marcas: solo lectura (reconstruir con `reconstruir_jornadas`)
+    list_display = ('trabajador', 'fecha', 'entrada', 'salida', 'segundos_trabajados', 'doble_entrada', 'tiene_manual')
+    list_filter = ('fecha', 'doble_entrada')
+    search_fields = ('trabajador__username', 'trabajador__first_name', 'trabajador__last_name')
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(AnimoDiario)
+class AnimoDiarioAdmin(admin.ModelAdmin):
+    # Contadores que suman las marcas: solo lectura (reconstruir con `reconstruir_animo`)
+    list_display = ('empresa', 'fecha', 'cargo', 'animo', 'total')
+    list_filter = ('animo', 'empresa')
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(TrabajoReporte)
+class TrabajoReporteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'empresa', 'estado', 'progreso', 'solicitado_por', 'created_at', 'terminado_en')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('huella', 'error', 'created_at', 'updated_at', 'terminado_en')
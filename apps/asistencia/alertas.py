@@ -0,0 +1,321 @@
+"""
+Motor de alertas de `revisar_alertas` (ausencias y exceso de jornada) y de
+`detectar_olvidos` (entradas sin salida).
+
+Antes se recorría Empresa → Trabajador y, por cada uno, se hacían hasta ocho
+consultas (entrada de hoy, primera y última marca, vacaciones, licencia, dos
+LogAlerta...) y se enviaba el correo dentro del mismo ciclo: con 3.000
+trabajadores la revisión tardaba minutos y se pisaba con la siguiente.
+
+Ahora:
+- Una sola consulta trae a todos los trabajadores a revisar, ya filtrados por
+  turno de hoy, vacaciones y licencias (NOT EXISTS), con su primera entrada,
+  el tipo de su última marca y si ya tienen alerta hoy (subconsultas).
+- Las reglas se evalúan en memoria.
+- Las alertas se guardan con un bulk_create (la restricción única de LogAlerta
+  evita duplicados aunque dos revisiones corran a la vez) y los correos se
+  dejan en la bandeja en un solo INSERT: los despacha el worker de correos.
+
+Los olvidos de salida se buscan igual: una consulta con NOT EXISTS (ENTRADA sin
+SALIDA posterior) y un solo UPDATE para marcarlas, sin pasar por
+`Marcacion.save` (que valida y recalcula la cadena de hash).
+
+El scheduler (`planificador.py`) usa las mismas funciones en modo incremental:
+con `anterior` (hora del tick previo) y `marca_desde` (última marca ya vista)
+solo se miran los umbrales que se cruzaron entre ambos ticks y las marcas nuevas.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import correo
+from .models import Marcacion, JornadaDiaria, LogAlerta, Vacacion, LicenciaMedica, Perfil
+
+
+# Tolerancia antes de acusar una ausencia
+TOLERANCIA_AUSENCIA = timedelta(minutes=45)
+# Horas sobre la jornada pactada para la alerta de fatiga
+MARGEN_EXCESO_HORAS = 2
+# Horas sobre la jornada pactada para considerar que olvidó marcar la salida (9 + 1 = 10)
+MARGEN_OLVIDO_HORAS = 1
+HORA_ENTRADA_DEFECTO = dt_time(9, 0)
+JORNADA_DEFECTO = 9
+
+
+class Cronometro:
+    """Segundos por fase, para el resumen del comando."""
+
+    def __init__(self):
+        self.fases = {}
+
+    @contextmanager
+    def fase(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nombre] = self.fases.get(nombre, 0) + time.perf_counter() - inicio
+
+
+def trabajadores_a_revisar(hoy):
+    """
+    Trabajadores activos (no staff) de empresas con correo de RRHH a los que les toca
+    trabajar hoy y no están de vacaciones ni con licencia, anotados con:
+    primera_entrada, ultimo_tipo (última marca del día), avisado_ausencia y avisado_exceso.
+    """
+    inicio, fin = JornadaDiaria.rango_dia(hoy)
+    marcas_hoy = Marcacion.objects.filter(trabajador=OuterRef('pk'), timestamp__gte=inicio, timestamp__lt=fin)
+    alertas_hoy = LogAlerta.objects.filter(trabajador=OuterRef('pk'), fecha=hoy)
+
+    return (
+        User.objects
+        .filter(is_active=True, is_staff=False, perfil__empresa__isnull=False, **{f'perfil__{Perfil.DIAS_TURNO[hoy.weekday()]}': True})
+        .exclude(perfil__empresa__email_rrhh__isnull=True)
+        .exclude(perfil__empresa__email_rrhh='')
+        .filter(~Exists(Vacacion.objects.filter(trabajador=OuterRef('pk'), estado='APROBADA', inicio__lte=hoy, fin__gte=hoy)))
+        .filter(~Exists(LicenciaMedica.objects.filter(trabajador=OuterRef('pk'), inicio__lte=hoy, fin__gte=hoy)))
+        .annotate(
+            primera_entrada=Subquery(marcas_hoy.filter(tipo='ENTRADA').order_by('timestamp').values('timestamp')[:1]),
+            ultimo_tipo=Subquery(marcas_hoy.order_by('-timestamp', '-id').values('tipo')[:1]),
+            avisado_ausencia=Exists(alertas_hoy.filter(tipo='AUSENCIA')),
+            avisado_exceso=Exists(alertas_hoy.filter(tipo='EXCESO_HORAS')),
+        )
+        .select_related('perfil__empresa')
+        .order_by('perfil__empresa_id', 'id')
+    )
+
+
+def evaluar(trabajadores, hoy, ahora):
+    """Aplica las reglas en memoria. Devuelve una lista de (trabajador, tipo, horas_trabajadas)."""
+    alertas = []
+    for user in trabajadores:
+        perfil = user.perfil
+        hora_entrada = perfil.hora_entrada or HORA_ENTRADA_DEFECTO
+        jornada_horas = perfil.jornada_diaria or JORNADA_DEFECTO
+
+        if user.primera_entrada is None:
+            # AUSENCIA: pasó la hora pactada + tolerancia y no ha marcado entrada
+            limite_ausencia = timezone.make_aware(datetime.combine(hoy, hora_entrada)) + TOLERANCIA_AUSENCIA
+            if ahora > limite_ausencia and not user.avisado_ausencia:
+                alertas.append((user, 'AUSENCIA', None))
+            continue
+
+        # EXCESO: sigue "dentro" (última marca ENTRADA o FIN_COLACION) y se pasó de su jornada
+        if user.ultimo_tipo in ('ENTRADA', 'FIN_COLACION') and not user.avisado_exceso:
+            horas_trabajadas = (ahora - user.primera_entrada).total_seconds() / 3600
+            if horas_trabajadas > jornada_horas + MARGEN_EXCESO_HORAS:
+                alertas.append((user, 'EXCESO_HORAS', horas_trabajadas))
+
+    return alertas
+
+
+def _correo(user, tipo, horas_trabajadas, ahora):
+    perfil = user.perfil
+    empresa = perfil.empresa
+    if tipo == 'AUSENCIA':
+        asunto = f"⚠️ ALERTA AUSENCIA: {user.get_full_name()}"
+        mensaje = (
+            f"Empresa: {empresa.nombre}\n"
+            f"Trabajador: {user.get_full_name()} (RUT: {perfil.rut or 'S/I'})\n\n"
+            f"Estado: NO HA MARCADO ENTRADA.\n"
+            f"Hora entrada pactada: {perfil.hora_entrada or HORA_ENTRADA_DEFECTO}\n"
+            f"Hora actual revisión: {ahora.strftime('%H:%M')}\n\n"
+            f"El sistema ha verificado y no existe registro de entrada."
+        )
+    else:
+        asunto = f"🚨 URGENTE EXCESO: {user.get_full_name()}"
+        mensaje = (
+            f"Empresa: {empresa.nombre}\n"
+            f"Trabajador: {user.get_full_name()}\n\n"
+            f"⚠️ ALERTA DE FATIGA / EXCESO DE JORNADA\n"
+            f"Lleva {int(horas_trabajadas)} horas trabajando continuas.\n"
+            f"Jornada pactada: {perfil.jornada_diaria or JORNADA_DEFECTO} hrs.\n"
+            f"Favor contactar al trabajador para verificar su salida."
+        )
+    return {
+        'asunto': asunto,
+        'destinatario': empresa.email_rrhh,
+        'texto': mensaje,
+        'remitente': f"Alerta Asistencia {empresa.nombre} <{settings.EMAIL_HOST_USER}>",
+    }
+
+
+def registrar(alertas, hoy, ahora):
+    """Guarda las alertas (sin duplicar) y encola sus correos, todo en una transacción."""
+    with transaction.atomic():
+        LogAlerta.objects.bulk_create(
+            [LogAlerta(trabajador=user, fecha=hoy, tipo=tipo) for user, tipo, _ in alertas],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        correo.encolar_lote([_correo(user, tipo, horas, ahora) for user, tipo, horas in alertas])
+
+
+def _vencidas(ahora, horas_extra, anterior=None):
+    """
+    Q de las marcas con más de (jornada_diaria + horas_extra) horas a las `ahora`.
+    Con `anterior`, solo las que cruzaron ese umbral entre `anterior` y `ahora`
+    (el rango exterior, de la jornada más larga a la más corta, acota el índice de timestamp).
+    """
+    # Una condición por cada jornada pactada distinta (son pocas: 8, 9, 10, 12...)
+    jornadas = set(Perfil.objects.exclude(jornada_diaria__isnull=True).values_list('jornada_diaria', flat=True).distinct())
+    margenes = {None: timedelta(hours=JORNADA_DEFECTO + horas_extra)}
+    margenes.update({horas: timedelta(hours=(horas or JORNADA_DEFECTO) + horas_extra) for horas in jornadas})
+
+    vencidas = Q()
+    for horas, margen in margenes.items():
+        rango = Q(timestamp__lte=ahora - margen)
+        if anterior is not None:
+            rango &= Q(timestamp__gte=anterior - margen)
+        jornada = Q(trabajador__perfil__jornada_diaria__isnull=True) if horas is None else Q(trabajador__perfil__jornada_diaria=horas)
+        vencidas |= jornada & rango
+
+    if anterior is None:
+        return vencidas
+    return Q(timestamp__gte=anterior - max(margenes.values()), timestamp__lte=ahora - min(margenes.values())) & vencidas
+
+
+def candidatos_alertas(hoy, anterior, ahora, marca_desde):
+    """
+    Ids de los trabajadores cuyo estado pudo cambiar entre el tick `anterior` y `ahora`:
+    - se les cumplió la hora de entrada + tolerancia (posible AUSENCIA),
+    - su primera ENTRADA cruzó jornada + margen (posible EXCESO_HORAS),
+    - marcaron algo después de la marca `marca_desde` (ej: volvieron de colación).
+    Cada consulta recorre un rango de índice: el costo sigue a los eventos, no a la dotación.
+    """
+    inicio = JornadaDiaria.rango_dia(hoy)[0]
+    anterior = max(anterior, inicio)
+    ids = set()
+
+    # Hora pactada en [anterior - tolerancia, ahora - tolerancia], ese mismo día
+    desde = timezone.localtime(anterior) - TOLERANCIA_AUSENCIA
+    hasta = timezone.localtime(ahora) - TOLERANCIA_AUSENCIA
+    if hasta.date() == hoy:
+        perfiles = Perfil.objects.filter(hora_entrada__lte=hasta.time())
+        if desde.date() == hoy:
+            perfiles = perfiles.filter(hora_entrada__gte=desde.time())
+        ids.update(perfiles.values_list('usuario_id', flat=True))
+
+    entradas = Marcacion.objects.filter(tipo='ENTRADA', timestamp__gte=inicio).filter(_vencidas(ahora, MARGEN_EXCESO_HORAS, anterior))
+    ids.update(entradas.values_list('trabajador_id', flat=True))
+
+    nuevas = Marcacion.objects.filter(id__gt=marca_desde, timestamp__gte=inicio)
+    ids.update(nuevas.values_list('trabajador_id', flat=True))
+    return ids
+
+
+def revisar(hoy=None, ahora=None, cronometro=None, solo=None):
+    """
+    Revisión del día (con `solo`, únicamente esos ids de trabajador).
+    Devuelve (trabajadores_revisados, alertas).
+    """
+    hoy = hoy or timezone.localdate()
+    ahora = timezone.localtime(ahora or timezone.now())
+    cronometro = cronometro or Cronometro()
+
+    with cronometro.fase('consulta'):
+        if solo is None:
+            trabajadores = list(trabajadores_a_revisar(hoy))
+        else:
+            trabajadores = list(trabajadores_a_revisar(hoy).filter(pk__in=solo)) if solo else []
+    with cronometro.fase('evaluacion'):
+        alertas = evaluar(trabajadores, hoy, ahora)
+    with cronometro.fase('registro'):
+        if alertas:
+            registrar(alertas, hoy, ahora)
+
+    return len(trabajadores), alertas
+
+
+# =======================================================
+# OLVIDOS DE SALIDA (detectar_olvidos)
+# =======================================================
+
+def entradas_sin_salida(ahora=None, dias=1, horas_extra=MARGEN_OLVIDO_HORAS, anterior=None, marca_desde=0):
+    """
+    ENTRADAS de los últimos `dias` días (hoy incluido) aún no avisadas, sin ninguna
+    SALIDA posterior del trabajador y con más de (jornada_diaria + horas_extra) horas.
+    El límite de cada jornada pactada va como condición de rango en la misma consulta.
+
+    Con `anterior` (modo scheduler) solo se consideran las que cruzaron el límite
+    desde el tick anterior y las marcas nuevas (id > `marca_desde`), que pueden
+    llegar atrasadas (sincronización offline) con el límite ya cruzado.
+    """
+    ahora = ahora or timezone.now()
+    desde = JornadaDiaria.rango_dia(timezone.localdate(ahora) - timedelta(days=dias - 1))[0]
+    entradas = Marcacion.objects.filter(tipo='ENTRADA', alerta_olvido_enviada=False, timestamp__gte=desde)
+
+    if anterior is None:
+        entradas = entradas.filter(_vencidas(ahora, horas_extra))
+    else:
+        ids = set(entradas.filter(_vencidas(ahora, horas_extra, anterior)).values_list('id', flat=True))
+        ids.update(entradas.filter(id__gt=marca_desde).filter(_vencidas(ahora, horas_extra)).values_list('id', flat=True))
+        entradas = Marcacion.objects.filter(id__in=ids)
+
+    salida_posterior = Marcacion.objects.filter(
+        trabajador=OuterRef('trabajador'), tipo='SALIDA', timestamp__gt=OuterRef('timestamp')
+    )
+    return (
+        entradas
+        .filter(~Exists(salida_posterior))
+        .select_related('trabajador__perfil__empresa')
+        .order_by('trabajador__perfil__empresa_id', 'timestamp')
+    )
+
+
+def _correos_olvido(entradas):
+    """Aviso a cada trabajador (si tiene email) y un resumen por empresa para RRHH."""
+    correos, por_empresa = [], {}
+    for entrada in entradas:
+        trabajador = entrada.trabajador
+        perfil = getattr(trabajador, 'perfil', None)
+        empresa = perfil.empresa if perfil else None
+        hora = timezone.localtime(entrada.timestamp)
+
+        if trabajador.email:
+            correos.append({
+                'asunto': f"⚠️ Alerta de Asistencia: Sin marca de salida - {trabajador.get_full_name()}",
+                'destinatario': trabajador.email,
+                'texto': (
+                    f"Estimado/a,\n\n"
+                    f"El trabajador {trabajador.get_full_name()} marcó ENTRADA el {hora.strftime('%d/%m')} a las {hora.strftime('%H:%M')}, "
+                    f"pero han pasado más de {(perfil.jornada_diaria if perfil and perfil.jornada_diaria else JORNADA_DEFECTO) + MARGEN_OLVIDO_HORAS} horas "
+                    f"y no se registra su SALIDA.\n\n"
+                    f"Por favor, verificar si se trata de un olvido o una hora extra extensa.\n\n"
+                    f"Saludos,\nSistema de Asistencia {empresa.nombre if empresa else 'Empresa'}"
+                ),
+            })
+        if empresa and empresa.email_rrhh:
+            por_empresa.setdefault(empresa, []).append(f"- {trabajador.get_full_name() or trabajador.username}: entrada {hora.strftime('%d/%m %H:%M')}")
+
+    for empresa, lineas in por_empresa.items():
+        correos.append({
+            'asunto': f"⚠️ {len(lineas)} trabajador(es) sin marca de salida - {empresa.nombre}",
+            'destinatario': empresa.email_rrhh,
+            'texto': "Las siguientes entradas no tienen SALIDA registrada:\n\n" + "\n".join(lineas),
+            'remitente': f"Alerta Asistencia {empresa.nombre} <{settings.EMAIL_HOST_USER}>",
+        })
+    return correos, len(por_empresa)
+
+
+def avisar_olvidos(ahora=None, dias=1, horas_extra=MARGEN_OLVIDO_HORAS, cronometro=None, anterior=None, marca_desde=0):
+    """Busca, encola los avisos y marca las entradas en una transacción. Devuelve (entradas, empresas)."""
+    cronometro = cronometro or Cronometro()
+    with cronometro.fase('consulta'):
+        entradas = list(entradas_sin_salida(ahora, dias, horas_extra, anterior, marca_desde))
+    if not entradas:
+        return entradas, 0
+
+    with cronometro.fase('registro'):
+        correos, empresas = _correos_olvido(entradas)
+        with transaction.atomic():
+            correo.encolar_lote(correos)
+            # UPDATE directo: no re-valida ni toca la cadena de hash
+            Marcacion.objects.filter(id__in=[e.id for e in entradas]).update(alerta_olvido_enviada=True)
+    return entradas, empresas
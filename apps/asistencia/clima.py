@@ -0,0 +1,126 @@
+"""
+Clima laboral (ánimo al marcar la salida) a partir del resumen `AnimoDiario`.
+
+El gráfico del panel RRHH agrupaba con GROUP BY todas las marcas de la última
+semana, de todas las empresas. Ahora cada marca con ánimo suma 1 al contador
+de su (empresa, día, cargo, ánimo) al insertarse, y los gráficos leen esa
+tabla: una semana son unas decenas de filas, un año unos pocos miles.
+
+`reconstruir` rellena la tabla desde las marcas (datos históricos o después de
+cargas directas a la BD), con una sola consulta agrupada.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Marcacion, AnimoDiario, JornadaDiaria
+
+
+ANIMOS = [clave for clave, _ in Marcacion.ANIMO_CHOICES]
+AGRUPACIONES = {'semana': TruncWeek, 'mes': TruncMonth}
+MAX_PERIODOS = 104
+
+
+def de_empresa(empresa):
+    """Contadores de la empresa (sin empresa, p. ej. un superusuario, se ven todas)."""
+    animos = AnimoDiario.objects.all()
+    return animos.filter(empresa=empresa) if empresa else animos
+
+
+def conteo(empresa, dias=7):
+    """{'FELIZ': n, 'NEUTRAL': n, 'MOLESTO': n} de los últimos `dias` días (incluido hoy)."""
+    desde = timezone.localdate() - timedelta(days=dias - 1)
+    resultado = dict.fromkeys(ANIMOS, 0)
+    for animo, total in de_empresa(empresa).filter(fecha__gte=desde).values_list('animo').annotate(suma=Sum('total')):
+        resultado[animo] = total
+    return resultado
+
+
+def _inicio_periodo(dia, agrupar):
+    if agrupar == 'mes':
+        return dia.replace(day=1)
+    return dia - timedelta(days=dia.weekday())  # Lunes (igual que TruncWeek)
+
+
+def _periodos(agrupar, cantidad, hasta):
+    """Inicios de los últimos `cantidad` periodos, del más antiguo al actual."""
+    actual = _inicio_periodo(hasta, agrupar)
+    inicios = [actual]
+    for _ in range(cantidad - 1):
+        actual = _inicio_periodo(actual - timedelta(days=1), agrupar)
+        inicios.append(actual)
+    return inicios[::-1]
+
+
+def tendencia(empresa, agrupar='semana', periodos=12, cargo=None):
+    """
+    Serie por semana o mes de cada ánimo: {'periodos': [...], 'series': {animo: [...]},
+    'cargos': [...]}. Con `cargo` se cuentan solo los trabajadores de ese cargo.
+    """
+    agrupar = agrupar if agrupar in AGRUPACIONES else 'semana'
+    periodos = max(1, min(int(periodos), MAX_PERIODOS))
+    inicios = _periodos(agrupar, periodos, timezone.localdate())
+
+    animos = de_empresa(empresa).filter(fecha__gte=inicios[0])
+    cargos = list(animos.exclude(cargo='').order_by('cargo').values_list('cargo', flat=True).distinct())
+    if cargo:
+        animos = animos.filter(cargo=cargo)
+
+    posicion = {inicio: i for i, inicio in enumerate(inicios)}
+    series = {animo: [0] * len(inicios) for animo in ANIMOS}
+    filas = (
+        animos.annotate(periodo=AGRUPACIONES[agrupar]('fecha'))
+        .values_list('periodo', 'animo')
+        .annotate(suma=Sum('total'))
+        .order_by()
+    )
+    for periodo, animo, total in filas:
+        if periodo in posicion and animo in series:
+            series[animo][posicion[periodo]] = total
+
+    return {
+        'agrupar': agrupar,
+        'periodos': [inicio.isoformat() for inicio in inicios],
+        'series': series,
+        'cargos': cargos,
+    }
+
+
+def reconstruir(desde=None, hasta=None, empresa_id=None):
+    """
+    Borra y vuelve a contar los ánimos entre `desde` y `hasta` (fechas locales, ambas
+    inclusive y opcionales), con la empresa y cargo que cada marca guardó al insertarse
+    (los mismos del conteo incremental). Devuelve cuántas filas quedaron.
+    """
+    marcas = Marcacion.objects.filter(animo__isnull=False, animo_empresa__isnull=False)
+    animos = AnimoDiario.objects.all()
+
+    if desde:
+        marcas = marcas.filter(timestamp__gte=JornadaDiaria.rango_dia(desde)[0])
+        animos = animos.filter(fecha__gte=desde)
+    if hasta:
+        marcas = marcas.filter(timestamp__lt=JornadaDiaria.rango_dia(hasta)[1])
+        animos = animos.filter(fecha__lte=hasta)
+    if empresa_id:
+        marcas = marcas.filter(animo_empresa_id=empresa_id)
+        animos = animos.filter(empresa_id=empresa_id)
+
+    # TruncDate usa la zona horaria activa (America/Santiago): el día local de cada marca
+    filas = (
+        marcas.annotate(dia=TruncDate('timestamp'))
+        .values_list('animo_empresa_id', 'dia', 'animo_cargo', 'animo')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    contadores = [
+        AnimoDiario(empresa_id=empresa, fecha=dia, cargo=cargo or '', animo=animo, total=total)
+        for empresa, dia, cargo, animo, total in filas
+    ]
+
+    with transaction.atomic():
+        animos.delete()
+        AnimoDiario.objects.bulk_create(contadores, batch_size=1000)
+    return len(contadores)
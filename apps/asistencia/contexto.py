@@ -0,0 +1,56 @@
+"""
+Contexto de empresa por request.
+
+Casi todas las vistas (y los chequeos de rol) pasan por `user.perfil.empresa`,
+lo que costaba una consulta por el Perfil y otra por la Empresa en cada hit.
+El middleware los resuelve con un solo `select_related`, los guarda en la caché
+de Django (se invalida al guardar un Perfil o una Empresa, ver models.py) y los
+deja en `request.perfil` / `request.empresa`.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Perfil, clave_contexto_empresa
+
+
+CACHE_SEGUNDOS = getattr(settings, 'CONTEXTO_EMPRESA_CACHE_SEGUNDOS', 60)
+
+_SIN_CACHE = object()
+
+
+def obtener_perfil(usuario):
+    """
+    Perfil del usuario con su Empresa ya cargada (None si no tiene perfil).
+    Además lo deja cacheado en `usuario.perfil`, así `hasattr(user, 'perfil')`
+    y `user.perfil.empresa` no vuelven a consultar la BD.
+    """
+    clave = clave_contexto_empresa(usuario.pk)
+    perfil = cache.get(clave, _SIN_CACHE)
+
+    if perfil is _SIN_CACHE:
+        perfil = Perfil.objects.select_related('empresa').filter(usuario_id=usuario.pk).first()
+        cache.set(clave, perfil, CACHE_SEGUNDOS)
+
+    # None también se cachea en la relación: `user.perfil` lanza DoesNotExist sin consultar
+    Perfil.usuario.field.remote_field.set_cached_value(usuario, perfil)
+    if perfil is not None:
+        Perfil.usuario.field.set_cached_value(perfil, usuario)
+    return perfil
+
+
+class ContextoEmpresaMiddleware:
+    """Adjunta `request.perfil` y `request.empresa` (va después de AuthenticationMiddleware)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.perfil = None
+        request.empresa = None
+
+        if request.user.is_authenticated:
+            request.perfil = obtener_perfil(request.user)
+            if request.perfil is not None:
+                request.empresa = request.perfil.empresa
+
+        return self.get_response(request)
@@ -0,0 +1,189 @@
+"""
+Bandeja de salida de correos (comprobantes y alertas).
+
+Antes cada evento llamaba a `send_mail`, que abre una conexión TLS nueva a
+smtp.gmail.com por correo. Ahora se encolan en `CorreoSaliente` y
+`enviar_pendientes` los despacha por lotes reutilizando una sola conexión,
+con reintentos con backoff y un tope de correos por destinatario.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Count, Q
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import CorreoSaliente
+
+
+# Backoff exponencial ante errores SMTP: 60s, 120s, 240s... con tope de 1 hora
+BACKOFF_BASE_SEGUNDOS = getattr(settings, 'CORREO_BACKOFF_BASE_SEGUNDOS', 60)
+BACKOFF_MAX_SEGUNDOS = getattr(settings, 'CORREO_BACKOFF_MAX_SEGUNDOS', 3600)
+# Límite por destinatario (ej: el correo de RRHH recibe copia de cada comprobante)
+MAX_POR_DESTINATARIO = getattr(settings, 'CORREO_MAX_POR_DESTINATARIO', 100)
+VENTANA_DESTINATARIO = timedelta(minutes=getattr(settings, 'CORREO_VENTANA_MINUTOS', 60))
+# Si un worker muere con un lote tomado, otro lo retoma pasado este tiempo
+TIMEOUT_EN_PROCESO = timedelta(minutes=getattr(settings, 'TAREAS_TIMEOUT_MINUTOS', 10))
+
+
+# =======================================================
+# 1. ENCOLAR
+# =======================================================
+
+def encolar_correo(asunto, destinatario, texto=None, plantilla=None, contexto=None, copia=None, remitente=None):
+    """
+    Deja un correo listo para el próximo lote.
+    Con `plantilla` se renderiza el HTML (Django mantiene la plantilla compilada
+    en caché) y, si no se entrega `texto`, la versión plana sale del HTML.
+
+    Cada dirección en `copia` se encola como su propio correo: así el límite por
+    destinatario también cuenta al buzón de RRHH (que recibe copia de cada
+    comprobante) y postergarlo no atrasa el comprobante del trabajador.
+    Devuelve el correo del destinatario principal.
+    """
+    html = None
+    if plantilla:
+        html = get_template(plantilla).render(contexto or {})
+        if texto is None:
+            texto = strip_tags(html)
+
+    destinatarios = [destinatario] + [c for c in dict.fromkeys(copia or []) if c and c != destinatario]
+
+    principal, *_ = CorreoSaliente.objects.bulk_create([
+        CorreoSaliente(
+            asunto=asunto[:255],
+            destinatario=direccion,
+            cuerpo_texto=texto or '',
+            cuerpo_html=html,
+            remitente=remitente,
+        )
+        for direccion in destinatarios
+    ])
+    return principal
+
+
+def encolar_lote(correos):
+    """
+    Encola muchos correos de texto en un solo INSERT (alertas masivas).
+    `correos`: dicts con asunto, destinatario, texto y opcionalmente remitente.
+    """
+    return CorreoSaliente.objects.bulk_create([
+        CorreoSaliente(
+            asunto=c['asunto'][:255],
+            destinatario=c['destinatario'],
+            cuerpo_texto=c.get('texto') or '',
+            remitente=c.get('remitente'),
+        )
+        for c in correos
+    ], batch_size=500)
+
+
+# =======================================================
+# 2. ENVÍO POR LOTES
+# =======================================================
+
+def calcular_backoff(intentos):
+    segundos = BACKOFF_BASE_SEGUNDOS * (2 ** max(intentos - 1, 0))
+    return timedelta(seconds=min(segundos, BACKOFF_MAX_SEGUNDOS))
+
+
+def tomar_lote(limite=50):
+    """Reserva hasta `limite` correos listos (skip_locked: varios workers sin pisarse)."""
+    ahora = timezone.now()
+    listos = Q(estado='PENDIENTE', ejecutar_desde__lte=ahora) | Q(
+        estado='EN_PROCESO', updated_at__lt=ahora - TIMEOUT_EN_PROCESO
+    )
+
+    with transaction.atomic():
+        qs = CorreoSaliente.objects.select_for_update(skip_locked=True).filter(listos)
+        ids = list(qs.order_by('id').values_list('id', flat=True)[:limite])
+        CorreoSaliente.objects.filter(id__in=ids).update(estado='EN_PROCESO', updated_at=ahora)
+
+    return list(CorreoSaliente.objects.filter(id__in=ids).order_by('id'))
+
+
+def _direcciones(correo):
+    """Todas las direcciones a las que llega el correo (`copia` solo en filas encoladas antes de separarla)."""
+    return [correo.destinatario, *(correo.copia or [])]
+
+
+def _enviados_recientes(destinatarios, ahora):
+    """Cuántos correos recibió cada destinatario dentro de la ventana del límite."""
+    filas = (
+        CorreoSaliente.objects
+        .filter(estado='ENVIADO', destinatario__in=destinatarios, enviado_en__gte=ahora - VENTANA_DESTINATARIO)
+        .values('destinatario')
+        .annotate(total=Count('id'))
+    )
+    return {fila['destinatario']: fila['total'] for fila in filas}
+
+
+def _mensaje(correo, conexion):
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo_texto,
+        from_email=correo.remitente or None,
+        to=[correo.destinatario],
+        cc=correo.copia or None,
+        connection=conexion,
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def enviar_pendientes(limite=50):
+    """
+    Envía un lote sobre una única conexión SMTP. Devuelve (enviados, con_error).
+    Cada correo se manda por separado para poder reintentar solo el que falló;
+    los que superan el límite de su destinatario se postergan sin gastar intentos.
+    """
+    lote = tomar_lote(limite)
+    if not lote:
+        return 0, 0
+
+    ahora = timezone.now()
+    recibidos = _enviados_recientes({d for c in lote for d in _direcciones(c)}, ahora)
+    espera_limite = VENTANA_DESTINATARIO / max(MAX_POR_DESTINATARIO, 1)
+
+    enviados, con_error = 0, 0
+    conexion = get_connection(fail_silently=False)
+    try:
+        for correo in lote:
+            if any(recibidos.get(d, 0) >= MAX_POR_DESTINATARIO for d in _direcciones(correo)):
+                correo.estado = 'PENDIENTE'
+                correo.ejecutar_desde = ahora + espera_limite
+                correo.save(update_fields=['estado', 'ejecutar_desde', 'updated_at'])
+                continue
+
+            correo.intentos += 1
+            try:
+                conexion.open()  # No hace nada si la conexión sigue abierta
+                conexion.send_messages([_mensaje(correo, conexion)])
+            except Exception as e:
+                # Cerramos para que el siguiente correo abra una conexión limpia
+                conexion.close()
+                correo.ultimo_error = f"{type(e).__name__}: {e}"
+                if correo.intentos >= correo.max_intentos:
+                    correo.estado = 'FALLIDO'
+                else:
+                    correo.estado = 'PENDIENTE'
+                    correo.ejecutar_desde = timezone.now() + calcular_backoff(correo.intentos)
+                correo.save(update_fields=['estado', 'intentos', 'ejecutar_desde', 'ultimo_error', 'updated_at'])
+                con_error += 1
+                continue
+
+            correo.estado = 'ENVIADO'
+            correo.ultimo_error = None
+            correo.enviado_en = timezone.now()
+            correo.save(update_fields=['estado', 'intentos', 'ultimo_error', 'enviado_en', 'updated_at'])
+            for d in _direcciones(correo):
+                recibidos[d] = recibidos.get(d, 0) + 1
+            enviados += 1
+    finally:
+        conexion.close()
+
+    return enviados, con_error
@@ -0,0 +1,154 @@
+"""
+Utilidades para exportar reportes sin cargarlos completos en memoria.
+
+Excel: openpyxl en modo `write_only` escribe cada fila a disco apenas se
+agrega, y los estilos se registran una sola vez como NamedStyle (antes se
+creaba un Font/Alignment por celda). El .xlsx final se arma en un
+SpooledTemporaryFile y se entrega con FileResponse por trozos.
+
+CSV (`?formato=csv` o `csv.gz`): las filas salen del generador directo a un
+StreamingHttpResponse, sin pasar por openpyxl. Es lo que usan la DT y el
+proveedor de remuneraciones para exportaciones grandes.
+
+Los reportes en segundo plano (`reportes.py`) usan los mismos formatos, pero
+escritos a un archivo temporal con `guardar_xlsx` / `guardar_csv`.
+"""
+import csv
+import io
+import tempfile
+import zlib
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, PatternFill, Alignment, Border, Side
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Hasta este tamaño el archivo queda en memoria; más grande pasa a disco
+SPOOL_MAX_BYTES = 5 * 1024 * 1024
+# Filas que trae la BD por viaje al iterar los querysets de exportación
+CHUNK_FILAS = 2000
+# Filas CSV que se juntan antes de entregarlas al cliente
+FILAS_POR_ENVIO = 500
+FORMATOS = ('xlsx', 'csv', 'csv.gz')
+
+_borde_fino = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+_centrado = Alignment(horizontal='center', vertical='center')
+
+# Estilos compartidos por los reportes (se crean una vez por libro)
+ESTILOS = {
+    'encabezado_gris': dict(font=Font(bold=True), fill=PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")),
+    'encabezado_oscuro': dict(
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="4F4F4F", end_color="4F4F4F", fill_type="solid"),
+        alignment=Alignment(horizontal="center"),
+    ),
+    'encabezado_azul': dict(
+        font=Font(color="FFFFFF", bold=True),
+        fill=PatternFill(start_color="2F75B5", end_color="2F75B5", fill_type="solid"),
+        alignment=Alignment(horizontal='center'),
+    ),
+    'encabezado_dt': dict(
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="003366", end_color="003366", fill_type="solid"),
+        alignment=_centrado,
+        border=_borde_fino,
+    ),
+    'centrado': dict(alignment=_centrado),
+    'marca_entrada': dict(font=Font(color="006600", bold=True), alignment=_centrado),
+    'marca_salida': dict(font=Font(color="990000", bold=True), alignment=_centrado),
+    'hash': dict(font=Font(name='Courier New', size=9, color="555555")),
+}
+
+
+def libro_solo_escritura(titulo, anchos=None):
+    """Devuelve (wb, ws) en modo write_only con los estilos ya registrados."""
+    wb = Workbook(write_only=True)
+    for nombre, atributos in ESTILOS.items():
+        wb.add_named_style(NamedStyle(name=nombre, **atributos))
+
+    ws = wb.create_sheet(titulo)
+    # En write_only los anchos se fijan antes de la primera fila
+    for letra, ancho in (anchos or {}).items():
+        ws.column_dimensions[letra].width = ancho
+    return wb, ws
+
+
+def celda(ws, valor, estilo=None):
+    """Celda con estilo para `ws.append([...])` en modo write_only."""
+    c = WriteOnlyCell(ws, value=valor)
+    if estilo:
+        c.style = estilo
+    return c
+
+
+def encabezados(ws, titulos, estilo):
+    ws.append([celda(ws, titulo, estilo) for titulo in titulos])
+
+
+def guardar_xlsx(wb):
+    """Guarda el libro en un archivo temporal (memoria o disco) listo para leer."""
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    wb.save(archivo)
+    archivo.seek(0)
+    return archivo
+
+
+def respuesta_xlsx(wb, nombre_archivo):
+    """Guarda el libro en un archivo temporal y lo entrega por trozos."""
+    return FileResponse(guardar_xlsx(wb), as_attachment=True, filename=nombre_archivo, content_type=CONTENT_TYPE_XLSX)
+
+
+def formato_solicitado(request):
+    """'xlsx' (por defecto), 'csv' o 'csv.gz' según ?formato=."""
+    formato = request.GET.get('formato', 'xlsx').lower()
+    return formato if formato in FORMATOS else 'xlsx'
+
+
+def _csv_por_trozos(encabezados, filas):
+    """Texto CSV en trozos de FILAS_POR_ENVIO filas (con BOM para que Excel lea los acentos)."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(encabezados)
+
+    for i, fila in enumerate(filas, 1):
+        escritor.writerow(fila)
+        if i % FILAS_POR_ENVIO == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _gzip(trozos):
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 => formato gzip
+    for trozo in trozos:
+        comprimido = compresor.compress(trozo)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def guardar_csv(encabezados, filas, comprimir=False):
+    """Mismo CSV (o .csv.gz) que `respuesta_csv`, escrito a un archivo temporal (reportes en segundo plano)."""
+    trozos = _csv_por_trozos(encabezados, filas)
+    archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for trozo in (_gzip(trozos) if comprimir else trozos):
+        archivo.write(trozo)
+    archivo.seek(0)
+    return archivo
+
+
+def respuesta_csv(nombre_base, encabezados, filas, comprimir=False):
+    """StreamingHttpResponse que va generando el CSV (o .csv.gz) a medida que llegan las filas."""
+    trozos = _csv_por_trozos(encabezados, filas)
+    if comprimir:
+        respuesta = StreamingHttpResponse(_gzip(trozos), content_type='application/gzip')
+        nombre = f"{nombre_base}.csv.gz"
+    else:
+        respuesta = StreamingHttpResponse(trozos, content_type='text/csv; charset=utf-8')
+        nombre = f"{nombre_base}.csv"
+    respuesta['Content-Disposition'] = content_disposition_header(as_attachment=True, filename=nombre)
+    return respuesta
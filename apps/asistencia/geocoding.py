@@ -0,0 +1,204 @@
+"""
+Geocodificación inversa con caché.
+
+Orden de búsqueda: LRU en memoria → tabla DireccionCache → Nominatim.
+Las llamadas a Nominatim pasan por un token-bucket en BD para respetar su
+política de 1 req/s entre todos los workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from geopy.geocoders import Nominatim
+
+from .models import DireccionCache, CuboTokens
+
+
+# 4 decimales ≈ 11 metros: suficiente para distinguir edificios
+PRECISION = getattr(settings, 'GEOCODING_PRECISION', 4)
+TTL = timedelta(days=getattr(settings, 'GEOCODING_TTL_DIAS', 30))
+TAMANO_LRU = getattr(settings, 'GEOCODING_LRU_TAMANO', 1024)
+
+# Política de uso de Nominatim: máximo 1 petición por segundo
+TASA_NOMINATIM = getattr(settings, 'GEOCODING_TASA_POR_SEGUNDO', 1.0)
+ESPERA_MAX_TOKEN = getattr(settings, 'GEOCODING_ESPERA_MAX_SEGUNDOS', 5)
+
+SIN_DIRECCION = "Ubicación no detectada"
+
+
+class LimiteGeocodingExcedido(Exception):
+    """No se obtuvo turno para llamar a Nominatim dentro del tiempo de espera."""
+
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_geolocator = None
+
+ESTADISTICAS = {
+    'hit_memoria': 0,
+    'hit_bd': 0,
+    'miss': 0,
+    'consultas_nominatim': 0,
+    'limitadas': 0,
+}
+
+
+def _contar(nombre):
+    with _lock:
+        ESTADISTICAS[nombre] += 1
+
+
+def estadisticas():
+    """Contadores de este proceso (los aciertos globales quedan en DireccionCache.aciertos)."""
+    with _lock:
+        datos = dict(ESTADISTICAS)
+    aciertos = datos['hit_memoria'] + datos['hit_bd']
+    total = aciertos + datos['miss']
+    datos['tasa_aciertos'] = round(aciertos / total, 3) if total else 0.0
+    return datos
+
+
+def resumen_estadisticas():
+    """Los contadores de este proceso en una línea (logs del worker y admin)."""
+    datos = estadisticas()
+    return (
+        f"Geocoding: {datos['hit_memoria']} memoria, {datos['hit_bd']} BD, {datos['miss']} miss "
+        f"({datos['tasa_aciertos']:.0%} aciertos), {datos['consultas_nominatim']} Nominatim, {datos['limitadas']} limitadas"
+    )
+
+
+def clave_coordenadas(lat, lon):
+    return f"{round(float(lat), PRECISION):.{PRECISION}f},{round(float(lon), PRECISION):.{PRECISION}f}"
+
+
+# =======================================================
+# 1. CACHÉ (memoria + BD)
+# =======================================================
+
+def _lru_get(clave):
+    with _lock:
+        entrada = _lru.get(clave)
+        if entrada is None:
+            return None
+        direccion, expira = entrada
+        if expira < timezone.now():
+            del _lru[clave]
+            return None
+        _lru.move_to_end(clave)
+        return direccion
+
+
+def _lru_set(clave, direccion, actualizado):
+    with _lock:
+        _lru[clave] = (direccion, actualizado + TTL)
+        _lru.move_to_end(clave)
+        while len(_lru) > TAMANO_LRU:
+            _lru.popitem(last=False)
+
+
+def limpiar_memoria():
+    with _lock:
+        _lru.clear()
+
+
+def buscar_en_cache(lat, lon):
+    """Devuelve la dirección si está en caché vigente. Nunca consulta la red."""
+    clave = clave_coordenadas(lat, lon)
+
+    direccion = _lru_get(clave)
+    if direccion is not None:
+        _contar('hit_memoria')
+        return direccion
+
+    registro = DireccionCache.objects.filter(clave=clave, actualizado__gte=timezone.now() - TTL).first()
+    if registro:
+        _contar('hit_bd')
+        DireccionCache.objects.filter(pk=registro.pk).update(aciertos=F('aciertos') + 1)
+        _lru_set(clave, registro.direccion, registro.actualizado)
+        return registro.direccion
+
+    _contar('miss')
+    return None
+
+
+def guardar_en_cache(lat, lon, direccion):
+    clave = clave_coordenadas(lat, lon)
+    ahora = timezone.now()
+    DireccionCache.objects.update_or_create(
+        clave=clave,
+        defaults={
+            'latitud': Decimal(str(round(float(lat), PRECISION))),
+            'longitud': Decimal(str(round(float(lon), PRECISION))),
+            'direccion': direccion[:255],
+            'actualizado': ahora,
+        }
+    )
+    _lru_set(clave, direccion[:255], ahora)
+
+
+# =======================================================
+# 2. LIMITADOR GLOBAL (token bucket en BD)
+# =======================================================
+
+def consumir_token(nombre, tasa, capacidad=1, espera_max=ESPERA_MAX_TOKEN):
+    """
+    Intenta consumir un token del cubo `nombre`, esperando como máximo `espera_max` segundos.
+    La fila se bloquea con select_for_update, así que el límite vale para todos los procesos.
+    """
+    limite = time.monotonic() + espera_max
+
+    while True:
+        with transaction.atomic():
+            cubo, _ = CuboTokens.objects.select_for_update().get_or_create(
+                nombre=nombre, defaults={'tokens': capacidad}
+            )
+            ahora = timezone.now()
+            transcurrido = max((ahora - cubo.actualizado).total_seconds(), 0)
+            cubo.tokens = min(capacidad, cubo.tokens + transcurrido * tasa)
+            cubo.actualizado = ahora
+
+            if cubo.tokens >= 1:
+                cubo.tokens -= 1
+                cubo.save(update_fields=['tokens', 'actualizado'])
+                return True
+
+            cubo.save(update_fields=['tokens', 'actualizado'])
+            espera = (1 - cubo.tokens) / tasa
+
+        if time.monotonic() + espera > limite:
+            return False
+        time.sleep(espera)
+
+
+# =======================================================
+# 3. API PRINCIPAL
+# =======================================================
+
+def _consultar_nominatim(lat, lon):
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="asistencia_perseus_v1", timeout=5)
+    location = _geolocator.reverse(f"{lat}, {lon}", timeout=5)
+    return location.address if location else SIN_DIRECCION
+
+
+def obtener_direccion(lat, lon):
+    """Dirección para unas coordenadas: caché si existe, si no Nominatim (respetando el límite)."""
+    direccion = buscar_en_cache(lat, lon)
+    if direccion is not None:
+        return direccion
+
+    if not consumir_token('nominatim', TASA_NOMINATIM):
+        _contar('limitadas')
+        raise LimiteGeocodingExcedido("Sin turno disponible para Nominatim (1 req/s)")
+
+    _contar('consultas_nominatim')
+    direccion = _consultar_nominatim(lat, lon)
+    guardar_en_cache(lat, lon, direccion)
+    return direccion
@@ -0,0 +1,43 @@
+"""
+Procesamiento de las fotos de marcación antes de subirlas a Cloudinary.
+
+El teléfono envía el frame de la cámara a resolución completa. Aquí se reduce a un
+tamaño máximo, se recomprime, se eliminan los metadatos EXIF (ubicación, modelo
+del teléfono) y se genera la miniatura que usa el panel de la empresa.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+FOTO_MAX_LADO = getattr(settings, 'FOTO_MAX_LADO', 800)
+FOTO_CALIDAD = getattr(settings, 'FOTO_CALIDAD', 75)
+MINIATURA_LADO = getattr(settings, 'FOTO_MINIATURA_LADO', 96)
+MINIATURA_CALIDAD = getattr(settings, 'FOTO_MINIATURA_CALIDAD', 70)
+
+
+def _a_jpeg(imagen, calidad):
+    buffer = BytesIO()
+    # Sin parámetro exif=: el JPEG resultante no lleva metadatos
+    imagen.save(buffer, format='JPEG', quality=calidad, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def procesar_foto(contenido):
+    """
+    Recibe los bytes originales y devuelve (foto_jpeg, miniatura_jpeg).
+    Lanza PIL.UnidentifiedImageError si el contenido no es una imagen.
+    """
+    with Image.open(BytesIO(contenido)) as original:
+        # Aplicamos la orientación EXIF antes de descartar los metadatos
+        imagen = ImageOps.exif_transpose(original)
+        if imagen.mode != 'RGB':
+            imagen = imagen.convert('RGB')
+
+        imagen.thumbnail((FOTO_MAX_LADO, FOTO_MAX_LADO), Image.LANCZOS)
+        foto = _a_jpeg(imagen, FOTO_CALIDAD)
+
+        # Miniatura cuadrada (avatar redondo del panel)
+        miniatura = ImageOps.fit(imagen, (MINIATURA_LADO, MINIATURA_LADO), Image.LANCZOS)
+        return foto, _a_jpeg(miniatura, MINIATURA_CALIDAD)
@@ -0,0 +1,406 @@
+"""
+Carga masiva de trabajadores (`cargar_usuarios`).
+
+Antes cada fila hacía get_or_create de Empresa y User, `set_password` en serie
+(PBKDF2: ~0,3 s por clave) y la señal `crear_o_actualizar_perfil` volvía a
+guardar el Perfil: una nómina de 5.000 personas tardaba más de media hora.
+
+Ahora:
+- La planilla se limpia con pandas, por columnas (no fila por fila).
+- Los usuarios, perfiles y empresas existentes se traen de una vez (una consulta
+  por cada `TAMANO_IN` usernames) y se comparan en memoria: cada fila queda como
+  nueva, con cambios (campo por campo) o sin cambios.
+- Las claves iniciales se hashean en un pool de procesos (PBKDF2 usa CPU).
+- User y Perfil se escriben con bulk_create / bulk_update, sin señales, por lotes
+  de `TAMANO_LOTE` filas, cada lote en su transacción. Volver a cargar la misma
+  planilla no escribe nada (todo queda "sin cambios").
+
+La nómina que se sube en `/rrhh/importar-nomina/` usa el mismo camino, pero en
+el worker (`ImportacionNomina`, tarea IMPORTAR_NOMINA): el Excel se lee en modo
+read_only (fila a fila, sin cargar el libro entero) y primero se simula, para
+mostrar los conteos y la diferencia por campo antes de confirmar.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, time as dt_time
+from itertools import islice
+
+import openpyxl
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Empresa, Perfil, ImportacionNomina, TareaPendiente, clave_contexto_empresa
+from .procesos import inicializar_proceso
+
+
+CAMPOS_USUARIO = ('email', 'first_name', 'last_name')
+CAMPOS_PERFIL = ('empresa_id', 'rut', 'cargo', 'hora_entrada', *Perfil.DIAS_TURNO)
+COLUMNAS_EMAIL = ('email', 'correo', 'mail')
+
+TAMANO_LOTE = 1000
+# Límite prudente de parámetros por consulta (SQLite antiguo admite 999)
+TAMANO_IN = 900
+# Procesos para hashear claves (por defecto, todos los núcleos)
+PROCESOS = getattr(settings, 'IMPORTACION_PROCESOS', None) or os.cpu_count() or 1
+# Con pocas claves no vale la pena levantar el pool
+MIN_CLAVES_POOL = 20
+# Filas nuevas o con cambios que se guardan para mostrar en la simulación
+MAX_DIFERENCIAS = 500
+
+
+def _trozos(filas, tamano):
+    """Listas de hasta `tamano` elementos; sirve también para iteradores (streaming)."""
+    filas = iter(filas)
+    while trozo := list(islice(filas, tamano)):
+        yield trozo
+
+
+# =======================================================
+# 1. LIMPIEZA DE LA PLANILLA (pandas)
+# =======================================================
+
+def limpiar_planilla(df):
+    """
+    DataFrame de `cargar_usuarios` (RUT, Nombres, Apellidos, Empresa, Cargo, Email/Correo)
+    → (filas, descartes). Cada fila es un dict con username (= RUT), clave_inicial
+    (4 primeros caracteres del RUT) y los campos que trae la planilla. Se descartan
+    las filas sin RUT y los RUT repetidos (vale la última aparición).
+    """
+    import pandas as pd
+
+    df = df.rename(columns=lambda columna: str(columna).strip())
+    col_email = next((c for c in df.columns if c.lower() in COLUMNAS_EMAIL), None)
+
+    def texto(columna):
+        if columna not in df:
+            return pd.Series('', index=df.index, dtype='string')
+        return df[columna].astype('string').str.strip().fillna('').replace({'nan': '', 'None': ''})
+
+    limpio = pd.DataFrame({
+        'username': texto('RUT'),
+        'first_name': texto('Nombres'),
+        'last_name': texto('Apellidos'),
+        'empresa': texto('Empresa'),
+        'cargo': texto('Cargo'),
+    })
+    if col_email:  # Sin columna de correo no se borran los que ya existen
+        limpio['email'] = texto(col_email)
+
+    sin_rut = limpio['username'] == ''
+    limpio = limpio[~sin_rut]
+    duplicados = limpio.duplicated('username', keep='last')
+    limpio = limpio[~duplicados]
+    limpio = limpio.assign(rut=limpio['username'], clave_inicial=limpio['username'].str[:4])
+
+    filas = limpio.to_dict('records')
+    for fila in filas:
+        if not fila['empresa']:
+            del fila['empresa']  # Sin empresa en la planilla se mantiene la del perfil
+    return filas, {'sin_rut': int(sin_rut.sum()), 'duplicados': int(duplicados.sum())}
+
+
+def resolver_empresas(filas):
+    """Cambia el nombre de la empresa de cada fila por su id, creando las que falten. Devuelve cuántas creó."""
+    nombres = {fila['empresa'] for fila in filas if 'empresa' in fila}
+    ids = {}
+    for trozo in _trozos(sorted(nombres), TAMANO_IN):
+        for empresa_id, nombre in Empresa.objects.filter(nombre__in=trozo).order_by('id').values_list('id', 'nombre'):
+            ids.setdefault(nombre, empresa_id)  # Si hay homónimas, la más antigua (como get_or_create)
+
+    nuevas = [Empresa(nombre=nombre) for nombre in sorted(nombres - ids.keys())]
+    Empresa.objects.bulk_create(nuevas)
+    ids.update({empresa.nombre: empresa.id for empresa in nuevas})
+
+    for fila in filas:
+        if 'empresa' in fila:
+            fila['empresa_id'] = ids[fila.pop('empresa')]
+    return len(nuevas)
+
+
+# =======================================================
+# 2. PLAN: nuevos / con cambios / sin cambios
+# =======================================================
+
+class Plan:
+    """Resultado de comparar las filas con la BD, antes de escribir nada."""
+
+    def __init__(self):
+        self.nuevos = []       # filas
+        self.cambios = []      # (user, perfil o None, fila, {campo: (antes, después)})
+        self.sin_cambios = 0
+
+    def campos_cambiados(self):
+        """Counter {campo: filas en que cambia}, para el resumen."""
+        return Counter(campo for _, _, _, diferencias in self.cambios for campo in diferencias)
+
+
+def planificar(filas):
+    """Compara cada fila con su usuario y perfil actuales (traídos en bloque)."""
+    filas = list({fila['username']: fila for fila in filas}.values())  # Repetidas en el lote: vale la última
+    usuarios = {}
+    for trozo in _trozos([fila['username'] for fila in filas], TAMANO_IN):
+        usuarios.update({user.username: user for user in User.objects.filter(username__in=trozo)})
+    perfiles = {}
+    for trozo in _trozos([user.id for user in usuarios.values()], TAMANO_IN):
+        perfiles.update({perfil.usuario_id: perfil for perfil in Perfil.objects.filter(usuario_id__in=trozo)})
+
+    plan = Plan()
+    for fila in filas:
+        user = usuarios.get(fila['username'])
+        if user is None:
+            plan.nuevos.append(fila)
+            continue
+
+        perfil = perfiles.get(user.id)
+        diferencias = {
+            campo: (getattr(user, campo), fila[campo])
+            for campo in CAMPOS_USUARIO if campo in fila and getattr(user, campo) != fila[campo]
+        }
+        diferencias.update({
+            campo: (getattr(perfil, campo, None), fila[campo])
+            for campo in CAMPOS_PERFIL if campo in fila and (perfil is None or getattr(perfil, campo) != fila[campo])
+        })
+        if diferencias or perfil is None:
+            plan.cambios.append((user, perfil, fila, diferencias))
+        else:
+            plan.sin_cambios += 1
+    return plan
+
+
+# =======================================================
+# 3. ESCRITURA
+# =======================================================
+
+def hashear(claves, pool=None):
+    """make_password de cada clave, en el pool si hay uno y vale la pena."""
+    if pool is None or len(claves) < MIN_CLAVES_POOL:
+        return [make_password(clave) for clave in claves]
+    return list(pool.map(make_password, claves, chunksize=16))
+
+
+def _perfil(user, fila):
+    return Perfil(usuario=user, **{campo: fila[campo] for campo in CAMPOS_PERFIL if campo in fila})
+
+
+def aplicar(plan, pool=None):
+    """
+    Escribe el plan en una transacción con bulk_create / bulk_update. Las señales de
+    User y Perfil no corren: el perfil se crea aquí y el caché de contexto se limpia a mano.
+    """
+    # El hash (lo lento) va antes de abrir la transacción
+    claves = hashear([fila['clave_inicial'] for fila in plan.nuevos], pool)
+
+    nuevos = [
+        User(username=fila['username'], password=clave, **{campo: fila[campo] for campo in CAMPOS_USUARIO if campo in fila})
+        for fila, clave in zip(plan.nuevos, claves)
+    ]
+    campos_usuario = sorted({campo for _, _, _, dif in plan.cambios for campo in dif if campo in CAMPOS_USUARIO})
+    campos_perfil = sorted({campo for _, _, _, dif in plan.cambios for campo in dif if campo in CAMPOS_PERFIL})
+
+    usuarios_cambiados, perfiles_cambiados, perfiles_nuevos = [], [], []
+    for user, perfil, fila, diferencias in plan.cambios:
+        for campo in diferencias:
+            destino = user if campo in CAMPOS_USUARIO else perfil
+            if destino is not None:
+                setattr(destino, campo, fila[campo])
+        if any(campo in CAMPOS_USUARIO for campo in diferencias):
+            usuarios_cambiados.append(user)
+        if perfil is None:
+            perfiles_nuevos.append(_perfil(user, fila))
+        elif any(campo in CAMPOS_PERFIL for campo in diferencias):
+            perfiles_cambiados.append(perfil)
+
+    with transaction.atomic():
+        User.objects.bulk_create(nuevos, batch_size=500)
+        # Perfil con cambiar_pass_inicial=True (por defecto): la clave inicial es parte del RUT
+        perfiles_nuevos += [_perfil(user, fila) for user, fila in zip(nuevos, plan.nuevos)]
+        Perfil.objects.bulk_create(perfiles_nuevos, batch_size=500)
+        if usuarios_cambiados and campos_usuario:
+            User.objects.bulk_update(usuarios_cambiados, campos_usuario, batch_size=500)
+        if perfiles_cambiados and campos_perfil:
+            Perfil.objects.bulk_update(perfiles_cambiados, campos_perfil, batch_size=500)
+
+    # Lo que haría la señal `invalidar_contexto_perfil`
+    cache.delete_many([clave_contexto_empresa(perfil.usuario_id) for perfil in perfiles_nuevos + perfiles_cambiados])
+
+
+def _json(valor):
+    if isinstance(valor, dt_time):
+        return valor.strftime('%H:%M')
+    return valor
+
+
+def muestra_diferencias(plan, limite):
+    """Hasta `limite` filas del plan para mostrar: {username, accion, campos: {campo: [antes, después]}}."""
+    muestra = []
+    for fila in plan.nuevos[:limite]:
+        campos = {campo: [None, _json(fila[campo])] for campo in CAMPOS_USUARIO + CAMPOS_PERFIL if campo in fila}
+        muestra.append({'username': fila['username'], 'accion': 'CREAR', 'campos': campos})
+    for user, _, _, diferencias in plan.cambios[:max(limite - len(muestra), 0)]:
+        campos = {campo: [_json(antes), _json(despues)] for campo, (antes, despues) in diferencias.items()}
+        muestra.append({'username': user.username, 'accion': 'ACTUALIZAR', 'campos': campos})
+    return muestra
+
+
+def importar(filas, procesos=None, tamano_lote=TAMANO_LOTE, avance=None, simular=False, total=None):
+    """
+    Planifica y aplica las filas por lotes (cada lote en su transacción: una falla a
+    mitad deja lo anterior guardado, y volver a correr sigue desde ahí). `filas`
+    puede ser un iterador: solo hay un lote en memoria a la vez.
+    Con `simular` no se escribe nada y el resumen trae una muestra de `diferencias`.
+    `avance(hechas, total)` se llama después de cada lote. Devuelve el resumen.
+    """
+    procesos = procesos or PROCESOS
+    resumen = {'creados': 0, 'actualizados': 0, 'sin_cambios': 0, 'campos': Counter(), 'diferencias': []}
+    if total is None:
+        total = len(filas)
+
+    # El executor levanta sus procesos recién al primer hash: si no hay nuevos, no cuesta nada
+    usar_pool = procesos > 1 and not simular and total >= MIN_CLAVES_POOL
+    hechas = 0
+    with (ProcessPoolExecutor(max_workers=procesos, initializer=inicializar_proceso) if usar_pool else nullcontext()) as pool:
+        for lote in _trozos(filas, tamano_lote):
+            plan = planificar(lote)
+            if simular:
+                resumen['diferencias'] += muestra_diferencias(plan, MAX_DIFERENCIAS - len(resumen['diferencias']))
+            else:
+                aplicar(plan, pool)
+            resumen['creados'] += len(plan.nuevos)
+            resumen['actualizados'] += len(plan.cambios)
+            resumen['sin_cambios'] += plan.sin_cambios
+            resumen['campos'].update(plan.campos_cambiados())
+            hechas += len(lote)
+            if avance:
+                avance(hechas, total)
+    return resumen
+
+
+# =======================================================
+# 4. NÓMINA SUBIDA POR LA WEB (worker)
+# =======================================================
+
+def _es_si(valor):
+    return str(valor).upper().strip() in ['SI', 'S', 'YES', '1', 'TRUE']
+
+
+def _hora(valor):
+    """Excel a veces devuelve time, datetime o texto "09:00". None si no se entiende."""
+    if isinstance(valor, datetime):
+        return valor.time()
+    if isinstance(valor, dt_time):
+        return valor
+    if isinstance(valor, str):
+        try:
+            horas, minutos = map(int, valor.strip().split(':')[:2])
+            return dt_time(horas, minutos)
+        except ValueError:
+            return None
+    return None
+
+
+def fila_de_nomina(row, empresa_id=None):
+    """
+    Fila del Excel de la nómina (username, email, nombres, apellidos, rut, cargo,
+    hora_entrada, lunes ... domingo) → fila de `planificar`. None si no trae username.
+    """
+    row = tuple(row) + (None,) * (14 - len(row))
+    if not row[0]:
+        return None
+
+    texto = [str(valor).strip() if valor else "" for valor in row[:6]]
+    username, email, first_name, last_name, rut, cargo = texto
+    fila = {
+        'username': username, 'email': email, 'first_name': first_name, 'last_name': last_name,
+        'rut': rut, 'cargo': cargo,
+        # Contraseña inicial: el RUT (sin puntos ni guion) o '123456'
+        'clave_inicial': rut.replace(".", "").replace("-", "") if rut else "123456",
+    }
+    fila.update({dia: _es_si(valor) for dia, valor in zip(Perfil.DIAS_TURNO, row[7:14])})
+    hora_entrada = _hora(row[6])
+    if hora_entrada:  # Si no viene o no se entiende, se mantiene la del perfil
+        fila['hora_entrada'] = hora_entrada
+    if empresa_id:
+        fila['empresa_id'] = empresa_id
+    return fila
+
+
+def _informar_avance(importacion, tarea, hechas, total):
+    ahora = timezone.now()
+    progreso = min(99, int(hechas * 100 / total)) if total else 0
+    ImportacionNomina.objects.filter(pk=importacion.pk).update(filas_procesadas=hechas, progreso=progreso, updated_at=ahora)
+    # Latido: que otro worker no la retome por timeout mientras sigue avanzando
+    TareaPendiente.objects.filter(pk=tarea.pk).update(updated_at=ahora)
+
+
+def procesar(tarea):
+    """Manejador de la tarea IMPORTAR_NOMINA (ver `tareas.MANEJADORES`): simula o aplica la nómina."""
+    importacion = ImportacionNomina.objects.get(pk=tarea.datos['importacion_id'])
+    if importacion.estado in ('ANALIZADA', 'COMPLETADA'):
+        return
+
+    importacion.estado = 'ANALIZANDO' if importacion.simular else 'APLICANDO'
+    importacion.progreso = importacion.filas_procesadas = 0
+    importacion.save(update_fields=['estado', 'progreso', 'filas_procesadas', 'updated_at'])
+
+    try:
+        with importacion.archivo.open('rb') as archivo:
+            # read_only: las filas se leen del XML a medida que se piden
+            wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+            try:
+                ws = wb.active
+                total = max(ws.max_row - 1, 0) if ws.max_row else None  # Dimensión declarada en el archivo
+                importacion.filas_total = total
+                filas = (
+                    fila for fila in (fila_de_nomina(row, importacion.empresa_id) for row in ws.iter_rows(min_row=2, values_only=True))
+                    if fila
+                )
+                resumen = importar(
+                    filas, simular=importacion.simular, total=total or 0, tamano_lote=TAMANO_LOTE,
+                    avance=lambda hechas, total: _informar_avance(importacion, tarea, hechas, total),
+                )
+            finally:
+                wb.close()
+    except Exception as e:
+        # La tarea se reintenta con backoff (lo ya aplicado queda "sin cambios"); solo falla con el último intento
+        importacion.estado = 'FALLIDA' if tarea.intentos >= tarea.max_intentos else 'PENDIENTE'
+        importacion.error = f"{type(e).__name__}: {e}"
+        importacion.save(update_fields=['estado', 'error', 'updated_at'])
+        raise
+
+    importacion.diferencias = resumen.pop('diferencias')
+    importacion.resumen = {**resumen, 'campos': dict(resumen['campos'])}
+    importacion.filas_procesadas = resumen['creados'] + resumen['actualizados'] + resumen['sin_cambios']
+    importacion.estado = 'ANALIZADA' if importacion.simular else 'COMPLETADA'
+    importacion.progreso = 100
+    importacion.error = None
+    importacion.terminado_en = timezone.now()
+    importacion.save(update_fields=[
+        'diferencias', 'resumen', 'filas_total', 'filas_procesadas', 'estado', 'progreso', 'error', 'terminado_en', 'updated_at',
+    ])
+
+
+def solicitar(usuario, empresa, archivo, simular=True):
+    """Guarda el Excel y encola su procesamiento. Devuelve la ImportacionNomina."""
+    with transaction.atomic():
+        importacion = ImportacionNomina.objects.create(
+            empresa=empresa, solicitado_por=usuario, archivo=archivo, nombre_archivo=archivo.name, simular=simular,
+        )
+        TareaPendiente.objects.create(tipo='IMPORTAR_NOMINA', datos={'importacion_id': importacion.id})
+    return importacion
+
+
+def confirmar(importacion):
+    """Después de revisar la simulación: encola la importación de verdad. False si no estaba ANALIZADA."""
+    with transaction.atomic():
+        confirmada = ImportacionNomina.objects.filter(pk=importacion.pk, estado='ANALIZADA').update(
+            simular=False, estado='PENDIENTE', progreso=0, filas_procesadas=0, updated_at=timezone.now(),
+        )
+        if confirmada:
+            TareaPendiente.objects.create(tipo='IMPORTAR_NOMINA', datos={'importacion_id': importacion.id})
+    return bool(confirmada)
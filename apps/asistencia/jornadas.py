@@ -0,0 +1,90 @@
+"""
+Reconstrucción masiva de `JornadaDiaria`.
+
+En la operación normal cada marca recalcula solo su día (ver `Marcacion.save`).
+Para datos históricos o después de cargas directas a la BD, `reconstruir`
+recorre las marcas vigentes una sola vez, ordenadas por trabajador y hora,
+arma cada día en memoria y las inserta por lotes con bulk_create.
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Marcacion, JornadaDiaria
+
+
+LOTE = 1000
+
+
+def _jornadas(marcas):
+    """Agrupa (trabajador_id, tipo, timestamp, es_manual) contiguos por trabajador y día local."""
+    actual, del_dia = None, []
+    for trabajador_id, tipo, timestamp, es_manual in marcas:
+        clave = (trabajador_id, timezone.localtime(timestamp).date())
+        if clave != actual:
+            if del_dia:
+                yield JornadaDiaria(trabajador_id=actual[0], fecha=actual[1], **JornadaDiaria.resumir(del_dia))
+            actual, del_dia = clave, []
+        del_dia.append((tipo, timestamp, es_manual))
+
+    if del_dia:
+        yield JornadaDiaria(trabajador_id=actual[0], fecha=actual[1], **JornadaDiaria.resumir(del_dia))
+
+
+def insertar(marcas, lote=LOTE):
+    """Arma e inserta las jornadas de `marcas` (queryset de marcas vigentes) por lotes."""
+    filas = marcas.order_by('trabajador_id', 'timestamp', 'id').values_list(
+        'trabajador_id', 'tipo', 'timestamp', 'es_manual'
+    ).iterator(chunk_size=5000)
+
+    total = 0
+    pendientes = []
+    for jornada in _jornadas(filas):
+        pendientes.append(jornada)
+        if len(pendientes) >= lote:
+            JornadaDiaria.objects.bulk_create(pendientes)
+            total += len(pendientes)
+            pendientes = []
+    if pendientes:
+        JornadaDiaria.objects.bulk_create(pendientes)
+        total += len(pendientes)
+    return total
+
+
+def reconstruir(desde=None, hasta=None, empresa_id=None, lote=LOTE):
+    """
+    Borra y vuelve a generar las jornadas entre `desde` y `hasta` (fechas locales,
+    ambas inclusive y opcionales). Devuelve cuántas jornadas quedaron.
+    """
+    marcas = Marcacion.objects.filter(estado='VIGENTE')
+    jornadas = JornadaDiaria.objects.all()
+
+    if desde:
+        marcas = marcas.filter(timestamp__gte=JornadaDiaria.rango_dia(desde)[0])
+        jornadas = jornadas.filter(fecha__gte=desde)
+    if hasta:
+        marcas = marcas.filter(timestamp__lt=JornadaDiaria.rango_dia(hasta)[1])
+        jornadas = jornadas.filter(fecha__lte=hasta)
+    if empresa_id:
+        marcas = marcas.filter(trabajador__perfil__empresa_id=empresa_id)
+        jornadas = jornadas.filter(trabajador__perfil__empresa_id=empresa_id)
+
+    with transaction.atomic():
+        jornadas.delete()
+        return insertar(marcas, lote=lote)
+
+
+def rango_fechas(desde, hasta, dias_defecto=30):
+    """
+    Fechas (date) de un filtro 'YYYY-MM-DD' de los paneles. Sin filtro válido
+    se muestran los últimos `dias_defecto` días.
+    """
+    try:
+        return (
+            datetime.strptime(desde, '%Y-%m-%d').date(),
+            datetime.strptime(hasta, '%Y-%m-%d').date(),
+        )
+    except (TypeError, ValueError):
+        hoy = timezone.localdate()
+        return hoy - timedelta(days=dias_defecto), hoy
@@ -0,0 +1,289 @@
+"""
+Libro de Asistencia en PDF (WeasyPrint).
+
+Antes cada clic cargaba todas las marcas históricas del trabajador, leía el
+logo con `empresa.logo.path` (acceso al storage remoto, o error) y volvía a
+renderizar todo. Ahora:
+- El libro es de un periodo (por defecto el mes en curso).
+- El logo se copia una vez a un directorio local y WeasyPrint lo lee de disco.
+- La configuración de fuentes de WeasyPrint se crea una vez por proceso.
+- El PDF queda en el storage con una clave (trabajador, periodo, resumen de
+  las marcas del periodo, logo): mientras no haya marcas nuevas, borradas o
+  geocodificadas, la descarga repetida sale del storage sin renderizar. Al
+  generar una versión nueva se borran las anteriores del mismo periodo, y
+  `limpiar_libros` borra las de periodos viejos.
+
+A fin de mes `generar_libros_empresa` arma los libros de toda la empresa en un
+pool de procesos (WeasyPrint usa CPU, no I/O) y los junta en un ZIP.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import Count, Max
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Marcacion, JornadaDiaria, Empresa
+from .procesos import inicializar_proceso
+
+
+logger = logging.getLogger(__name__)
+
+# Copias locales de los logos (no hace falta respaldarlas: se vuelven a bajar)
+CACHE_DIR = Path(getattr(settings, 'LIBROS_CACHE_DIR', Path(tempfile.gettempdir()) / 'asistencia_libros'))
+CARPETA_STORAGE = 'libros'
+# Procesos para los libros de toda la empresa (por defecto, todos los núcleos)
+PROCESOS = getattr(settings, 'LIBROS_PROCESOS', None) or os.cpu_count() or 1
+
+_fuentes = None
+
+
+def _configuracion_fuentes():
+    """FontConfiguration compartida: fontconfig no se re-escanea en cada PDF."""
+    global _fuentes
+    if _fuentes is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _fuentes = FontConfiguration()
+    return _fuentes
+
+
+def logo_local(empresa):
+    """
+    URI file:// de una copia local del logo (se descarga del storage solo la
+    primera vez). Si el storage no responde, el libro sale sin logo.
+    """
+    if not empresa or not empresa.logo:
+        return None
+
+    nombre = empresa.logo.name
+    extension = os.path.splitext(nombre)[1].lower() or '.png'
+    destino = CACHE_DIR / 'logos' / f"{hashlib.sha1(nombre.encode('utf-8')).hexdigest()}{extension}"
+
+    if not destino.exists():
+        temporal = None
+        try:
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            with empresa.logo.open('rb') as origen:
+                contenido = origen.read()
+            # Escritura atómica: otro proceso nunca ve un logo a medias
+            with tempfile.NamedTemporaryFile(dir=destino.parent, delete=False) as temporal:
+                temporal.write(contenido)
+            os.replace(temporal.name, destino)
+        except Exception as e:
+            logger.warning("No se pudo copiar el logo de %s: %s", empresa, e)
+            if temporal is not None:
+                Path(temporal.name).unlink(missing_ok=True)  # Sin copias a medias en el caché
+            return None
+
+    return destino.as_uri()
+
+
+def resumen_marcas(marcas):
+    """
+    Resumen barato de un conjunto de marcas: cambia si se agrega o borra una, o si
+    el geocoder completa su dirección (lo hace con update(), sin mover la cadena).
+    """
+    return marcas.order_by().aggregate(total=Count('id'), ultima=Max('id'), con_direccion=Count('direccion'))
+
+
+def _marcas_del_periodo(desde, hasta, **filtro):
+    inicio, fin = JornadaDiaria.rango_dia(desde)[0], JornadaDiaria.rango_dia(hasta)[1]
+    return Marcacion.objects.filter(timestamp__gte=inicio, timestamp__lt=fin, **filtro)
+
+
+def clave_libro(usuario, empresa, desde, hasta):
+    """Cambia si cambian las marcas del periodo o si la empresa cambia de logo."""
+    marcas = resumen_marcas(_marcas_del_periodo(desde, hasta, trabajador=usuario))
+    logo = empresa.logo.name if empresa and empresa.logo else ''
+    datos = (
+        f"{usuario.id}|{desde}|{hasta}|{marcas['total']}|{marcas['ultima']}|{marcas['con_direccion']}"
+        f"|{empresa.id if empresa else ''}|{logo}"
+    )
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+
+def renderizar(usuario, empresa, desde, hasta):
+    """PDF (bytes) del Libro de Asistencia del trabajador entre `desde` y `hasta` (fechas locales)."""
+    from weasyprint import HTML
+
+    marcas = (
+        _marcas_del_periodo(desde, hasta, trabajador=usuario)
+        .only('timestamp', 'tipo', 'direccion', 'latitud', 'longitud', 'hash_actual')
+        .order_by('timestamp')
+    )
+    contexto = {
+        'marcas': marcas,
+        'usuario': usuario,
+        'fecha_generacion': timezone.localtime(timezone.now()),
+        'empresa': empresa,
+        'logo_path': logo_local(empresa),
+        'desde': desde,
+        'hasta': hasta,
+    }
+    html_string = render_to_string('reportes/libro_asistencia.html', contexto)
+    return HTML(string=html_string).write_pdf(font_config=_configuracion_fuentes())
+
+
+def _carpeta_libro(usuario_id, desde, hasta):
+    return f"{CARPETA_STORAGE}/{usuario_id}/{desde:%Y%m%d}_{hasta:%Y%m%d}"
+
+
+def obtener_pdf(usuario, empresa, desde, hasta):
+    """
+    Ruta en el storage del libro del periodo; lo renderiza solo si no existe uno
+    con la misma clave. Devuelve (ruta, reutilizado).
+    """
+    carpeta = _carpeta_libro(usuario.id, desde, hasta)
+    ruta = f"{carpeta}/{clave_libro(usuario, empresa, desde, hasta)}.pdf"
+    if default_storage.exists(ruta):
+        return ruta, True
+
+    contenido = renderizar(usuario, empresa, desde, hasta)
+    ruta = default_storage.save(ruta, ContentFile(contenido))
+    _borrar_versiones_anteriores(carpeta, ruta)
+    return ruta, False
+
+
+def _borrar_versiones_anteriores(carpeta, vigente):
+    """Las versiones anteriores del libro del mismo periodo ya no se van a servir."""
+    try:
+        _, archivos = default_storage.listdir(carpeta)
+    except (NotImplementedError, OSError):
+        return
+    for nombre in archivos:
+        ruta = f"{carpeta}/{nombre}"
+        if ruta != vigente:
+            default_storage.delete(ruta)
+
+
+def limpiar_cache(hasta_antes_de):
+    """
+    Borra del storage los libros en caché de periodos que terminaron antes de
+    `hasta_antes_de` (y los del formato anterior, sin carpeta de periodo). Se
+    regeneran si alguien los vuelve a pedir. Devuelve cuántos archivos borró.
+    """
+    borrados = 0
+    try:
+        usuarios, _ = default_storage.listdir(CARPETA_STORAGE)
+    except (NotImplementedError, OSError):
+        return borrados
+
+    for usuario in usuarios:
+        if not usuario.isdigit():
+            continue  # libros/zip/ son salidas de generar_libros, no caché
+        carpeta_usuario = f"{CARPETA_STORAGE}/{usuario}"
+        periodos, sueltos = default_storage.listdir(carpeta_usuario)
+        viejos = [f"{carpeta_usuario}/{nombre}" for nombre in sueltos]
+
+        for periodo in periodos:
+            try:
+                fin = datetime.strptime(periodo.rsplit('_', 1)[-1], '%Y%m%d').date()
+            except ValueError:
+                continue
+            if fin < hasta_antes_de:
+                carpeta = f"{carpeta_usuario}/{periodo}"
+                viejos += [f"{carpeta}/{nombre}" for nombre in default_storage.listdir(carpeta)[1]]
+
+        for ruta in viejos:
+            default_storage.delete(ruta)
+        borrados += len(viejos)
+
+    return borrados
+
+
+def nombre_archivo(usuario, desde, hasta):
+    return f"asistencia_{usuario.username}_{desde:%Y%m%d}_{hasta:%Y%m%d}.pdf"
+
+
+# =======================================================
+# LIBROS DE TODA LA EMPRESA (pool de procesos + ZIP)
+# =======================================================
+
+def libro_de_trabajador(usuario_id, empresa_id, desde, hasta):
+    """
+    Unidad de trabajo del pool (argumentos simples, se pasan entre procesos).
+    Devuelve (usuario_id, ruta, reutilizado, error); un libro que falla no corta el resto.
+    """
+    try:
+        usuario = User.objects.select_related('perfil').get(pk=usuario_id)
+        empresa = Empresa.objects.get(pk=empresa_id)
+        ruta, reutilizado = obtener_pdf(usuario, empresa, desde, hasta)
+        return usuario_id, ruta, reutilizado, None
+    except Exception as e:
+        return usuario_id, None, False, f"{type(e).__name__}: {e}"
+
+
+def _nombre_en_zip(usuario):
+    rut = getattr(usuario.perfil, 'rut', None) or usuario.username
+    return get_valid_filename(f"{rut} {usuario.get_full_name()}".strip()) + ".pdf"
+
+
+def generar_libros_empresa(empresa, desde, hasta, procesos=None, avance=None):
+    """
+    Libros del periodo de todos los trabajadores activos de la empresa.
+    `avance(hechos, total)` se llama a medida que terminan. Devuelve un dict con
+    el ZIP (archivo temporal), su nombre sugerido y los totales.
+    """
+    trabajadores = list(
+        User.objects.filter(perfil__empresa=empresa, is_active=True)
+        .select_related('perfil')
+        .order_by('last_name', 'first_name', 'id')
+    )
+    argumentos = [(t.id, empresa.id, desde, hasta) for t in trabajadores]
+    procesos = procesos or PROCESOS
+    total = len(argumentos)
+
+    resultados = {}
+    if procesos > 1 and total > 1:
+        connections.close_all()  # Los procesos hijos abren sus propias conexiones
+        with ProcessPoolExecutor(max_workers=procesos, initializer=inicializar_proceso) as pool:
+            for hechos, resultado in enumerate(pool.map(libro_de_trabajador, *zip(*argumentos), chunksize=4), 1):
+                resultados[resultado[0]] = resultado
+                if avance:
+                    avance(hechos, total)
+    else:
+        for hechos, args in enumerate(argumentos, 1):
+            resultado = libro_de_trabajador(*args)
+            resultados[resultado[0]] = resultado
+            if avance:
+                avance(hechos, total)
+
+    # Los PDF ya vienen comprimidos: ZIP_STORED solo los empaqueta (sin gastar CPU)
+    archivo = tempfile.SpooledTemporaryFile(max_size=20 * 1024 * 1024)
+    errores = []
+    with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_STORED) as zf:
+        for trabajador in trabajadores:
+            _, ruta, _, error = resultados[trabajador.id]
+            if error:
+                errores.append({'trabajador_id': trabajador.id, 'nombre': trabajador.get_full_name(), 'error': error})
+                continue
+            with default_storage.open(ruta, 'rb') as pdf:
+                zf.writestr(_nombre_en_zip(trabajador), pdf.read())
+    archivo.seek(0)
+
+    return {
+        'archivo': archivo,
+        'nombre': get_valid_filename(f"Libros_Asistencia_{empresa.nombre}_{desde:%Y%m%d}_{hasta:%Y%m%d}.zip"),
+        'total': total,
+        'reutilizados': sum(1 for r in resultados.values() if r[2]),
+        'errores': errores,
+    }
+
+
+def huella_empresa(empresa, desde, hasta):
+    """Resumen de las marcas del periodo de toda la empresa + logo: cambia con cualquier marca nueva, borrada o geocodificada."""
+    marcas = resumen_marcas(_marcas_del_periodo(desde, hasta, trabajador__perfil__empresa=empresa))
+    logo = empresa.logo.name if empresa.logo else ''
+    return hashlib.sha256(f"{logo}|{marcas['total']}|{marcas['ultima']}|{marcas['con_direccion']}".encode('utf-8')).hexdigest()
@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.asistencia import planificador
+
+class Command(BaseCommand):
+    help = 'Scheduler de alertas y olvidos de salida: ticks incrementales con lease en la BD (un solo nodo por trabajo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Un tick de cada trabajo y termina (ignora los intervalos)')
+        parser.add_argument('--trabajos', nargs='*', default=list(planificador.TRABAJOS),
+                            help=f"Trabajos a ejecutar (por defecto: {' '.join(planificador.TRABAJOS)})")
+        parser.add_argument('--intervalo-alertas', type=int, default=planificador.INTERVALOS['revisar_alertas'],
+                            help='Segundos entre revisiones de alertas')
+        parser.add_argument('--intervalo-olvidos', type=int, default=planificador.INTERVALOS['detectar_olvidos'],
+                            help='Segundos entre revisiones de olvidos de salida')
+        parser.add_argument('--pulso', type=float, default=15, help='Segundos entre consultas de "¿ya me toca?"')
+
+    def handle(self, *args, **kwargs):
+        trabajos = kwargs['trabajos']
+        desconocidos = set(trabajos) - set(planificador.TRABAJOS)
+        if desconocidos:
+            raise CommandError(f"Trabajos desconocidos: {', '.join(sorted(desconocidos))}")
+
+        intervalos = {
+            'revisar_alertas': kwargs['intervalo_alertas'],
+            'detectar_olvidos': kwargs['intervalo_olvidos'],
+        }
+        una_vez = kwargs['una_vez']
+        dueno = planificador.identidad()
+
+        self.stdout.write(self.style.WARNING(f"⏳ Scheduler iniciado ({dueno}): {', '.join(trabajos)}"))
+
+        ticks = 0
+        try:
+            while True:
+                for nombre in trabajos:
+                    try:
+                        resultado = planificador.ejecutar(nombre, dueno, intervalo=None if una_vez else intervalos[nombre])
+                    except Exception as e:
+                        self.stderr.write(f"❌ {nombre}: {type(e).__name__}: {e}")
+                        continue
+
+                    if resultado is None:
+                        if una_vez:
+                            self.stdout.write(f"🔒 {nombre}: lo está ejecutando otro nodo")
+                        continue
+
+                    resumen, cronometro = resultado
+                    ticks += 1
+                    fases = " | ".join(f"{fase}: {segundos:.2f}s" for fase, segundos in cronometro.fases.items())
+                    self.stdout.write(f"{nombre}: {resumen} ({fases})")
+
+                if una_vez:
+                    break
+                time.sleep(kwargs['pulso'])
+        except KeyboardInterrupt:
+            self.stdout.write("Deteniendo scheduler...")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Scheduler detenido. {ticks} ticks ejecutados."))
@@ -1,91 +1,45 @@
 import pandas as pd
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from apps.asistencia.models import Perfil, Empresa
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from apps.asistencia import importacion
 
 class Command(BaseCommand):
-    help = 'Carga o Actualiza usuarios desde Excel'
+    help = 'Carga o Actualiza usuarios desde Excel (carga masiva: se puede volver a correr sin duplicar)'
 
     def add_arguments(self, parser):
         parser.add_argument('excel_file', type=str, help='Ruta al archivo Excel')
+        parser.add_argument('--procesos', type=int, default=importacion.PROCESOS,
+                            help='Procesos para hashear las claves iniciales (por defecto, todos los núcleos)')
+        parser.add_argument('--lote', type=int, default=importacion.TAMANO_LOTE,
+                            help='Filas por transacción')
 
     def handle(self, *args, **kwargs):
         ruta_archivo = kwargs['excel_file']
         self.stdout.write(self.style.WARNING(f'Procesando: {ruta_archivo}...'))
 
         try:
-            # Leemos el Excel
-            df = pd.read_excel(ruta_archivo)
-            # Limpiamos nombres de columnas (quita espacios al inicio/final)
-            df.columns = df.columns.str.strip()
-            
-            # Buscamos la columna del email (acepta Email, email, Correo, CORREO)
-            col_email = next((col for col in df.columns if col.lower() in ['email', 'correo', 'mail']), None)
-
-            total_procesados = 0
-            
-            with transaction.atomic():
-                for index, row in df.iterrows():
-                    
-                    rut = str(row.get('RUT', '')).strip()
-                    nombres = str(row.get('Nombres', '')).strip()
-                    apellidos = str(row.get('Apellidos', '')).strip()
-                    nombre_empresa = str(row.get('Empresa', '')).strip()
-                    cargo = str(row.get('Cargo', '')).strip()
-                    
-                    # Obtenemos el email si existe la columna, sino vacío
-                    email = str(row.get(col_email, '')).strip() if col_email else ''
-                    if email == 'nan': email = ''
-
-                    if not rut or rut == 'nan': continue
-
-                    # 1. Gestionar la Empresa
-                    empresa_obj, _ = Empresa.objects.get_or_create(nombre=nombre_empresa)
-
-                    # 2. CREAR O ACTUALIZAR USUARIO
-                    # get_or_create devuelve el objeto y un booleano (True si fue creado recién)
-                    user, created = User.objects.get_or_create(username=rut)
-
-                    # Actualizamos SIEMPRE los datos (sea nuevo o viejo)
-                    user.email = email
-                    user.first_name = nombres
-                    user.last_name = apellidos
-                    
-                    # Solo si es NUEVO asignamos la contraseña inicial
-                    if created:
-                        user.set_password(rut[:4])
-                        accion = "CREADO"
-                    else:
-                        accion = "ACTUALIZADO"
-                    
-                    user.save()
-
-                    # 3. Actualizar el Perfil
-                    # Gracias a tu señal en models.py, el perfil ya existe. Lo traemos:
-                    if hasattr(user, 'perfil'):
-                        perfil = user.perfil
-                        perfil.empresa = empresa_obj
-                        perfil.cargo = cargo
-                        perfil.rut = rut
-                        
-                        if accion == "NUEVO": # Solo si es nuevo
-                            perfil.cambiar_pass_inicial = True # <--- FORZAMOS EL CAMBIO
-                        
-                        perfil.save()
-                    
-                    total_procesados += 1
-                    msg = f'{accion}: {nombres} {apellidos} - {email}'
-                    
-                    if created:
-                        self.stdout.write(self.style.SUCCESS(msg))
-                    else:
-                        self.stdout.write(self.style.WARNING(msg))
-                    
-                    
-
-            self.stdout.write(self.style.SUCCESS(f'-----------------------------------'))
-            self.stdout.write(self.style.SUCCESS(f'¡LISTO! Se procesaron {total_procesados} usuarios.'))
-
+            # Todo como texto: un RUT numérico no se convierte en 12345678.0
+            df = pd.read_excel(ruta_archivo, dtype=str)
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error: {str(e)}'))
\ No newline at end of file
+            raise CommandError(f'No se pudo leer el archivo: {e}')
+
+        filas, descartes = importacion.limpiar_planilla(df)
+        empresas_creadas = importacion.resolver_empresas(filas)
+
+        def avance(hechas, total):
+            self.stdout.write(f'  {hechas}/{total} filas...')
+
+        resumen = importacion.importar(filas, procesos=kwargs['procesos'], tamano_lote=kwargs['lote'], avance=avance)
+
+        self.stdout.write(self.style.SUCCESS(f'-----------------------------------'))
+        self.stdout.write(self.style.SUCCESS(f"CREADOS: {resumen['creados']}"))
+        self.stdout.write(self.style.WARNING(f"ACTUALIZADOS: {resumen['actualizados']}"))
+        self.stdout.write(f"SIN CAMBIOS: {resumen['sin_cambios']}")
+        if resumen['campos']:
+            self.stdout.write("Campos cambiados: " + ", ".join(f"{campo} ({n})" for campo, n in resumen['campos'].most_common()))
+        if empresas_creadas:
+            self.stdout.write(f"Empresas nuevas: {empresas_creadas}")
+        if descartes['sin_rut'] or descartes['duplicados']:
+            self.stdout.write(self.style.WARNING(
+                f"Filas omitidas: {descartes['sin_rut']} sin RUT, {descartes['duplicados']} con RUT repetido (vale la última)"
+            ))
+        self.stdout.write(self.style.SUCCESS(f'¡LISTO! Se procesaron {len(filas)} usuarios.'))
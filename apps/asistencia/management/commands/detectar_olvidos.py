@@ -1,73 +1,40 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.core.mail import send_mail
-from apps.asistencia.models import Marcacion
-from datetime import timedelta
+from apps.asistencia import alertas, correo, planificador
 
 class Command(BaseCommand):
     help = 'Detecta trabajadores que marcaron entrada pero no salida'
 
-    def handle(self, *args, **kwargs):
-        now = timezone.now()
-        # Definimos el límite: Si pasaron más de 10 horas desde la entrada
-        # (9 horas de jornada + 1 hora de colación/extra)
-        LIMITE_HORAS = 10 
-
-        # 1. Buscamos todas las ENTRADAS de hoy que NO tengan alerta enviada
-        entradas_hoy = Marcacion.objects.filter(
-            tipo='ENTRADA',
-            timestamp__date=now.date(),
-            alerta_olvido_enviada=False
-        )
-
-        count = 0
-        for entrada in entradas_hoy:
-            # 2. Calculamos cuánto tiempo ha pasado
-            tiempo_transcurrido = now - entrada.timestamp
-            horas_pasadas = tiempo_transcurrido.total_seconds() / 3600
-
-            if horas_pasadas > LIMITE_HORAS:
-                # 3. Verificamos si existe una SALIDA posterior a esa entrada
-                salida_existe = Marcacion.objects.filter(
-                    trabajador=entrada.trabajador,
-                    tipo='SALIDA',
-                    timestamp__gt=entrada.timestamp # Que sea DESPUÉS de la entrada
-                ).exists()
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=1, help='Días hacia atrás a revisar (1 = solo hoy)')
+        parser.add_argument('--horas-extra', type=int, default=alertas.MARGEN_OLVIDO_HORAS,
+                            help='Horas sobre la jornada pactada antes de avisar (jornada 9 + 1 = 10 horas)')
+        parser.add_argument('--enviar', action='store_true', help='Despacha ahora la bandeja de correos (sin esperar al worker)')
 
-                if not salida_existe:
-                    # ¡OLVIDO DETECTADO! 🚨
-                    self.enviar_alerta(entrada)
-                    count += 1
-
-        self.stdout.write(self.style.SUCCESS(f'Proceso terminado. Se enviaron {count} alertas.'))
-
-    def enviar_alerta(self, entrada):
-        trabajador = entrada.trabajador
-        empresa = trabajador.perfil.empresa.nombre if hasattr(trabajador, 'perfil') else "Empresa"
-        
-        asunto = f"⚠️ Alerta de Asistencia: Sin marca de salida - {trabajador.get_full_name()}"
-        mensaje = f"""
-        Estimado/a,
-        
-        El trabajador {trabajador.get_full_name()} marcó ENTRADA a las {entrada.timestamp.strftime('%H:%M')}, 
-        pero han pasado más de 10 horas y no se registra su SALIDA.
-        
-        Por favor, verificar si se trata de un olvido o una hora extra extensa.
-        
-        Saludos,
-        Sistema de Asistencia {empresa}
-        """
+    def handle(self, *args, **kwargs):
+        # Si el scheduler (u otro cron) está revisando, no nos pisamos
+        dueno = planificador.identidad()
+        if planificador.tomar_lease('detectar_olvidos', dueno) is None:
+            self.stdout.write(self.style.WARNING("🔒 Otra detección de olvidos está en curso. Se omite esta."))
+            return
 
+        cronometro = alertas.Cronometro()
         try:
-            # Enviar correo (puedes poner el email del jefe aquí)
-            destinatarios = [trabajador.email] # Agrega el mail del jefe a la lista
-            
-            send_mail(asunto, mensaje, None, destinatarios)
-            
-            # Marcar como enviada para no repetir
-            entrada.alerta_olvido_enviada = True
-            entrada.save()
-            print(f"📧 Correo enviado a {trabajador.email}")
-            
-        except Exception as e:
-            print(f"Error enviando correo a {trabajador.email}: {e}")
\ No newline at end of file
+            entradas, empresas = alertas.avisar_olvidos(dias=kwargs['dias'], horas_extra=kwargs['horas_extra'], cronometro=cronometro)
+        finally:
+            planificador.soltar_lease('detectar_olvidos', dueno)
+
+        for entrada in entradas:
+            self.stdout.write(f"📧 Olvido de salida: {entrada.trabajador.username} ({timezone.localtime(entrada.timestamp):%d/%m %H:%M})")
+
+        enviados, con_error = 0, 0
+        if kwargs['enviar'] and entradas:
+            with cronometro.fase('envio'):
+                enviados, con_error = correo.enviar_pendientes(limite=len(entradas) + empresas)
+
+        fases = " | ".join(f"{fase}: {segundos:.2f}s" for fase, segundos in cronometro.fases.items())
+        self.stdout.write(f"⏱️  {fases}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Proceso terminado. {len(entradas)} entradas sin salida en {empresas} empresas '
+            f'({enviados} correos enviados ahora, {con_error} con error).'
+        ))
@@ -0,0 +1,56 @@
+import shutil
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.asistencia import libros, reportes
+from apps.asistencia.models import Empresa
+
+class Command(BaseCommand):
+    help = 'Genera el Libro de Asistencia PDF de todos los trabajadores de una empresa (pool de procesos) y un ZIP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa', type=int, required=True, help='ID de la empresa')
+        parser.add_argument('--mes', type=str, help='Mes YYYY-MM (por defecto el mes en curso)')
+        parser.add_argument('--procesos', type=int, default=libros.PROCESOS, help='Procesos en paralelo (1 = sin pool)')
+        parser.add_argument('--salida', type=str, help='Ruta local del ZIP (por defecto se guarda en el storage, en libros/zip/)')
+
+    def handle(self, *args, **kwargs):
+        try:
+            empresa = Empresa.objects.get(pk=kwargs['empresa'])
+        except Empresa.DoesNotExist:
+            raise CommandError(f"No existe la empresa {kwargs['empresa']}")
+
+        if kwargs['mes']:
+            periodo = reportes.parsear_mes(kwargs['mes'])
+            if not periodo:
+                raise CommandError("El mes debe tener formato YYYY-MM")
+        else:
+            periodo = reportes.mes_actual()
+        desde, hasta = periodo
+
+        inicio = timezone.now()
+        self.stderr.write(f"⏳ Generando libros de {empresa.nombre} ({desde} al {hasta}) con {kwargs['procesos']} procesos...")
+
+        def avance(hechos, total):
+            if hechos % 50 == 0 or hechos == total:
+                self.stderr.write(f"   {hechos}/{total} libros")
+
+        resultado = libros.generar_libros_empresa(empresa, desde, hasta, procesos=kwargs['procesos'], avance=avance)
+
+        with resultado['archivo'] as archivo:
+            if kwargs['salida']:
+                with open(kwargs['salida'], 'wb') as destino:
+                    shutil.copyfileobj(archivo, destino)
+                ruta = kwargs['salida']
+            else:
+                ruta = default_storage.save(f"{libros.CARPETA_STORAGE}/zip/{resultado['nombre']}", File(archivo))
+
+        for error in resultado['errores']:
+            self.stderr.write(self.style.ERROR(f"❌ {error['nombre']} (#{error['trabajador_id']}): {error['error']}"))
+
+        segundos = (timezone.now() - inicio).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resultado['total'] - len(resultado['errores'])}/{resultado['total']} libros "
+            f"({resultado['reutilizados']} sin cambios) en {segundos:.1f}s → {ruta}"
+        ))
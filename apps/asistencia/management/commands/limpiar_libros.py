@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.asistencia import libros
+
+class Command(BaseCommand):
+    help = 'Borra del storage los Libros de Asistencia PDF en caché de periodos viejos (se regeneran si se vuelven a pedir)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=90,
+                            help='Borra los libros de periodos que terminaron hace más de N días')
+
+    def handle(self, *args, **kwargs):
+        limite = timezone.localdate() - timedelta(days=kwargs['dias'])
+        self.stdout.write(self.style.WARNING(f"⏳ Borrando libros en caché de periodos terminados antes del {limite}..."))
+
+        borrados = libros.limpiar_cache(limite)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {borrados} libros borrados."))
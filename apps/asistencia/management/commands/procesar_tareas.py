@@ -0,0 +1,65 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.asistencia import tareas, geocoding, correo, planificador
+
+# Cada cuánto el worker publica sus contadores (EstadoTrabajo 'procesar_tareas')
+PUBLICAR_CADA = 60
+
+class Command(BaseCommand):
+    help = 'Worker del outbox: geocodifica, sube fotos, arma comprobantes y despacha la bandeja de correos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa lo pendiente y termina (modo cron)')
+        parser.add_argument('--intervalo', type=float, default=2, help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--lote', type=int, default=20, help='Tareas reservadas por ciclo')
+        parser.add_argument('--tipos', nargs='*', help='Solo procesa estos tipos (ej: GEOCODIFICAR SUBIR_FOTO)')
+        parser.add_argument('--lote-correos', type=int, default=50, help='Correos enviados por conexión SMTP en cada ciclo')
+        parser.add_argument('--sin-correos', action='store_true', help='No despacha la bandeja de correos (otro worker lo hace)')
+
+    def handle(self, *args, **kwargs):
+        una_vez = kwargs['una_vez']
+        intervalo = kwargs['intervalo']
+        lote = kwargs['lote']
+        tipos = kwargs['tipos']
+        lote_correos = kwargs['lote_correos']
+        sin_correos = kwargs['sin_correos']
+
+        self.stdout.write(self.style.WARNING("⏳ Worker de tareas iniciado..."))
+
+        total_ok, total_error, total_correos = 0, 0, 0
+        publicado = time.monotonic()
+        try:
+            while True:
+                completadas, con_error = tareas.procesar_pendientes(limite=lote, tipos=tipos)
+                total_ok += completadas
+                total_error += con_error
+
+                if completadas or con_error:
+                    self.stdout.write(f"Lote: {completadas} completadas, {con_error} con error (se reintentarán)")
+
+                enviados, correos_error = 0, 0
+                if not sin_correos:
+                    enviados, correos_error = correo.enviar_pendientes(limite=lote_correos)
+                    total_correos += enviados
+                    if enviados or correos_error:
+                        self.stdout.write(f"Correos: {enviados} enviados, {correos_error} con error (se reintentarán)")
+
+                if time.monotonic() - publicado >= PUBLICAR_CADA:
+                    self._publicar(total_ok, total_error, total_correos)
+                    publicado = time.monotonic()
+
+                # Colas vacías (o lotes incompletos): en modo cron terminamos, si no esperamos
+                if completadas + con_error < lote and enviados + correos_error < lote_correos:
+                    if una_vez:
+                        break
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write("Deteniendo worker...")
+
+        self._publicar(total_ok, total_error, total_correos)
+        self.stdout.write(self.style.SUCCESS(f"✅ Worker detenido. {total_ok} tareas completadas, {total_error} con error, {total_correos} correos enviados."))
+
+    def _publicar(self, total_ok, total_error, total_correos):
+        resumen = f"{total_ok} tareas, {total_error} con error, {total_correos} correos | {geocoding.resumen_estadisticas()}"
+        planificador.publicar_estado('procesar_tareas', resumen)
+        self.stdout.write(resumen)
@@ -0,0 +1,25 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from apps.asistencia import clima
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla AnimoDiario (clima laboral) desde las marcas con ánimo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=str, help='Fecha inicial YYYY-MM-DD (por defecto, desde la primera marca)')
+        parser.add_argument('--hasta', type=str, help='Fecha final YYYY-MM-DD (por defecto, hasta la última marca)')
+        parser.add_argument('--empresa', type=int, help='ID de empresa a reconstruir (por defecto todas)')
+
+    def handle(self, *args, **kwargs):
+        try:
+            desde = datetime.strptime(kwargs['desde'], '%Y-%m-%d').date() if kwargs['desde'] else None
+            hasta = datetime.strptime(kwargs['hasta'], '%Y-%m-%d').date() if kwargs['hasta'] else None
+        except ValueError:
+            raise CommandError("Las fechas deben tener formato YYYY-MM-DD")
+
+        inicio = timezone.now()
+        total = clima.reconstruir(desde, hasta, empresa_id=kwargs['empresa'])
+        segundos = (timezone.now() - inicio).total_seconds()
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} contadores de ánimo reconstruidos en {segundos:.1f}s"))
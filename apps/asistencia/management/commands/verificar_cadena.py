@@ -0,0 +1,93 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from apps.asistencia.models import Marcacion, Perfil, VerificacionCadena
+from apps.asistencia.procesos import inicializar_proceso
+from apps.asistencia.verificacion import verificar_trabajador
+
+class Command(BaseCommand):
+    help = 'Verifica la cadena de hash de las marcas (incremental, en paralelo) y genera un reporte JSON de rupturas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=4, help='Procesos en paralelo (1 = sin pool)')
+        parser.add_argument('--empresa', type=int, help='ID de empresa a verificar (por defecto todas)')
+        parser.add_argument('--desde-cero', action='store_true', help='Ignora los checkpoints y re-verifica todo')
+        parser.add_argument('--salida', type=str, help='Archivo donde escribir el reporte JSON (por defecto stdout)')
+
+    def handle(self, *args, **kwargs):
+        inicio = timezone.now()
+
+        # 1. Trabajadores con marcas (y su checkpoint, si existe)
+        marcas = Marcacion.objects.all()
+        if kwargs['empresa']:
+            marcas = marcas.filter(trabajador__perfil__empresa_id=kwargs['empresa'])
+        trabajadores = list(marcas.order_by().values_list('trabajador_id', flat=True).distinct())
+
+        checkpoints = {}
+        if not kwargs['desde_cero']:
+            checkpoints = {c.trabajador_id: c for c in VerificacionCadena.objects.filter(trabajador_id__in=trabajadores)}
+
+        argumentos = [
+            (
+                tid,
+                checkpoints[tid].ultima_marca_id if tid in checkpoints else 0,
+                checkpoints[tid].ultimo_hash if tid in checkpoints else "GENESIS_BLOCK",
+            )
+            for tid in trabajadores
+        ]
+        self.stderr.write(f"⏳ Verificando {len(argumentos)} trabajadores con {kwargs['procesos']} procesos...")
+
+        # 2. Verificar (cada trabajador es independiente)
+        if kwargs['procesos'] > 1 and len(argumentos) > 1:
+            connections.close_all()  # Los procesos hijos abren sus propias conexiones
+            with ProcessPoolExecutor(max_workers=kwargs['procesos'], initializer=inicializar_proceso) as pool:
+                resultados = list(pool.map(verificar_trabajador, *zip(*argumentos), chunksize=8))
+        else:
+            resultados = [verificar_trabajador(*a) for a in argumentos]
+
+        # 3. Guardar checkpoints y armar reporte
+        ruts = dict(Perfil.objects.filter(usuario_id__in=trabajadores).values_list('usuario_id', 'rut'))
+        rupturas = []
+        total_verificadas = 0
+
+        for r in resultados:
+            total_verificadas += r['verificadas']
+            for ruptura in r['rupturas']:
+                rupturas.append({'trabajador_id': r['trabajador_id'], 'rut': ruts.get(r['trabajador_id']), **ruptura})
+
+            if r['verificadas']:
+                previo = checkpoints.get(r['trabajador_id'])
+                VerificacionCadena.objects.update_or_create(
+                    trabajador_id=r['trabajador_id'],
+                    defaults={
+                        'ultima_marca_id': r['ultima_marca_id'],
+                        'ultimo_hash': r['ultimo_hash'],
+                        'marcas_verificadas': (previo.marcas_verificadas if previo else 0) + r['verificadas'],
+                        'rupturas': (previo.rupturas if previo else 0) + len(r['rupturas']),
+                        'verificado_en': timezone.now(),
+                    }
+                )
+
+        reporte = {
+            'generado': timezone.localtime(inicio).isoformat(),
+            'segundos': round((timezone.now() - inicio).total_seconds(), 2),
+            'incremental': not kwargs['desde_cero'],
+            'trabajadores': len(argumentos),
+            'marcas_verificadas': total_verificadas,
+            'total_rupturas': len(rupturas),
+            'rupturas': rupturas,
+        }
+
+        contenido = json.dumps(reporte, ensure_ascii=False, indent=2)
+        if kwargs['salida']:
+            with open(kwargs['salida'], 'w', encoding='utf-8') as f:
+                f.write(contenido)
+        else:
+            self.stdout.write(contenido)
+
+        if rupturas:
+            self.stderr.write(self.style.ERROR(f"🚨 {len(rupturas)} rupturas en la cadena ({total_verificadas} marcas verificadas)."))
+        else:
+            self.stderr.write(self.style.SUCCESS(f"✅ Cadena íntegra: {total_verificadas} marcas nuevas verificadas."))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0007_alter_marcacion_foto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TareaPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('GEOCODIFICAR', 'Obtener Dirección (GPS)'), ('SUBIR_FOTO', 'Subir Foto'), ('ENVIAR_COMPROBANTE', 'Enviar Comprobante por Correo')], max_length=30)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida (Sin más reintentos)')], default='PENDIENTE', max_length=15)),
+                ('datos', models.JSONField(blank=True, default=dict)),
+                ('archivo', models.BinaryField(blank=True, help_text='Contenido binario temporal (ej: foto antes de subirla)', null=True)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('max_intentos', models.PositiveIntegerField(default=5)),
+                ('ejecutar_desde', models.DateTimeField(default=django.utils.timezone.now, help_text='No se procesa antes de esta hora (backoff)')),
+                ('ultimo_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tareas', to='asistencia.marcacion')),
+            ],
+            options={
+                'verbose_name': 'Tarea Pendiente',
+                'verbose_name_plural': 'Tareas Pendientes (Outbox)',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['estado', 'ejecutar_desde'], name='tarea_estado_ejecutar_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0008_tareapendiente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CuboTokens',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('tokens', models.FloatField(default=1)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DireccionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(help_text='Lat/Lon redondeadas, ej: -33.4489,-70.6693', max_length=40, unique=True)),
+                ('latitud', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('longitud', models.DecimalField(decimal_places=7, max_digits=10)),
+                ('direccion', models.CharField(max_length=255)),
+                ('aciertos', models.PositiveIntegerField(default=0, help_text='Veces que se evitó una consulta a Nominatim')),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Dirección en Caché',
+                'verbose_name_plural': 'Caché de Direcciones (Geocoding)',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0009_direccioncache_cubotokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marcacion',
+            name='clave_idempotencia',
+            field=models.CharField(blank=True, editable=False, help_text='UUID generado por el teléfono para marcas offline (evita duplicados al reintentar)', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='marcacion',
+            constraint=models.UniqueConstraint(fields=('trabajador', 'clave_idempotencia'), name='marca_clave_idempotencia_unica'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0010_marcacion_clave_idempotencia'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CadenaMarcas',
+            fields=[
+                ('trabajador', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cadena_marcas', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('ultimo_hash', models.CharField(default='GENESIS_BLOCK', max_length=64)),
+                ('ultimo_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_tipo', models.CharField(blank=True, max_length=20)),
+                ('ultima_entrada', models.DateTimeField(blank=True, help_text='Para validar que la SALIDA no sea anterior', null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cabeza de Cadena de Marcas',
+                'verbose_name_plural': 'Cabezas de Cadena de Marcas',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0011_cadenamarcas'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificacionCadena',
+            fields=[
+                ('trabajador', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='verificacion_cadena', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('ultima_marca_id', models.BigIntegerField(default=0)),
+                ('ultimo_hash', models.CharField(default='GENESIS_BLOCK', max_length=64)),
+                ('marcas_verificadas', models.PositiveIntegerField(default=0)),
+                ('rupturas', models.PositiveIntegerField(default=0)),
+                ('verificado_en', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Verificación de Cadena',
+                'verbose_name_plural': 'Verificaciones de Cadena',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:01
+
+import cloudinary_storage.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0012_verificacioncadena'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marcacion',
+            name='miniatura',
+            field=models.ImageField(blank=True, help_text='Versión pequeña de la foto para los listados', null=True, storage=cloudinary_storage.storage.MediaCloudinaryStorage(), upload_to='marcas/miniaturas/%Y/%m/'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0013_marcacion_miniatura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorreoSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asunto', models.CharField(max_length=255)),
+                ('remitente', models.CharField(blank=True, help_text='Vacío = DEFAULT_FROM_EMAIL', max_length=255, null=True)),
+                ('destinatario', models.EmailField(help_text='Destinatario principal (se usa para el límite por destinatario)', max_length=254)),
+                ('copia', models.JSONField(blank=True, default=list, help_text='Direcciones en copia (ej: RRHH)')),
+                ('cuerpo_texto', models.TextField()),
+                ('cuerpo_html', models.TextField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido (Sin más reintentos)')], default='PENDIENTE', max_length=15)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('max_intentos', models.PositiveIntegerField(default=5)),
+                ('ejecutar_desde', models.DateTimeField(default=django.utils.timezone.now, help_text='No se envía antes de esta hora (backoff / límite)')),
+                ('ultimo_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('enviado_en', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Correo Saliente',
+                'verbose_name_plural': 'Correos Salientes (Outbox)',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['estado', 'ejecutar_desde'], name='correo_estado_ejecutar_idx'), models.Index(fields=['destinatario', 'enviado_en'], name='correo_destinatario_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def _resumir(del_dia):
+    """Campos de la jornada a partir de (tipo, timestamp, es_manual) del día, ordenados por hora."""
+    datos = {
+        'entrada': None, 'inicio_colacion': None, 'fin_colacion': None, 'salida': None,
+        'segundos_trabajados': 0, 'segundos_colacion': 0, 'total_marcas': 0,
+        'doble_entrada': False, 'tiene_manual': False, 'abierta': False, 'ultima_marca': None,
+    }
+    for tipo, timestamp, es_manual in del_dia:
+        datos['total_marcas'] += 1
+        datos['tiene_manual'] = datos['tiene_manual'] or es_manual
+        datos['ultima_marca'] = timestamp
+        if tipo == 'ENTRADA':
+            if datos['entrada'] is None:
+                datos['entrada'] = timestamp
+            if datos['abierta']:
+                datos['doble_entrada'] = True
+            datos['abierta'] = True
+        elif tipo == 'INICIO_COLACION':
+            datos['inicio_colacion'] = timestamp
+        elif tipo == 'FIN_COLACION':
+            datos['fin_colacion'] = timestamp
+        elif tipo == 'SALIDA':
+            datos['salida'] = timestamp
+            datos['abierta'] = False
+
+    if datos['entrada'] and datos['salida']:
+        datos['segundos_trabajados'] = max(0, int((datos['salida'] - datos['entrada']).total_seconds()))
+    if datos['inicio_colacion'] and datos['fin_colacion']:
+        datos['segundos_colacion'] = max(0, int((datos['fin_colacion'] - datos['inicio_colacion']).total_seconds()))
+    return datos
+
+
+def rellenar_jornadas(apps, schema_editor):
+    """
+    Jornadas de las marcas que ya existen: los reportes leen solo de esta tabla.
+    Autocontenida (igual que `jornadas.insertar` al crear la tabla) para no depender
+    del código actual de los modelos.
+    """
+    Marcacion = apps.get_model('asistencia', 'Marcacion')
+    JornadaDiaria = apps.get_model('asistencia', 'JornadaDiaria')
+
+    filas = (
+        Marcacion.objects.filter(estado='VIGENTE')
+        .order_by('trabajador_id', 'timestamp', 'id')
+        .values_list('trabajador_id', 'tipo', 'timestamp', 'es_manual')
+        .iterator(chunk_size=5000)
+    )
+
+    pendientes = []
+    actual, del_dia = None, []
+    for trabajador_id, tipo, timestamp, es_manual in filas:
+        clave = (trabajador_id, timezone.localtime(timestamp).date())
+        if clave != actual:
+            if del_dia:
+                pendientes.append(JornadaDiaria(trabajador_id=actual[0], fecha=actual[1], **_resumir(del_dia)))
+                if len(pendientes) >= 1000:
+                    JornadaDiaria.objects.bulk_create(pendientes)
+                    pendientes = []
+            actual, del_dia = clave, []
+        del_dia.append((tipo, timestamp, es_manual))
+    if del_dia:
+        pendientes.append(JornadaDiaria(trabajador_id=actual[0], fecha=actual[1], **_resumir(del_dia)))
+
+    JornadaDiaria.objects.bulk_create(pendientes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0014_correosaliente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JornadaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('entrada', models.DateTimeField(blank=True, help_text='Primera ENTRADA del día', null=True)),
+                ('inicio_colacion', models.DateTimeField(blank=True, null=True)),
+                ('fin_colacion', models.DateTimeField(blank=True, null=True)),
+                ('salida', models.DateTimeField(blank=True, help_text='Última SALIDA del día', null=True)),
+                ('segundos_trabajados', models.PositiveIntegerField(default=0, help_text='Bruto: Salida - Entrada')),
+                ('segundos_colacion', models.PositiveIntegerField(default=0)),
+                ('total_marcas', models.PositiveSmallIntegerField(default=0)),
+                ('doble_entrada', models.BooleanField(default=False, help_text='Dos ENTRADAS sin SALIDA entre medio')),
+                ('tiene_manual', models.BooleanField(default=False, help_text='Incluye marcas manuales o rectificadas')),
+                ('abierta', models.BooleanField(default=False, help_text='Última ENTRADA sin SALIDA posterior')),
+                ('ultima_marca', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('trabajador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jornadas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Jornada Diaria',
+                'verbose_name_plural': 'Jornadas Diarias',
+                'indexes': [models.Index(fields=['fecha'], name='jornada_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('trabajador', 'fecha'), name='jornada_trabajador_fecha_unica')],
+            },
+        ),
+        migrations.RunPython(rellenar_jornadas, migrations.RunPython.noop),
+    ]
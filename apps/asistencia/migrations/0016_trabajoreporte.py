@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0015_jornadadiaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tareapendiente',
+            name='tipo',
+            field=models.CharField(choices=[('GEOCODIFICAR', 'Obtener Dirección (GPS)'), ('SUBIR_FOTO', 'Subir Foto'), ('ENVIAR_COMPROBANTE', 'Enviar Comprobante por Correo'), ('GENERAR_REPORTE', 'Generar Reporte')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='TrabajoReporte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('REMUNERACIONES', 'Pre-Nómina (Remuneraciones)'), ('FISCALIZACION', 'Reporte Fiscalización DT'), ('LIBRO_PDF', 'Libro de Asistencia (PDF)')], max_length=20)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=15)),
+                ('parametros', models.JSONField(blank=True, default=dict, help_text='Filtros: desde, hasta, formato...')),
+                ('huella', models.CharField(max_length=64)),
+                ('progreso', models.PositiveSmallIntegerField(default=0, help_text='0 a 100')),
+                ('archivo', models.FileField(blank=True, null=True, upload_to='reportes/%Y/%m/')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reportes', to='asistencia.empresa')),
+                ('solicitado_por', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reportes_solicitados', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Reporte',
+                'verbose_name_plural': 'Trabajos de Reportes',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['empresa', 'tipo', 'huella'], name='reporte_huella_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0016_trabajoreporte'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajoreporte',
+            name='tipo',
+            field=models.CharField(choices=[('REMUNERACIONES', 'Pre-Nómina (Remuneraciones)'), ('FISCALIZACION', 'Reporte Fiscalización DT'), ('LIBRO_PDF', 'Libro de Asistencia (PDF)'), ('LIBROS_EMPRESA', 'Libros de Asistencia de la Empresa (ZIP)')], max_length=20),
+        ),
+    ]
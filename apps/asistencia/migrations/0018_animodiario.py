@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def rellenar_animos(apps, schema_editor):
+    """Contadores de las marcas con ánimo que ya existen: el gráfico de clima lee solo de esta tabla."""
+    Marcacion = apps.get_model('asistencia', 'Marcacion')
+    AnimoDiario = apps.get_model('asistencia', 'AnimoDiario')
+
+    # Igual que `clima.reconstruir`: día local (TruncDate usa America/Santiago) y cargo actual
+    filas = (
+        Marcacion.objects.filter(animo__isnull=False, trabajador__perfil__empresa__isnull=False)
+        .annotate(dia=TruncDate('timestamp'))
+        .values_list('trabajador__perfil__empresa_id', 'dia', 'trabajador__perfil__cargo', 'animo')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    AnimoDiario.objects.bulk_create([
+        AnimoDiario(empresa_id=empresa, fecha=dia, cargo=cargo or '', animo=animo, total=total)
+        for empresa, dia, cargo, animo, total in filas
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0017_trabajoreporte_libros_empresa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnimoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cargo', models.CharField(blank=True, help_text='Cargo del trabajador al marcar', max_length=100)),
+                ('animo', models.CharField(choices=[('FELIZ', 'Feliz'), ('NEUTRAL', 'Neutral'), ('MOLESTO', 'Molesto/Triste')], max_length=10)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='animos', to='asistencia.empresa')),
+            ],
+            options={
+                'verbose_name': 'Ánimo Diario',
+                'verbose_name_plural': 'Ánimos Diarios',
+                'indexes': [models.Index(fields=['fecha'], name='animo_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('empresa', 'fecha', 'cargo', 'animo'), name='animo_empresa_fecha_cargo_unico')],
+            },
+        ),
+        migrations.RunPython(rellenar_animos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0018_animodiario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='marcacion',
+            index=models.Index(fields=['trabajador', 'timestamp'], name='marca_trabajador_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='marcacion',
+            index=models.Index(fields=['trabajador', 'tipo', 'timestamp'], name='marca_trab_tipo_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='marcacion',
+            index=models.Index(fields=['timestamp', 'id'], name='marca_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:37
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def borrar_alertas_duplicadas(apps, schema_editor):
+    """Deja solo la primera alerta de cada (trabajador, fecha, tipo) antes de crear la restricción."""
+    LogAlerta = apps.get_model('asistencia', 'LogAlerta')
+    primeras = (
+        LogAlerta.objects.values('trabajador', 'fecha', 'tipo')
+        .annotate(primera=Min('id'))
+        .values_list('primera', flat=True)
+    )
+    LogAlerta.objects.exclude(id__in=list(primeras)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0019_indices_marcacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logalerta',
+            name='fecha',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(borrar_alertas_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='logalerta',
+            constraint=models.UniqueConstraint(fields=('trabajador', 'fecha', 'tipo'), name='alerta_trabajador_fecha_tipo_unica'),
+        ),
+    ]
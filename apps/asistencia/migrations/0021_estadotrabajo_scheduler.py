@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0020_logalerta_unica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoTrabajo',
+            fields=[
+                ('nombre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('marca_hasta', models.BigIntegerField(default=0, help_text='Id de la última marca ya procesada')),
+                ('revisado_hasta', models.DateTimeField(blank=True, help_text='Hora hasta la que se evaluaron los umbrales', null=True)),
+                ('dueno', models.CharField(blank=True, help_text='Nodo que tiene (o tuvo) el lease, ej: host:pid', max_length=100)),
+                ('lease_hasta', models.DateTimeField(blank=True, help_text='Vacío o vencido = libre', null=True)),
+                ('ultima_ejecucion', models.DateTimeField(blank=True, null=True)),
+                ('ultima_duracion', models.FloatField(blank=True, help_text='Segundos', null=True)),
+                ('ultimo_resumen', models.CharField(blank=True, max_length=255)),
+                ('ultimo_error', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Estado de Trabajo Programado',
+                'verbose_name_plural': 'Estados de Trabajos Programados',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='perfil',
+            index=models.Index(fields=['hora_entrada'], name='perfil_hora_entrada_idx'),
+        ),
+    ]
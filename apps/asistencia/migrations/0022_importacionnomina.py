@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0021_estadotrabajo_scheduler'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tareapendiente',
+            name='tipo',
+            field=models.CharField(choices=[('GEOCODIFICAR', 'Obtener Dirección (GPS)'), ('SUBIR_FOTO', 'Subir Foto'), ('ENVIAR_COMPROBANTE', 'Enviar Comprobante por Correo'), ('GENERAR_REPORTE', 'Generar Reporte'), ('IMPORTAR_NOMINA', 'Importar Nómina')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='ImportacionNomina',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.FileField(upload_to='importaciones/%Y/%m/')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255)),
+                ('simular', models.BooleanField(default=True, help_text='Solo calcula los cambios, sin guardar')),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('ANALIZANDO', 'Analizando (simulación)'), ('ANALIZADA', 'Analizada: esperando confirmación'), ('APLICANDO', 'Aplicando cambios'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='PENDIENTE', max_length=15)),
+                ('progreso', models.PositiveSmallIntegerField(default=0, help_text='0 a 100')),
+                ('filas_total', models.PositiveIntegerField(blank=True, null=True)),
+                ('filas_procesadas', models.PositiveIntegerField(default=0)),
+                ('resumen', models.JSONField(blank=True, default=dict, help_text='creados, actualizados, sin_cambios, campos')),
+                ('diferencias', models.JSONField(blank=True, default=list, help_text='Muestra de filas nuevas o con cambios')),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('empresa', models.ForeignKey(blank=True, help_text='Empresa asignada a los trabajadores (la de quien sube el archivo)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='importaciones', to='asistencia.empresa')),
+                ('solicitado_por', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='importaciones_solicitadas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Importación de Nómina',
+                'verbose_name_plural': 'Importaciones de Nómina',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
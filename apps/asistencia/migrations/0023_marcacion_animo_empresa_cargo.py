@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def guardar_empresa_y_cargo(apps, schema_editor):
+    """Las marcas con ánimo ya contadas lo fueron con la empresa y cargo actuales del trabajador."""
+    Marcacion = apps.get_model('asistencia', 'Marcacion')
+    Perfil = apps.get_model('asistencia', 'Perfil')
+
+    # Un UPDATE por (empresa, cargo), no por marca
+    grupos = Perfil.objects.filter(empresa__isnull=False).values_list('empresa_id', 'cargo').distinct()
+    for empresa_id, cargo in grupos:
+        Marcacion.objects.filter(
+            animo__isnull=False, trabajador__perfil__empresa_id=empresa_id, trabajador__perfil__cargo=cargo
+        ).update(animo_empresa_id=empresa_id, animo_cargo=cargo or '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0022_importacionnomina'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marcacion',
+            name='animo_cargo',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='marcacion',
+            name='animo_empresa',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='asistencia.empresa'),
+        ),
+        migrations.RunPython(guardar_empresa_y_cargo, migrations.RunPython.noop),
+    ]
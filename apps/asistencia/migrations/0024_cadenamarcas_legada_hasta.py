@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asistencia', '0023_marcacion_animo_empresa_cargo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cadenamarcas',
+            name='legada_hasta_id',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Última marca encadenada antes de existir la cabeza (regla por timestamp)', null=True),
+        ),
+    ]
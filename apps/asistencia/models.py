@@ -1,10 +1,11 @@
 import hashlib
 import datetime
 from cloudinary_storage.storage import MediaCloudinaryStorage
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
@@ -29,6 +30,13 @@ class Marcacion(models.Model):
         blank=True,
         storage=MediaCloudinaryStorage()  # <--- ESTO ES LA MAGIA
     )
+    miniatura = models.ImageField(
+        upload_to='marcas/miniaturas/%Y/%m/',
+        null=True,
+        blank=True,
+        storage=MediaCloudinaryStorage(),
+        help_text="Versión pequeña de la foto para los listados"
+    )
     alerta_olvido_enviada = models.BooleanField(default=False)
 
     ESTADOS_MARCA = [
@@ -45,6 +53,10 @@ class Marcacion(models.Model):
     ]
     animo = models.CharField(max_length=10, choices=ANIMO_CHOICES, null=True, blank=True)
     comentario_animo = models.TextField(null=True, blank=True, verbose_name="¿Por qué te sientes así?")
+    # Empresa y cargo con que se contó el ánimo en AnimoDiario: al borrar la marca se descuenta
+    # del mismo contador aunque el trabajador haya cambiado de cargo entremedio
+    animo_empresa = models.ForeignKey('Empresa', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    animo_cargo = models.CharField(max_length=100, blank=True, editable=False)
     marca_reemplazada = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reemplazo')
     es_manual = models.BooleanField(default=False)
     observacion = models.TextField(blank=True, null=True)
@@ -54,16 +66,39 @@ class Marcacion(models.Model):
     direccion = models.CharField(max_length=255, blank=True, null=True, help_text="Dirección obtenida vía GPS")
     hash_previo = models.CharField(max_length=64, blank=True)
     hash_actual = models.CharField(max_length=64, blank=True, editable=False)
+    clave_idempotencia = models.CharField(
+        max_length=64, null=True, blank=True, editable=False,
+        help_text="UUID generado por el teléfono para marcas offline (evita duplicados al reintentar)"
+    )
 
-    def calcular_hash(self):
-        """Genera firma SHA-256 única encadenada al registro anterior"""
-        ultima = Marcacion.objects.filter(trabajador=self.trabajador).order_by('-timestamp').first()
-        prev = ultima.hash_actual if ultima else "GENESIS_BLOCK"
-
-        self.hash_previo = prev
-        raw_data = f"{self.trabajador.id}{self.timestamp}{self.tipo}{prev}"
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trabajador', 'clave_idempotencia'], name='marca_clave_idempotencia_unica'),
+        ]
+        # Las consultas calientes filtran por rango de timestamp (nunca con __date, que no usa índices).
+        # `RendimientoConsultasTests` revisa con EXPLAIN que los sigan usando.
+        indexes = [
+            # Historial de un trabajador: dashboard, mis marcas, libro PDF, jornada del día
+            models.Index(fields=['trabajador', 'timestamp'], name='marca_trabajador_ts_idx'),
+            # Última ENTRADA/SALIDA de un trabajador: validación cronológica, alertas, olvidos
+            models.Index(fields=['trabajador', 'tipo', 'timestamp'], name='marca_trab_tipo_ts_idx'),
+            # Rangos de fecha de toda una empresa y el cursor del panel (timestamp, id)
+            models.Index(fields=['timestamp', 'id'], name='marca_ts_id_idx'),
+        ]
+
+    @staticmethod
+    def firmar(trabajador_id, timestamp, tipo, hash_previo):
+        """SHA-256 de una marca encadenada a la anterior. El timestamp se normaliza a UTC
+        para que la firma se pueda recalcular igual al leerla desde la BD."""
+        if timezone.is_aware(timestamp):
+            timestamp = timestamp.astimezone(datetime.timezone.utc)
+        raw_data = f"{trabajador_id}{timestamp}{tipo}{hash_previo}"
         return hashlib.sha256(raw_data.encode('utf-8')).hexdigest()
 
+    def calcular_hash(self):
+        """Genera firma SHA-256 única encadenada al registro anterior (hash_previo)"""
+        return self.firmar(self.trabajador_id, self.timestamp, self.tipo, self.hash_previo or "GENESIS_BLOCK")
+
     def clean(self):
         """Validador lógico para impedir inconsistencias"""
         super().clean()
@@ -75,20 +110,330 @@ class Marcacion(models.Model):
             ).exclude(pk=self.pk).order_by('-timestamp').first()
 
             if ultima_entrada:
-                if self.timestamp < ultima_entrada.timestamp:
-                    raise ValidationError(f"Error Cronológico: No puedes marcar SALIDA ({self.timestamp.strftime('%H:%M')}) antes de la ENTRADA ({ultima_entrada.timestamp.strftime('%H:%M')}).")
+                self._validar_salida(ultima_entrada.timestamp)
+
+    def _validar_salida(self, timestamp_entrada):
+        if timestamp_entrada and self.timestamp < timestamp_entrada:
+            raise ValidationError(f"Error Cronológico: No puedes marcar SALIDA ({self.timestamp.strftime('%H:%M')}) antes de la ENTRADA ({timestamp_entrada.strftime('%H:%M')}).")
+
+    def _cabeza_cadena(self):
+        """
+        Lee y bloquea (select_for_update) la cabeza de la cadena del trabajador.
+        Si aún no existe, la crea a partir de su última marca (datos históricos) y
+        anota hasta qué marca la cadena se armó con la regla antigua (por timestamp).
+        """
+        try:
+            return CadenaMarcas.objects.select_for_update().get(trabajador_id=self.trabajador_id)
+        except CadenaMarcas.DoesNotExist:
+            pass
+
+        marcas = Marcacion.objects.filter(trabajador_id=self.trabajador_id)
+        ultima = marcas.order_by('-timestamp', '-id').first()
+        historico = marcas.aggregate(
+            ultima_entrada=models.Max('timestamp', filter=models.Q(tipo='ENTRADA')),
+            legada_hasta_id=models.Max('id'),
+        )
+        try:
+            with transaction.atomic():
+                return CadenaMarcas.objects.create(
+                    trabajador_id=self.trabajador_id,
+                    ultimo_hash=ultima.hash_actual if ultima else "GENESIS_BLOCK",
+                    ultimo_timestamp=ultima.timestamp if ultima else None,
+                    ultimo_tipo=ultima.tipo if ultima else '',
+                    ultima_entrada=historico['ultima_entrada'],
+                    legada_hasta_id=historico['legada_hasta_id'] or 0,
+                )
+        except IntegrityError:
+            # Otra transacción la creó en paralelo: esperamos su bloqueo
+            return CadenaMarcas.objects.select_for_update().get(trabajador_id=self.trabajador_id)
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-
-        if not self.pk:
+        # Validación liviana: formatos de campos sin las consultas de existencia de FKs.
+        # La regla cronológica se valida contra la cabeza de la cadena (ya bloqueada).
+        self.clean_fields(exclude=['trabajador', 'marca_reemplazada'])
+
+        if not self._state.adding:
+            # Actualización (ej: pasa a RECTIFICADA): el hash y el timestamp no cambian
+            with transaction.atomic():
+                super(Marcacion, self).save(*args, **kwargs)
+                JornadaDiaria.recalcular(self.trabajador_id, self.fecha_local)
+            return
+
+        with transaction.atomic():
+            cabeza = self._cabeza_cadena()
+            if self.tipo == 'SALIDA':
+                self._validar_salida(cabeza.ultima_entrada)
+
+            self.hash_previo = cabeza.ultimo_hash
             self.hash_actual = self.calcular_hash()
+            if self.animo:
+                self.animo_empresa_id, self.animo_cargo = AnimoDiario.empresa_y_cargo(self.trabajador_id)
+            super(Marcacion, self).save(*args, **kwargs)
+
+            cabeza.ultimo_hash = self.hash_actual
+            cabeza.ultimo_timestamp = self.timestamp
+            cabeza.ultimo_tipo = self.tipo
+            if self.tipo == 'ENTRADA' and (cabeza.ultima_entrada is None or self.timestamp > cabeza.ultima_entrada):
+                cabeza.ultima_entrada = self.timestamp
+            cabeza.save()
+
+            JornadaDiaria.registrar(self)
+            AnimoDiario.registrar(self)
 
-        super(Marcacion, self).save(*args, **kwargs)
+    @property
+    def fecha_local(self):
+        """Día (hora de Chile) al que pertenece la marca."""
+        return timezone.localtime(self.timestamp).date()
 
     def __str__(self):
         return f"{self.trabajador} - {self.tipo} ({self.timestamp})"
 
+class CadenaMarcas(models.Model):
+    """
+    Cabeza de la cadena de hash de cada trabajador: último hash firmado y datos de
+    la última marca. Insertar una marca cuesta una lectura bloqueada de esta fila
+    en vez de buscar la última marca, y dos inserciones simultáneas no bifurcan la cadena.
+    """
+    trabajador = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='cadena_marcas')
+    ultimo_hash = models.CharField(max_length=64, default="GENESIS_BLOCK")
+    ultimo_timestamp = models.DateTimeField(null=True, blank=True)
+    ultimo_tipo = models.CharField(max_length=20, blank=True)
+    ultima_entrada = models.DateTimeField(null=True, blank=True, help_text="Para validar que la SALIDA no sea anterior")
+    legada_hasta_id = models.BigIntegerField(null=True, blank=True, editable=False,
+                                             help_text="Última marca encadenada antes de existir la cabeza (regla por timestamp)")
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cabeza de Cadena de Marcas"
+        verbose_name_plural = "Cabezas de Cadena de Marcas"
+
+    def __str__(self):
+        return f"{self.trabajador_id}: {self.ultimo_hash[:12]}..."
+
+class JornadaDiaria(models.Model):
+    """
+    Resumen materializado del día de un trabajador (hora local de Chile), armado con
+    sus marcas VIGENTES. Se recalcula cada vez que se guarda, rectifica o borra una
+    marca, así los paneles y reportes leen una fila por día en vez de re-emparejar
+    todas las marcas. `reconstruir_jornadas` lo rellena para datos históricos.
+    """
+    trabajador = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='jornadas')
+    fecha = models.DateField()
+    entrada = models.DateTimeField(null=True, blank=True, help_text="Primera ENTRADA del día")
+    inicio_colacion = models.DateTimeField(null=True, blank=True)
+    fin_colacion = models.DateTimeField(null=True, blank=True)
+    salida = models.DateTimeField(null=True, blank=True, help_text="Última SALIDA del día")
+    segundos_trabajados = models.PositiveIntegerField(default=0, help_text="Bruto: Salida - Entrada")
+    segundos_colacion = models.PositiveIntegerField(default=0)
+    total_marcas = models.PositiveSmallIntegerField(default=0)
+    doble_entrada = models.BooleanField(default=False, help_text="Dos ENTRADAS sin SALIDA entre medio")
+    tiene_manual = models.BooleanField(default=False, help_text="Incluye marcas manuales o rectificadas")
+    abierta = models.BooleanField(default=False, help_text="Última ENTRADA sin SALIDA posterior")
+    ultima_marca = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Jornada Diaria"
+        verbose_name_plural = "Jornadas Diarias"
+        constraints = [
+            models.UniqueConstraint(fields=['trabajador', 'fecha'], name='jornada_trabajador_fecha_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha'], name='jornada_fecha_idx'),
+        ]
+
+    @staticmethod
+    def _vacia():
+        return {
+            'entrada': None, 'inicio_colacion': None, 'fin_colacion': None, 'salida': None,
+            'segundos_trabajados': 0, 'segundos_colacion': 0, 'total_marcas': 0,
+            'doble_entrada': False, 'tiene_manual': False, 'abierta': False, 'ultima_marca': None,
+        }
+
+    @staticmethod
+    def _acumular(datos, tipo, timestamp, es_manual):
+        """Suma una marca (en orden cronológico) a los campos de la jornada."""
+        datos['total_marcas'] += 1
+        datos['tiene_manual'] = datos['tiene_manual'] or es_manual
+        datos['ultima_marca'] = timestamp
+        if tipo == 'ENTRADA':
+            if datos['entrada'] is None:
+                datos['entrada'] = timestamp
+            if datos['abierta']:
+                datos['doble_entrada'] = True
+            datos['abierta'] = True
+        elif tipo == 'INICIO_COLACION':
+            datos['inicio_colacion'] = timestamp
+        elif tipo == 'FIN_COLACION':
+            datos['fin_colacion'] = timestamp
+        elif tipo == 'SALIDA':
+            datos['salida'] = timestamp
+            datos['abierta'] = False
+
+        datos['segundos_trabajados'] = 0
+        if datos['entrada'] and datos['salida']:
+            datos['segundos_trabajados'] = max(0, int((datos['salida'] - datos['entrada']).total_seconds()))
+        datos['segundos_colacion'] = 0
+        if datos['inicio_colacion'] and datos['fin_colacion']:
+            datos['segundos_colacion'] = max(0, int((datos['fin_colacion'] - datos['inicio_colacion']).total_seconds()))
+
+    @classmethod
+    def resumir(cls, marcas):
+        """Campos de la jornada a partir de (tipo, timestamp, es_manual) del día, ordenados por hora."""
+        datos = cls._vacia()
+        for tipo, timestamp, es_manual in marcas:
+            cls._acumular(datos, tipo, timestamp, es_manual)
+        return datos
+
+    @staticmethod
+    def rango_dia(fecha):
+        """Inicio y fin (exclusivo) del día local como datetimes aware."""
+        inicio = timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min))
+        fin = timezone.make_aware(datetime.datetime.combine(fecha + datetime.timedelta(days=1), datetime.time.min))
+        return inicio, fin
+
+    @classmethod
+    def recalcular(cls, trabajador_id, fecha):
+        """Rehace la jornada de un trabajador en un día (o la borra si ya no quedan marcas)."""
+        inicio, fin = cls.rango_dia(fecha)
+        marcas = Marcacion.objects.filter(
+            trabajador_id=trabajador_id, estado='VIGENTE', timestamp__gte=inicio, timestamp__lt=fin
+        ).order_by('timestamp', 'id').values_list('tipo', 'timestamp', 'es_manual')
+
+        datos = cls.resumir(marcas)
+        if not datos['total_marcas']:
+            cls.objects.filter(trabajador_id=trabajador_id, fecha=fecha).delete()
+            return None
+
+        jornada, _ = cls.objects.update_or_create(trabajador_id=trabajador_id, fecha=fecha, defaults=datos)
+        return jornada
+
+    @classmethod
+    def registrar(cls, marca):
+        """
+        Suma una marca recién insertada a su jornada sin releer las marcas del día.
+        Corre dentro de la transacción de `Marcacion.save`, con la cabeza de la cadena
+        del trabajador ya bloqueada (dos marcas suyas no llegan aquí en paralelo).
+        """
+        if marca.estado != 'VIGENTE':
+            return None
+
+        fecha = marca.fecha_local
+        jornada = cls.objects.select_for_update().filter(trabajador_id=marca.trabajador_id, fecha=fecha).first()
+        if jornada is None:
+            return cls.objects.create(
+                trabajador_id=marca.trabajador_id, fecha=fecha,
+                **cls.resumir([(marca.tipo, marca.timestamp, marca.es_manual)])
+            )
+        if jornada.ultima_marca and marca.timestamp < jornada.ultima_marca:
+            # Llegó desordenada (sincronización offline o marca manual): se rehace el día
+            return cls.recalcular(marca.trabajador_id, fecha)
+
+        datos = {campo: getattr(jornada, campo) for campo in cls._vacia()}
+        cls._acumular(datos, marca.tipo, marca.timestamp, marca.es_manual)
+        for campo, valor in datos.items():
+            setattr(jornada, campo, valor)
+        jornada.save()
+        return jornada
+
+    @property
+    def estado(self):
+        """Color del panel DT: success, info (en curso), warning o danger."""
+        if self.entrada and self.salida:
+            return 'warning' if self.doble_entrada else 'success'
+        if self.entrada:
+            return 'info' if self.fecha == timezone.localdate() else 'warning'
+        return 'danger'
+
+    @property
+    def duracion(self):
+        if self.entrada and self.salida:
+            texto = f"{self.segundos_trabajados // 3600}h {(self.segundos_trabajados % 3600) // 60}m"
+            return f"{texto} (Doble Entrada)" if self.doble_entrada else texto
+        if self.entrada:
+            return 'En curso (Trabajando)' if self.fecha == timezone.localdate() else 'Sin marcación de salida'
+        if self.salida:
+            return 'Error: Falta Entrada'
+        return 'Solo colación'
+
+    def __str__(self):
+        return f"{self.trabajador_id} - {self.fecha}"
+
+class AnimoDiario(models.Model):
+    """
+    Cuántas marcas con cada ánimo hubo por empresa, cargo y día (hora local de Chile).
+    Se suma al insertar cada marca con ánimo, así el gráfico de clima laboral y la
+    tendencia leen unas pocas filas en vez de agrupar las marcas de todas las empresas.
+    `reconstruir_animo` la rellena para datos históricos.
+    """
+    empresa = models.ForeignKey('Empresa', on_delete=models.CASCADE, related_name='animos')
+    fecha = models.DateField()
+    cargo = models.CharField(max_length=100, blank=True, help_text="Cargo del trabajador al marcar")
+    animo = models.CharField(max_length=10, choices=Marcacion.ANIMO_CHOICES)
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Ánimo Diario"
+        verbose_name_plural = "Ánimos Diarios"
+        constraints = [
+            models.UniqueConstraint(fields=['empresa', 'fecha', 'cargo', 'animo'], name='animo_empresa_fecha_cargo_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha'], name='animo_fecha_idx'),
+        ]
+
+    @classmethod
+    def sumar(cls, empresa_id, fecha, cargo, animo, cantidad=1):
+        """Suma (o resta, con `cantidad` negativa) al contador con un UPDATE atómico."""
+        filtro = {'empresa_id': empresa_id, 'fecha': fecha, 'cargo': cargo or '', 'animo': animo}
+        filas = cls.objects.filter(**filtro)
+        if cantidad < 0:
+            filas = filas.filter(total__gte=-cantidad)
+        if filas.update(total=models.F('total') + cantidad) or cantidad < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(total=cantidad, **filtro)
+        except IntegrityError:
+            # Otra marca creó el contador en paralelo
+            cls.objects.filter(**filtro).update(total=models.F('total') + cantidad)
+
+    @staticmethod
+    def empresa_y_cargo(trabajador_id):
+        """(empresa_id, cargo) actuales del trabajador; (None, '') si no tiene empresa."""
+        perfil = Perfil.objects.filter(
+            usuario_id=trabajador_id, empresa__isnull=False
+        ).values_list('empresa_id', 'cargo').first()
+        return perfil or (None, '')
+
+    @classmethod
+    def registrar(cls, marca, cantidad=1):
+        """
+        Cuenta el ánimo de una marca con la empresa y cargo guardados en ella al insertarla
+        (las de trabajadores sin empresa no se cuentan).
+        """
+        if marca.animo and marca.animo_empresa_id:
+            cls.sumar(marca.animo_empresa_id, marca.fecha_local, marca.animo_cargo, marca.animo, cantidad)
+
+    def __str__(self):
+        return f"{self.empresa_id} - {self.fecha} - {self.animo}: {self.total}"
+
+class VerificacionCadena(models.Model):
+    """Checkpoint de `verificar_cadena`: hasta qué marca está verificada la cadena de cada trabajador."""
+    trabajador = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='verificacion_cadena')
+    ultima_marca_id = models.BigIntegerField(default=0)
+    ultimo_hash = models.CharField(max_length=64, default="GENESIS_BLOCK")
+    marcas_verificadas = models.PositiveIntegerField(default=0)
+    rupturas = models.PositiveIntegerField(default=0)
+    verificado_en = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Verificación de Cadena"
+        verbose_name_plural = "Verificaciones de Cadena"
+
+    def __str__(self):
+        return f"{self.trabajador_id}: hasta marca #{self.ultima_marca_id} ({self.rupturas} rupturas)"
+
 class SolicitudMarca(models.Model):
     TIPOS_SOLICITUD = [
         ('NUEVA', 'Nueva Marca (Falla Técnica)'),
@@ -154,6 +499,11 @@ class Perfil(models.Model):
         ('EMPLEADOR', 'Empleador / RRHH'),
         ('FISCALIZADOR', 'Fiscalizador DT'),
     )
+    # Campo que dice si le toca trabajar, indexado por weekday() (0=Lunes)
+    DIAS_TURNO = (
+        'trabaja_lunes', 'trabaja_martes', 'trabaja_miercoles', 'trabaja_jueves',
+        'trabaja_viernes', 'trabaja_sabado', 'trabaja_domingo',
+    )
 
     usuario = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, null=True, blank=True)
@@ -196,20 +546,53 @@ class Perfil(models.Model):
         help_text="Hora límite antes de contar atraso."
     )
 
+    class Meta:
+        indexes = [
+            # El scheduler busca "a quién se le venció la hora de entrada desde el último tick"
+            models.Index(fields=['hora_entrada'], name='perfil_hora_entrada_idx'),
+        ]
+
     def __str__(self):
         return f"Perfil de {self.usuario.username}"
 
 
+@receiver(post_delete, sender=Marcacion)
+def recalcular_jornada_marca_borrada(sender, instance, **kwargs):
+    JornadaDiaria.recalcular(instance.trabajador_id, instance.fecha_local)
+
+
+@receiver(post_delete, sender=Marcacion)
+def descontar_animo_marca_borrada(sender, instance, **kwargs):
+    AnimoDiario.registrar(instance, cantidad=-1)
+
+
 @receiver(post_save, sender=User)
 def crear_o_actualizar_perfil(sender, instance, created, **kwargs):
     """
     Gestiona la creación del perfil de forma segura.
+    Solo al crear: `user.perfil` puede venir de la caché del contexto de empresa
+    (hasta 60 s de antigüedad), y guardarlo en cada `user.save()` pisaba con datos
+    viejos los cambios hechos al Perfil desde otro request.
     """
     if created:
         Perfil.objects.get_or_create(usuario=instance)
 
-    if hasattr(instance, 'perfil'):
-        instance.perfil.save()
+
+def clave_contexto_empresa(usuario_id):
+    """Clave en caché del Perfil+Empresa del usuario (ver `contexto.py`)."""
+    return f"contexto_empresa:{usuario_id}"
+
+
+@receiver([post_save, post_delete], sender=Perfil)
+def invalidar_contexto_perfil(sender, instance, **kwargs):
+    cache.delete(clave_contexto_empresa(instance.usuario_id))
+
+
+@receiver(post_save, sender=Empresa)
+def invalidar_contexto_empresa(sender, instance, **kwargs):
+    # Al borrar una empresa sus perfiles se borran en cascada (y se invalidan arriba)
+    usuarios = Perfil.objects.filter(empresa=instance).values_list('usuario_id', flat=True)
+    cache.delete_many([clave_contexto_empresa(u) for u in usuarios])
 
 class LogAlerta(models.Model):
     TIPOS = [
@@ -218,9 +601,15 @@ class LogAlerta(models.Model):
     ]
     trabajador = models.ForeignKey(User, on_delete=models.CASCADE)
     tipo = models.CharField(max_length=20, choices=TIPOS)
-    fecha = models.DateField(auto_now_add=True) 
+    fecha = models.DateField(default=timezone.localdate)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Una alerta de cada tipo por trabajador y día, aunque dos revisiones corran a la vez
+            models.UniqueConstraint(fields=['trabajador', 'fecha', 'tipo'], name='alerta_trabajador_fecha_tipo_unica'),
+        ]
+
     def __str__(self):
         return f"{self.trabajador} - {self.tipo} - {self.fecha}"
 
@@ -301,4 +690,237 @@ class DiaAdministrativo(models.Model):
         return f"{self.trabajador} - {self.fecha} ({self.estado})"
 
     class Meta:
-        ordering = ['-fecha']
\ No newline at end of file
+        ordering = ['-fecha']
+
+class TareaPendiente(models.Model):
+    """
+    Bandeja de salida (outbox) para el trabajo lento: geocodificación, subida de
+    la foto y comprobante de cada marca, y los reportes pesados (`TrabajoReporte`).
+    La procesa el comando `procesar_tareas` fuera del request.
+    """
+    TIPOS = [
+        ('GEOCODIFICAR', 'Obtener Dirección (GPS)'),
+        ('SUBIR_FOTO', 'Subir Foto'),
+        ('ENVIAR_COMPROBANTE', 'Enviar Comprobante por Correo'),
+        ('GENERAR_REPORTE', 'Generar Reporte'),
+        ('IMPORTAR_NOMINA', 'Importar Nómina'),
+    ]
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En Proceso'),
+        ('COMPLETADA', 'Completada'),
+        ('FALLIDA', 'Fallida (Sin más reintentos)'),
+    ]
+
+    tipo = models.CharField(max_length=30, choices=TIPOS)
+    estado = models.CharField(max_length=15, choices=ESTADOS, default='PENDIENTE')
+    marca = models.ForeignKey(Marcacion, on_delete=models.CASCADE, null=True, blank=True, related_name='tareas')
+    datos = models.JSONField(default=dict, blank=True)
+    archivo = models.BinaryField(null=True, blank=True, help_text="Contenido binario temporal (ej: foto antes de subirla)")
+
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    ejecutar_desde = models.DateTimeField(default=timezone.now, help_text="No se procesa antes de esta hora (backoff)")
+    ultimo_error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Tarea Pendiente"
+        verbose_name_plural = "Tareas Pendientes (Outbox)"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['estado', 'ejecutar_desde'], name='tarea_estado_ejecutar_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.pk} ({self.estado})"
+
+
+class DireccionCache(models.Model):
+    """Caché persistente de geocodificación inversa, por coordenadas redondeadas."""
+    clave = models.CharField(max_length=40, unique=True, help_text="Lat/Lon redondeadas, ej: -33.4489,-70.6693")
+    latitud = models.DecimalField(max_digits=10, decimal_places=7)
+    longitud = models.DecimalField(max_digits=10, decimal_places=7)
+    direccion = models.CharField(max_length=255)
+    aciertos = models.PositiveIntegerField(default=0, help_text="Veces que se evitó una consulta a Nominatim")
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Dirección en Caché"
+        verbose_name_plural = "Caché de Direcciones (Geocoding)"
+
+    def __str__(self):
+        return f"{self.clave} → {self.direccion}"
+
+
+class CuboTokens(models.Model):
+    """Limitador token-bucket compartido entre procesos (ej: 1 req/s a Nominatim)."""
+    nombre = models.CharField(max_length=50, unique=True)
+    tokens = models.FloatField(default=1)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.nombre}: {self.tokens:.2f} tokens"
+
+
+class EstadoTrabajo(models.Model):
+    """
+    Estado persistente de cada trabajo periódico de `asistencia_scheduler`:
+    hasta dónde ya se procesó (marca de agua) y quién lo tiene tomado (lease).
+    El worker de tareas también publica aquí sus contadores ('procesar_tareas').
+    """
+    nombre = models.CharField(max_length=50, primary_key=True)
+    marca_hasta = models.BigIntegerField(default=0, help_text="Id de la última marca ya procesada")
+    revisado_hasta = models.DateTimeField(null=True, blank=True, help_text="Hora hasta la que se evaluaron los umbrales")
+
+    dueno = models.CharField(max_length=100, blank=True, help_text="Nodo que tiene (o tuvo) el lease, ej: host:pid")
+    lease_hasta = models.DateTimeField(null=True, blank=True, help_text="Vacío o vencido = libre")
+
+    ultima_ejecucion = models.DateTimeField(null=True, blank=True)
+    ultima_duracion = models.FloatField(null=True, blank=True, help_text="Segundos")
+    ultimo_resumen = models.CharField(max_length=255, blank=True)
+    ultimo_error = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estado de Trabajo Programado"
+        verbose_name_plural = "Estados de Trabajos Programados"
+
+    def __str__(self):
+        return f"{self.nombre} (marca #{self.marca_hasta}, {self.dueno or 'libre'})"
+
+
+class CorreoSaliente(models.Model):
+    """
+    Bandeja de salida de correos (comprobantes y alertas).
+    Se envían por lotes reutilizando una sola conexión SMTP (ver `correo.enviar_pendientes`).
+    """
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En Proceso'),
+        ('ENVIADO', 'Enviado'),
+        ('FALLIDO', 'Fallido (Sin más reintentos)'),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    remitente = models.CharField(max_length=255, blank=True, null=True, help_text="Vacío = DEFAULT_FROM_EMAIL")
+    destinatario = models.EmailField(help_text="Destinatario principal (se usa para el límite por destinatario)")
+    copia = models.JSONField(default=list, blank=True, help_text="Direcciones en copia (ej: RRHH)")
+    cuerpo_texto = models.TextField()
+    cuerpo_html = models.TextField(blank=True, null=True)
+
+    estado = models.CharField(max_length=15, choices=ESTADOS, default='PENDIENTE')
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    ejecutar_desde = models.DateTimeField(default=timezone.now, help_text="No se envía antes de esta hora (backoff / límite)")
+    ultimo_error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Correo Saliente"
+        verbose_name_plural = "Correos Salientes (Outbox)"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['estado', 'ejecutar_desde'], name='correo_estado_ejecutar_idx'),
+            models.Index(fields=['destinatario', 'enviado_en'], name='correo_destinatario_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asunto} → {self.destinatario} ({self.estado})"
+
+
+class TrabajoReporte(models.Model):
+    """
+    Reporte pesado (Excel/CSV/PDF) generado por el worker en vez de en el request.
+    El panel lo encola, consulta su estado y descarga el archivo terminado.
+    `huella` resume el tipo, los filtros y el estado de los datos: una solicitud
+    idéntica sin datos nuevos reutiliza el archivo ya generado.
+    """
+    TIPOS = [
+        ('REMUNERACIONES', 'Pre-Nómina (Remuneraciones)'),
+        ('FISCALIZACION', 'Reporte Fiscalización DT'),
+        ('LIBRO_PDF', 'Libro de Asistencia (PDF)'),
+        ('LIBROS_EMPRESA', 'Libros de Asistencia de la Empresa (ZIP)'),
+    ]
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En Proceso'),
+        ('COMPLETADO', 'Completado'),
+        ('FALLIDO', 'Fallido'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    estado = models.CharField(max_length=15, choices=ESTADOS, default='PENDIENTE')
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, related_name='reportes')
+    solicitado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='reportes_solicitados')
+    parametros = models.JSONField(default=dict, blank=True, help_text="Filtros: desde, hasta, formato...")
+    huella = models.CharField(max_length=64)
+
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="0 a 100")
+    archivo = models.FileField(upload_to='reportes/%Y/%m/', null=True, blank=True)
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Trabajo de Reporte"
+        verbose_name_plural = "Trabajos de Reportes"
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['empresa', 'tipo', 'huella'], name='reporte_huella_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.pk} ({self.estado})"
+
+
+class ImportacionNomina(models.Model):
+    """
+    Carga de una nómina Excel subida en `/rrhh/importar-nomina/`. El archivo queda
+    en el storage y lo procesa el worker (tarea IMPORTAR_NOMINA): primero en
+    simulación (cuenta nuevos / actualizados / sin cambios y guarda la diferencia
+    campo por campo) y, cuando se confirma, de verdad, por lotes.
+    """
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('ANALIZANDO', 'Analizando (simulación)'),
+        ('ANALIZADA', 'Analizada: esperando confirmación'),
+        ('APLICANDO', 'Aplicando cambios'),
+        ('COMPLETADA', 'Completada'),
+        ('FALLIDA', 'Fallida'),
+    ]
+
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, null=True, blank=True, related_name='importaciones',
+                                help_text="Empresa asignada a los trabajadores (la de quien sube el archivo)")
+    solicitado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='importaciones_solicitadas')
+    archivo = models.FileField(upload_to='importaciones/%Y/%m/')
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    simular = models.BooleanField(default=True, help_text="Solo calcula los cambios, sin guardar")
+
+    estado = models.CharField(max_length=15, choices=ESTADOS, default='PENDIENTE')
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="0 a 100")
+    filas_total = models.PositiveIntegerField(null=True, blank=True)
+    filas_procesadas = models.PositiveIntegerField(default=0)
+    resumen = models.JSONField(default=dict, blank=True, help_text="creados, actualizados, sin_cambios, campos")
+    diferencias = models.JSONField(default=list, blank=True, help_text="Muestra de filas nuevas o con cambios")
+    error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Importación de Nómina"
+        verbose_name_plural = "Importaciones de Nómina"
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.nombre_archivo or self.archivo.name} #{self.pk} ({self.estado})"
@@ -1,27 +1,192 @@
-import ntplib
-from time import ctime
+"""
+Hora oficial (SHOA) sin bloquear el request.
+
+Antes cada llamada consultaba ntp.shoa.cl con un timeout de 2 s. Ahora un hilo
+en segundo plano mide el desfase (offset) contra el SHOA cada
+`NTP_INTERVALO_SEGUNDOS` y lo deja en la caché de Django, compartido entre
+workers. La hora oficial se calcula localmente: reloj monotónico + offset,
+en microsegundos y sin latencia.
+
+Los fallos de sincronización se registran con `logging` (logger
+`apps.asistencia.ntp_time`) y `estado_reloj()` queda expuesto en /salud/.
+"""
+import logging
+import threading
+import time
 from datetime import datetime, timezone
 
+import ntplib
+from django.conf import settings
+from django.core.cache import cache
+
+SERVIDOR = getattr(settings, 'NTP_SERVIDOR', 'ntp.shoa.cl')
+TIMEOUT = getattr(settings, 'NTP_TIMEOUT_SEGUNDOS', 2)
+INTERVALO = getattr(settings, 'NTP_INTERVALO_SEGUNDOS', 300)
+# Pasado este tiempo sin sincronizar, la hora se informa como no oficial
+MAX_ANTIGUEDAD = getattr(settings, 'NTP_MAX_ANTIGUEDAD_SEGUNDOS', 1800)
+# Cada cuánto un proceso relee el offset que pudo publicar otro worker
+RELECTURA = 5
+
+logger = logging.getLogger(__name__)
+
+CLAVE_ESTADO = 'ntp:estado'
+CLAVE_TURNO = 'ntp:turno'
+
+_lock = threading.Lock()
+_hilo = None
+# Ancla local: hora oficial (ns) correspondiente a una lectura del reloj monotónico
+_local = {
+    'version': None,
+    'offset_ns': 0,
+    'ancla_mono': None,
+    'ancla_oficial': None,
+    'releido': None,
+}
+
+
+# =======================================================
+# 1. SINCRONIZACIÓN (hilo en segundo plano)
+# =======================================================
+
+def sincronizar(servidor=None):
+    """Consulta el NTP (bloqueante) y publica el offset en la caché. Devuelve el estado."""
+    servidor = servidor or SERVIDOR
+    ahora = time.time()
+
+    try:
+        respuesta = ntplib.NTPClient().request(servidor, version=3, timeout=TIMEOUT)
+    except Exception as e:
+        # Conservamos el último offset bueno; solo anotamos el fallo
+        estado = cache.get(CLAVE_ESTADO) or {'offset_us': 0, 'retardo_us': None, 'sincronizado_en': None, 'servidor': servidor}
+        estado.update(error=str(e), ultimo_intento=ahora)
+        cache.set(CLAVE_ESTADO, estado, None)
+        antiguedad = ahora - estado['sincronizado_en'] if estado['sincronizado_en'] else None
+        logger.warning(
+            "No se pudo sincronizar con %s: %s (último offset bueno: %s)", servidor, e,
+            f"hace {antiguedad:.0f} s" if antiguedad is not None else "ninguno",
+        )
+        if antiguedad is None or antiguedad > MAX_ANTIGUEDAD:
+            logger.error("Reloj sin sincronizar con el SHOA: las marcas usan la hora local del servidor")
+        return estado
+
+    estado = {
+        'offset_us': int(respuesta.offset * 1_000_000),
+        'retardo_us': int(respuesta.delay * 1_000_000),
+        'sincronizado_en': ahora,
+        'ultimo_intento': ahora,
+        'servidor': servidor,
+        'error': None,
+    }
+    cache.set(CLAVE_ESTADO, estado, None)
+    _releer(forzar=True)
+    logger.debug("Reloj sincronizado con %s: offset %d us, retardo %d us", servidor, estado['offset_us'], estado['retardo_us'])
+    return estado
+
+
+def _bucle():
+    while True:
+        try:
+            # cache.add es atómico: solo un worker por intervalo le pregunta al SHOA
+            if cache.add(CLAVE_TURNO, 1, INTERVALO):
+                sincronizar()
+        except Exception:
+            logger.exception("Error en el hilo del reloj NTP")
+        time.sleep(min(INTERVALO, 60))
+
+
+def iniciar_servicio():
+    """Arranca (una vez por proceso) el hilo que mantiene el offset al día."""
+    global _hilo
+    if not getattr(settings, 'NTP_SERVICIO_ACTIVO', True):
+        return
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_bucle, name='reloj-ntp', daemon=True)
+            _hilo.start()
+
+
+# =======================================================
+# 2. HORA OFICIAL (sin red)
+# =======================================================
+
+def _releer(forzar=False):
+    """Trae el offset publicado en la caché y re-ancla el reloj monotónico si cambió."""
+    mono = time.monotonic_ns()
+    if not forzar and _local['releido'] is not None and mono - _local['releido'] < RELECTURA * 1_000_000_000:
+        return
+
+    estado = cache.get(CLAVE_ESTADO)
+    with _lock:
+        _local['releido'] = mono
+        if estado and estado['sincronizado_en'] is not None and estado['sincronizado_en'] != _local['version']:
+            offset_ns = estado['offset_us'] * 1000
+            _local.update(
+                version=estado['sincronizado_en'],
+                offset_ns=offset_ns,
+                ancla_mono=time.monotonic_ns(),
+                ancla_oficial=time.time_ns() + offset_ns,
+            )
+
+
+def _oficial_ns():
+    with _lock:
+        if _local['ancla_mono'] is None:
+            return None
+        return _local['ancla_oficial'] + (time.monotonic_ns() - _local['ancla_mono'])
+
+
+def hora_oficial():
+    """Hora SHOA (UTC, aware) con precisión de microsegundos. Sin sincronizar = hora local."""
+    iniciar_servicio()
+    _releer()
+
+    ns = _oficial_ns()
+    if ns is None:
+        return datetime.now(timezone.utc)
+    segundos, resto = divmod(ns, 1_000_000_000)
+    return datetime.fromtimestamp(segundos, timezone.utc).replace(microsecond=resto // 1000)
+
+
+def estado_reloj():
+    """Offset, deriva y antigüedad de la última sincronización (para monitoreo)."""
+    _releer()
+    estado = cache.get(CLAVE_ESTADO) or {}
+    sincronizado_en = estado.get('sincronizado_en')
+    antiguedad = time.time() - sincronizado_en if sincronizado_en else None
+
+    # Deriva: cuánto se separó el reloj de pared del monotónico desde el último ancla
+    ns = _oficial_ns()
+    deriva_us = (time.time_ns() + _local['offset_ns'] - ns) // 1000 if ns is not None else None
+
+    return {
+        'servidor': estado.get('servidor', SERVIDOR),
+        'offset_us': estado.get('offset_us'),
+        'retardo_us': estado.get('retardo_us'),
+        'deriva_us': deriva_us,
+        'ultima_sincronizacion': datetime.fromtimestamp(sincronizado_en, timezone.utc) if sincronizado_en else None,
+        'antiguedad_segundos': antiguedad,
+        'sincronizado': antiguedad is not None and antiguedad <= MAX_ANTIGUEDAD,
+        'error': estado.get('error'),
+    }
+
+
 def obtener_hora_oficial_chile():
     """
-    Consulta el servidor NTP del SHOA (Servicio Hidrográfico y Oceanográfico de la Armada).
-    Si falla, usa la hora del servidor pero deja un registro del fallo.
+    Hora del SHOA (Servicio Hidrográfico y Oceanográfico de la Armada).
+    Se mantiene la firma antigua; ya no consulta la red en cada llamada.
     """
-    servidor_ntp = 'ntp.shoa.cl'
-    cliente = ntplib.NTPClient()
-    
-    try:
-        respuesta = cliente.request(servidor_ntp, version=3, timeout=2)
-        hora_exacta = datetime.fromtimestamp(respuesta.tx_time, timezone.utc)
+    hora = hora_oficial()
+    estado = estado_reloj()
+
+    if estado['sincronizado']:
         return {
-            'hora': hora_exacta,
+            'hora': hora,
             'origen': 'SHOA (Oficial)',
             'sincronizado': True
         }
-    except Exception as e:
-        return {
-            'hora': datetime.now(timezone.utc),
-            'origen': 'Servidor Local (Fallback)',
-            'sincronizado': False,
-            'error': str(e)
-        }
\ No newline at end of file
+    return {
+        'hora': hora,
+        'origen': 'Servidor Local (Fallback)',
+        'sincronizado': False,
+        'error': estado['error'] or 'Sin sincronización reciente con el SHOA'
+    }
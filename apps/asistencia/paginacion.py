@@ -0,0 +1,57 @@
+"""
+Paginación por cursor (keyset) de las marcas, ordenadas de la más nueva a la más antigua.
+
+Con OFFSET la base de datos igual recorre y descarta todas las filas anteriores,
+así que la página 500 cuesta 500 veces la primera. Aquí la página siguiente se
+pide "desde la última marca vista": WHERE (timestamp, id) < (t, i) ORDER BY
+timestamp DESC, id DESC LIMIT n, que usa el índice y cuesta lo mismo en el
+primer mes que después de años de historia.
+
+El cursor viaja al navegador como texto opaco (base64 de "timestamp|id").
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+TAMANO_PAGINA = 50
+MAX_TAMANO_PAGINA = 200
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(marca):
+    texto = f"{marca.timestamp.isoformat()}|{marca.id}"
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    """(timestamp, id) de un cursor; CursorInvalido si fue alterado."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, marca_id = texto.split('|')
+        return datetime.fromisoformat(timestamp), int(marca_id)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise CursorInvalido(f"Cursor inválido: {cursor!r}") from e
+
+
+def pagina(marcas, cursor=None, tamano=None):
+    """
+    Hasta `tamano` marcas después del cursor (None = desde la más nueva).
+    Devuelve (marcas, cursor_siguiente); el cursor es None en la última página.
+    """
+    tamano = max(1, min(tamano or TAMANO_PAGINA, MAX_TAMANO_PAGINA))
+    marcas = marcas.order_by('-timestamp', '-id')
+    if cursor:
+        timestamp, marca_id = decodificar_cursor(cursor)
+        marcas = marcas.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=marca_id))
+
+    # Una de más para saber si hay otra página sin hacer un COUNT
+    filas = list(marcas[:tamano + 1])
+    if len(filas) > tamano:
+        return filas[:tamano], codificar_cursor(filas[tamano - 1])
+    return filas, None
@@ -0,0 +1,153 @@
+"""
+Scheduler en proceso (`asistencia_scheduler`) para los trabajos de asistencia.
+
+`revisar_alertas` y `detectar_olvidos` corrían desde un cron externo: cada
+ejecución volvía a revisar el día completo de todos los trabajadores y nada
+impedía que dos ejecuciones (o dos nodos) se pisaran.
+
+Ahora cada trabajo tiene una fila `EstadoTrabajo` con:
+- Un lease en la BD, que se toma con un UPDATE condicional (libre, vencido o ya
+  nuestro): solo un nodo corre cada trabajo a la vez, y si ese nodo muere el
+  lease vence y otro lo retoma.
+- Marcas de agua: el id de la última marca procesada y la hora del último tick.
+  Cada tick solo mira las marcas nuevas y los umbrales (hora de entrada +
+  tolerancia, jornada + margen) cruzados desde el tick anterior, así que su
+  costo sigue a los eventos nuevos y no a la dotación.
+
+El primer tick (sin estado previo) hace la revisión completa, igual que los comandos.
+"""
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import alertas
+from .models import EstadoTrabajo, Feriado, Marcacion
+
+
+# Segundos entre ticks de cada trabajo (se pueden cambiar con settings.SCHEDULER_INTERVALOS)
+INTERVALOS = {
+    'revisar_alertas': 300,
+    'detectar_olvidos': 900,
+    **getattr(settings, 'SCHEDULER_INTERVALOS', {}),
+}
+# Si el nodo muere a mitad de un tick, otro puede tomar el trabajo pasado este tiempo
+DURACION_LEASE = timedelta(seconds=getattr(settings, 'SCHEDULER_LEASE_SEGUNDOS', 600))
+
+
+def identidad():
+    """Nombre de este nodo en el lease (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def tomar_lease(nombre, dueno, ahora=None, intervalo=None):
+    """
+    Toma el lease del trabajo si está libre, vencido o ya es de `dueno`. Es un solo
+    UPDATE condicional, atómico aunque varios nodos lo intenten a la vez. Con
+    `intervalo` (segundos) además exige que ya le toque: que la última ejecución,
+    de cualquier nodo, sea más antigua que eso.
+    Devuelve el EstadoTrabajo o None si no se pudo tomar.
+    """
+    ahora = ahora or timezone.now()
+    condicion = Q(nombre=nombre) & (Q(lease_hasta__isnull=True) | Q(lease_hasta__lt=ahora) | Q(dueno=dueno))
+    if intervalo is not None:
+        condicion &= Q(ultima_ejecucion__isnull=True) | Q(ultima_ejecucion__lte=ahora - timedelta(seconds=intervalo))
+
+    campos = {'dueno': dueno, 'lease_hasta': ahora + DURACION_LEASE}
+    if EstadoTrabajo.objects.filter(condicion).update(updated_at=ahora, **campos):
+        return EstadoTrabajo.objects.get(nombre=nombre)
+
+    # Primera vez que corre este trabajo (si otro nodo la crea antes, no lo tomamos)
+    estado, creado = EstadoTrabajo.objects.get_or_create(nombre=nombre, defaults=campos)
+    return estado if creado else None
+
+
+def soltar_lease(nombre, dueno, **campos):
+    """
+    Libera el lease guardando `campos` (marcas de agua, resumen...). Si el lease
+    venció y ya lo tomó otro nodo no se toca nada. Devuelve True si lo soltó.
+    """
+    return bool(
+        EstadoTrabajo.objects.filter(nombre=nombre, dueno=dueno)
+        .update(lease_hasta=None, updated_at=timezone.now(), **campos)
+    )
+
+
+def publicar_estado(nombre, resumen, ahora=None):
+    """
+    Deja a la vista (admin y /salud/) el estado de un proceso de fondo que no usa
+    lease, ej: los contadores del worker de tareas.
+    """
+    EstadoTrabajo.objects.update_or_create(
+        nombre=nombre, defaults={'dueno': identidad(), 'ultima_ejecucion': ahora or timezone.now(), 'ultimo_resumen': resumen[:255]},
+    )
+
+
+# =======================================================
+# TRABAJOS
+# =======================================================
+
+def tick_alertas(estado, ahora, cronometro):
+    """Ausencias y exceso de jornada de los trabajadores con algo nuevo desde el tick anterior."""
+    hoy = timezone.localdate(ahora)
+    if hoy.weekday() >= 5 or Feriado.objects.filter(fecha=hoy).exists():
+        return "Feriado o fin de semana: sin revisión"
+
+    solo = None
+    if estado.revisado_hasta:
+        with cronometro.fase('candidatos'):
+            solo = alertas.candidatos_alertas(hoy, estado.revisado_hasta, ahora, estado.marca_hasta)
+    revisados, generadas = alertas.revisar(hoy, ahora, cronometro, solo=solo)
+    return f"{revisados} trabajadores revisados, {len(generadas)} alertas"
+
+
+def tick_olvidos(estado, ahora, cronometro):
+    """Entradas sin salida que cruzaron el límite desde el tick anterior (o llegaron nuevas)."""
+    entradas, empresas = alertas.avisar_olvidos(
+        ahora, cronometro=cronometro, anterior=estado.revisado_hasta, marca_desde=estado.marca_hasta
+    )
+    return f"{len(entradas)} entradas sin salida en {empresas} empresas"
+
+
+TRABAJOS = {
+    'revisar_alertas': tick_alertas,
+    'detectar_olvidos': tick_olvidos,
+}
+
+
+def ejecutar(nombre, dueno=None, ahora=None, intervalo=None):
+    """
+    Un tick del trabajo, si este nodo obtiene el lease. Devuelve (resumen, cronometro),
+    o None si lo tiene otro nodo o aún no le toca. Un error no avanza las marcas de
+    agua (el siguiente tick vuelve a cubrir el mismo tramo) y se propaga.
+    """
+    dueno = dueno or identidad()
+    ahora = ahora or timezone.now()
+    estado = tomar_lease(nombre, dueno, ahora, intervalo)
+    if estado is None:
+        return None
+
+    # Tope fijado antes de revisar: lo que se marque durante el tick lo ve el siguiente
+    tope = Marcacion.objects.aggregate(tope=Max('id'))['tope'] or 0
+    cronometro = alertas.Cronometro()
+    inicio = time.perf_counter()
+    try:
+        resumen = TRABAJOS[nombre](estado, ahora, cronometro)
+    except Exception as e:
+        soltar_lease(nombre, dueno, ultima_ejecucion=ahora, ultimo_error=f"{type(e).__name__}: {e}")
+        raise
+
+    soltar_lease(
+        nombre, dueno,
+        marca_hasta=max(tope, estado.marca_hasta),
+        revisado_hasta=ahora,
+        ultima_ejecucion=ahora,
+        ultima_duracion=time.perf_counter() - inicio,
+        ultimo_resumen=resumen[:255],
+        ultimo_error=None,
+    )
+    return resumen, cronometro
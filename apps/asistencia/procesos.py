@@ -0,0 +1,14 @@
+"""
+Utilidades para los pools de procesos (ProcessPoolExecutor) de los comandos pesados:
+verificación de la cadena de hash, libros PDF de la empresa e importación de nóminas.
+"""
+import django
+from django.apps import apps
+from django.db import connections
+
+
+def inicializar_proceso():
+    """Initializer del ProcessPoolExecutor: Django listo y conexiones propias por proceso."""
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
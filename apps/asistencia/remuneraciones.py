@@ -0,0 +1,201 @@
+"""
+Motor de cálculo de la pre-nómina (reporte de remuneraciones / LRE).
+
+El reporte antiguo recorría trabajador × día haciendo hasta seis consultas por
+celda (~90.000 para 500 trabajadores en un mes). Aquí se cargan de una vez las
+jornadas (tabla JornadaDiaria), vacaciones aprobadas, licencias y feriados del
+periodo para toda la empresa (número constante de consultas) y se calcula todo
+en memoria.
+
+Las reglas son las mismas del reporte original:
+- Día trabajado = cualquier marca vigente ese día (hora local).
+- Jornada = primera ENTRADA a última SALIDA del día, menos 1 hora de colación.
+- Domingo o feriado: todo es H.E. 100%. Resto: sobre la jornada pactada es H.E. 50%.
+- Atraso (lunes a viernes no feriado): pasada la tolerancia de 10 min se cuenta desde la hora oficial.
+- Sin marcas: es ausencia solo si le tocaba trabajar y no es feriado, vacación ni licencia.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import JornadaDiaria, Feriado, Vacacion, LicenciaMedica
+
+
+COLACION_SEGUNDOS = 3600
+TOLERANCIA_ATRASO = timedelta(minutes=10)
+
+ENCABEZADOS = [
+    "RUT", "Nombre Completo", "Cargo",
+    "Días Trab. (Cód 1102)", "Horas Ordinarias",
+    "H.E. 50% (Cód 2101)", "H.E. 100% (Dom/Fest)",
+    "Min. Atraso", "Días Ausencia (Cód 1106)", "Observaciones"
+]
+
+
+def fmt_horas(segundos):
+    """Segundos → 'HH:MM'."""
+    h = int(segundos // 3600)
+    m = int((segundos % 3600) // 60)
+    return f"{h:02d}:{m:02d}"
+
+
+def dias_turno(perfil):
+    """Días que le toca trabajar, indexados por weekday() (0=Lunes ... 6=Domingo)."""
+    return (
+        perfil.trabaja_lunes,
+        perfil.trabaja_martes,
+        perfil.trabaja_miercoles,
+        perfil.trabaja_jueves,
+        perfil.trabaja_viernes,
+        perfil.trabaja_sabado,
+        perfil.trabaja_domingo,
+    )
+
+
+def _dias_en_rangos(rangos, desde, hasta):
+    """Fechas del periodo cubiertas por una lista de rangos (inicio, fin)."""
+    dias = set()
+    for inicio, fin in rangos:
+        dia = max(inicio, desde)
+        while dia <= min(fin, hasta):
+            dias.add(dia)
+            dia += timedelta(days=1)
+    return dias
+
+
+def calcular_trabajador(perfil, jornadas_por_dia, desde, hasta, feriados=(), dias_vacacion=(), dias_licencia=()):
+    """
+    Calcula la fila de un trabajador, sin tocar la BD.
+    `jornadas_por_dia`: {fecha_local: (primera_entrada, ultima_salida)}.
+    """
+    horas_jornada = perfil.jornada_diaria if perfil.jornada_diaria else 9
+    hora_entrada_oficial = perfil.hora_entrada if perfil.hora_entrada else time(9, 0)
+    jornada_segundos = horas_jornada * 3600
+    turno = dias_turno(perfil)
+
+    resultado = {
+        'dias_trabajados': 0,
+        'seg_ordinarios': 0,
+        'seg_extra_50': 0,
+        'seg_extra_100': 0,
+        'minutos_atraso': 0,
+        'dias_ausencia': 0,
+        'observaciones': [],
+    }
+
+    es_vacacion = False
+    dia = desde
+    while dia <= hasta:
+        es_vacacion = dia in dias_vacacion
+        es_feriado = dia in feriados
+        es_domingo = dia.weekday() == 6
+        es_sabado = dia.weekday() == 5
+        jornada = jornadas_por_dia.get(dia)
+
+        if jornada:
+            resultado['dias_trabajados'] += 1
+            entrada, salida = jornada
+
+            if entrada and salida:
+                tiempo_neto = max(0, (salida - entrada).total_seconds() - COLACION_SEGUNDOS)
+
+                if es_domingo or es_feriado:
+                    resultado['seg_extra_100'] += tiempo_neto
+                elif tiempo_neto > jornada_segundos:
+                    resultado['seg_ordinarios'] += jornada_segundos
+                    resultado['seg_extra_50'] += tiempo_neto - jornada_segundos
+                else:
+                    resultado['seg_ordinarios'] += tiempo_neto
+
+                if not es_feriado and not es_domingo and not es_sabado:
+                    dt_real = datetime.combine(dia, timezone.localtime(entrada).time())
+                    dt_oficial = datetime.combine(dia, hora_entrada_oficial)
+                    if dt_real > dt_oficial + TOLERANCIA_ATRASO:
+                        resultado['minutos_atraso'] += int((dt_real - dt_oficial).total_seconds() / 60)
+
+        elif not (es_feriado or es_vacacion or dia in dias_licencia or not turno[dia.weekday()]):
+            # Día hábil para él, sin justificación y sin marcas => FALTA
+            resultado['dias_ausencia'] += 1
+
+        dia += timedelta(days=1)
+
+    if resultado['dias_ausencia'] > 0:
+        resultado['observaciones'].append(f"{resultado['dias_ausencia']} Ausencias injustificadas")
+    # Igual que el reporte original: se mira solo el último día del periodo
+    if es_vacacion:
+        resultado['observaciones'].append("Periodo con Vacaciones")
+
+    return resultado
+
+
+def calcular_periodo(empresa, desde, hasta):
+    """
+    Pre-nómina de todos los trabajadores activos de la empresa entre `desde` y `hasta`
+    (fechas, ambas inclusive). Cinco consultas sin importar trabajadores ni días.
+    Devuelve una lista de dicts con 'trabajador', 'perfil' y los totales.
+    """
+    trabajadores = list(
+        User.objects.filter(perfil__empresa=empresa, is_active=True)
+        .select_related('perfil')
+        .order_by('id')
+    )
+    ids = [t.id for t in trabajadores]
+
+    feriados = set(Feriado.objects.filter(fecha__range=[desde, hasta]).values_list('fecha', flat=True))
+
+    # Una fila por trabajador y día ya emparejada (fecha local de Chile)
+    jornadas = defaultdict(dict)
+    for trabajador_id, fecha, entrada, salida in JornadaDiaria.objects.filter(
+        trabajador_id__in=ids, fecha__range=[desde, hasta]
+    ).values_list('trabajador_id', 'fecha', 'entrada', 'salida').iterator(chunk_size=5000):
+        jornadas[trabajador_id][fecha] = (entrada, salida)
+
+    vacaciones = defaultdict(list)
+    for trabajador_id, ini, fin_vac in Vacacion.objects.filter(
+        trabajador_id__in=ids, estado='APROBADA', inicio__lte=hasta, fin__gte=desde
+    ).values_list('trabajador_id', 'inicio', 'fin'):
+        vacaciones[trabajador_id].append((ini, fin_vac))
+
+    licencias = defaultdict(list)
+    for trabajador_id, ini, fin_lic in LicenciaMedica.objects.filter(
+        trabajador_id__in=ids, inicio__lte=hasta, fin__gte=desde
+    ).values_list('trabajador_id', 'inicio', 'fin'):
+        licencias[trabajador_id].append((ini, fin_lic))
+
+    filas = []
+    for trabajador in trabajadores:
+        perfil = trabajador.perfil
+        fila = calcular_trabajador(
+            perfil,
+            jornadas.get(trabajador.id, {}),
+            desde,
+            hasta,
+            feriados=feriados,
+            dias_vacacion=_dias_en_rangos(vacaciones.get(trabajador.id, []), desde, hasta),
+            dias_licencia=_dias_en_rangos(licencias.get(trabajador.id, []), desde, hasta),
+        )
+        fila['trabajador'] = trabajador
+        fila['perfil'] = perfil
+        filas.append(fila)
+
+    return filas
+
+
+def filas_reporte(empresa, desde, hasta):
+    """Filas del reporte de remuneraciones (mismas columnas que ENCABEZADOS)."""
+    for fila in calcular_periodo(empresa, desde, hasta):
+        trabajador, perfil = fila['trabajador'], fila['perfil']
+        yield [
+            perfil.rut,
+            f"{trabajador.first_name} {trabajador.last_name}",
+            perfil.cargo,
+            fila['dias_trabajados'],
+            fmt_horas(fila['seg_ordinarios']),
+            fmt_horas(fila['seg_extra_50']),
+            fmt_horas(fila['seg_extra_100']),
+            fila['minutos_atraso'],
+            fila['dias_ausencia'],
+            ", ".join(fila['observaciones'])
+        ]
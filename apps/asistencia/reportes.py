@@ -0,0 +1,344 @@
+"""
+Reportes pesados en segundo plano (pre-nómina, reporte DT y libros PDF).
+
+Generarlos dentro del request dejaba al worker web ocupado por minutos y el
+proxy cortaba la descarga. Ahora el panel llama a `solicitar`, que deja un
+`TrabajoReporte` y una tarea GENERAR_REPORTE en el outbox; `procesar_tareas`
+lo genera al storage e informa su avance, y el navegador consulta el estado
+hasta que el archivo está listo.
+
+Si ya existe un archivo con la misma huella (mismos filtros y sin cambios en
+los datos) se reutiliza en vez de generar otro.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from . import exportacion, libros, remuneraciones
+from .models import (
+    Marcacion, JornadaDiaria, Feriado, Vacacion, LicenciaMedica, Perfil, TareaPendiente, TrabajoReporte,
+)
+
+
+# Un archivo con la misma huella se reutiliza mientras no tenga más de estas horas
+REUTILIZAR = timedelta(hours=getattr(settings, 'REPORTES_REUTILIZAR_HORAS', 24))
+# Cada cuántas filas se informa el avance (y se renueva la tarea en el outbox)
+AVANCE_CADA = 1000
+
+ENCABEZADOS_FISCALIZACION = [
+    "ID Registro",
+    "RUT Trabajador",
+    "Nombre Completo",
+    "Fecha",
+    "Hora",
+    "Tipo de Marca",
+    "Origen",
+    "Geolocalización",
+    "Estado",
+    "Checksum (Hash)",
+    "Hash Cadena"
+]
+
+
+def parsear_fecha(texto):
+    """'YYYY-MM-DD' → date (None si viene vacío o mal formado)."""
+    try:
+        return datetime.strptime(texto, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def mes_actual():
+    return rango_mes(timezone.localdate())
+
+
+def rango_mes(dia):
+    """Primer y último día del mes de `dia`."""
+    inicio = dia.replace(day=1)
+    # Truco fin de mes
+    siguiente = inicio.replace(day=28) + timedelta(days=4)
+    return inicio, siguiente - timedelta(days=siguiente.day)
+
+
+def parsear_mes(texto):
+    """'YYYY-MM' (input type=month) → (primer día, último día), o None."""
+    fecha = parsear_fecha(f"{texto}-01") if texto else None
+    return rango_mes(fecha) if fecha else None
+
+
+# =======================================================
+# 1. CONTENIDO DE CADA REPORTE (lo usan las vistas y el worker)
+# =======================================================
+
+def marcas_fiscalizacion(empresa, desde=None, hasta=None):
+    """Marcas de la empresa para el reporte DT, más recientes primero (días en hora local)."""
+    marcas = Marcacion.objects.filter(trabajador__perfil__empresa=empresa).order_by('-timestamp')
+    if desde and hasta:
+        marcas = marcas.filter(
+            timestamp__gte=JornadaDiaria.rango_dia(desde)[0],
+            timestamp__lt=JornadaDiaria.rango_dia(hasta)[1],
+        )
+    return marcas
+
+
+def filas_fiscalizacion(marcas):
+    """Una fila por marca para el reporte DT, directo desde la BD."""
+    filas = marcas.values_list(
+        'id', 'trabajador__perfil__rut', 'trabajador__first_name', 'trabajador__last_name',
+        'timestamp', 'tipo', 'direccion', 'latitud', 'longitud', 'hash_actual'
+    ).iterator(chunk_size=exportacion.CHUNK_FILAS)
+
+    for marca_id, rut, nombre, apellido, timestamp, tipo, direccion, latitud, longitud, hash_actual in filas:
+        # A. Preparar datos de Fecha/Hora
+        fecha_local = timezone.localtime(timestamp)
+        fecha_str = fecha_local.strftime('%d/%m/%Y')
+        hora_str = fecha_local.strftime('%H:%M:%S')
+
+        # B. RUT seguro: si no tiene, "S/I"
+        rut_real = rut or "S/I"
+
+        # C. Generar HASH (Huella digital)
+        # Usamos el ID + RUT + Fecha + Hora para que sea único
+        raw_data = f"{marca_id}{rut_real}{fecha_str}{hora_str}{tipo}".encode('utf-8')
+        hash_seguridad = hashlib.sha256(raw_data).hexdigest()
+
+        # Geolocalización limpia (recortada para que no rompa el Excel)
+        geo_info = direccion if direccion else f"{latitud}, {longitud}"
+
+        yield [
+            marca_id,
+            rut_real,
+            f"{nombre} {apellido}".strip(),
+            fecha_str,
+            hora_str,
+            tipo,
+            "WEB/APP",
+            geo_info[:60],
+            "VIGENTE",  # (Aquí podrías poner lógica si tienes marcas anuladas o rectificadas)
+            hash_seguridad,
+            hash_actual,  # Hash guardado en la cadena de la marca (verificable)
+        ]
+
+
+def libro_fiscalizacion(filas):
+    """Libro write_only con estilos compartidos (Normativa DT)."""
+    wb, ws = exportacion.libro_solo_escritura("Registro de Asistencia", anchos={
+        'A': 12,  # ID
+        'B': 15,  # RUT
+        'C': 30,  # Nombre
+        'D': 12,  # Fecha
+        'E': 12,  # Hora
+        'H': 40,  # Geo
+        'J': 65,  # Hash
+        'K': 65,  # Hash cadena
+    })
+    exportacion.encabezados(ws, ENCABEZADOS_FISCALIZACION, 'encabezado_dt')
+
+    # Estilo por columna; el tipo de marca va con color (ENTRADA verde, SALIDA rojo)
+    estilos = ['centrado', 'centrado', None, 'centrado', 'centrado', None, 'centrado', None, 'centrado', 'hash', 'hash']
+    estilo_tipo = {'ENTRADA': 'marca_entrada', 'SALIDA': 'marca_salida'}
+
+    for fila in filas:
+        estilos[5] = estilo_tipo.get(fila[5], 'centrado')
+        ws.append([exportacion.celda(ws, valor, estilo) if estilo else valor for valor, estilo in zip(fila, estilos)])
+    return wb
+
+
+def libro_remuneraciones(filas):
+    wb, ws = exportacion.libro_solo_escritura("Pre-Nomina LRE", anchos={letra: 18 for letra in "ABCDEFGHIJ"})
+    exportacion.encabezados(ws, remuneraciones.ENCABEZADOS, 'encabezado_azul')
+    for fila in filas:
+        ws.append(fila)
+    return wb
+
+
+# =======================================================
+# 2. HUELLA (¿cambiaron los datos desde el último archivo?)
+# =======================================================
+
+def _firma_datos(tipo, empresa, usuario, desde, hasta):
+    """
+    Resumen barato del estado de los datos que entran al reporte. Las marcas solo
+    se insertan (rectificar crea una nueva), así que cantidad + último id las
+    cubre; contar direcciones detecta la geocodificación que llega después.
+    """
+    marcas_resumen = dict(total=Count('id'), ultima=Max('id'), con_direccion=Count('direccion'))
+
+    if tipo == 'FISCALIZACION':
+        return marcas_fiscalizacion(empresa, desde, hasta).order_by().aggregate(**marcas_resumen)
+
+    if tipo == 'LIBRO_PDF':
+        # La misma clave del PDF en caché (marcas del periodo del trabajador + logo)
+        return libros.clave_libro(usuario, empresa, desde, hasta)
+
+    if tipo == 'LIBROS_EMPRESA':
+        return {
+            'marcas': libros.huella_empresa(empresa, desde, hasta),
+            'trabajadores': list(Perfil.objects.filter(empresa=empresa, usuario__is_active=True).order_by('usuario_id').values_list('usuario_id', flat=True)),
+        }
+
+    # REMUNERACIONES: jornadas del periodo, ausencias justificadas, feriados y dotación
+    return {
+        'jornadas': JornadaDiaria.objects.filter(trabajador__perfil__empresa=empresa, fecha__range=[desde, hasta])
+                    .aggregate(total=Count('id'), actualizado=Max('actualizado')),
+        'vacaciones': Vacacion.objects.filter(trabajador__perfil__empresa=empresa, estado='APROBADA', inicio__lte=hasta, fin__gte=desde)
+                      .aggregate(total=Count('id'), ultima=Max('id')),
+        'licencias': LicenciaMedica.objects.filter(trabajador__perfil__empresa=empresa, inicio__lte=hasta, fin__gte=desde)
+                     .aggregate(total=Count('id'), ultima=Max('id')),
+        'feriados': Feriado.objects.filter(fecha__range=[desde, hasta]).aggregate(total=Count('id'), ultimo=Max('id')),
+        'trabajadores': list(Perfil.objects.filter(empresa=empresa, usuario__is_active=True).order_by('usuario_id').values_list('usuario_id', flat=True)),
+    }
+
+
+def calcular_huella(tipo, empresa, usuario, parametros):
+    desde, hasta = parsear_fecha(parametros.get('desde')), parsear_fecha(parametros.get('hasta'))
+    contenido = {
+        'tipo': tipo,
+        'empresa': empresa.id,
+        # El libro PDF es personal; los reportes de empresa se comparten entre quienes los piden
+        'usuario': usuario.id if tipo == 'LIBRO_PDF' else None,
+        'parametros': parametros,
+        'datos': _firma_datos(tipo, empresa, usuario, desde, hasta),
+    }
+    return hashlib.sha256(json.dumps(contenido, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# =======================================================
+# 3. SOLICITAR (request web)
+# =======================================================
+
+def normalizar_parametros(tipo, datos):
+    """Filtros válidos del reporte, con los mismos valores por defecto que las descargas directas."""
+    formato = datos.get('formato') if datos.get('formato') in exportacion.FORMATOS else 'xlsx'
+    if tipo == 'LIBRO_PDF':
+        formato = 'pdf'
+    elif tipo == 'LIBROS_EMPRESA':
+        formato = 'zip'
+
+    # El modal de remuneraciones usa fecha_inicio/fecha_fin; el panel DT desde/hasta; los libros un mes
+    desde = parsear_fecha(datos.get('desde') or datos.get('fecha_inicio'))
+    hasta = parsear_fecha(datos.get('hasta') or datos.get('fecha_fin'))
+    if not (desde and hasta) and parsear_mes(datos.get('mes')):
+        desde, hasta = parsear_mes(datos.get('mes'))
+    if tipo in ('REMUNERACIONES', 'LIBRO_PDF', 'LIBROS_EMPRESA') and not (desde and hasta):
+        desde, hasta = mes_actual()
+    if not (desde and hasta):
+        desde = hasta = None
+    return {
+        'desde': desde.isoformat() if desde else None,
+        'hasta': hasta.isoformat() if hasta else None,
+        'formato': formato,
+    }
+
+
+def solicitar(tipo, usuario, empresa, datos):
+    """
+    Devuelve (trabajo, reutilizado). Reutiliza un archivo vigente con la misma
+    huella o un trabajo idéntico que aún está en curso; si no, encola uno nuevo.
+    """
+    parametros = normalizar_parametros(tipo, datos)
+    huella = calcular_huella(tipo, empresa, usuario, parametros)
+
+    vigente = Q(estado__in=['PENDIENTE', 'EN_PROCESO']) | Q(estado='COMPLETADO', terminado_en__gte=timezone.now() - REUTILIZAR)
+    previo = TrabajoReporte.objects.filter(vigente, empresa=empresa, tipo=tipo, huella=huella).first()
+    if previo:
+        return previo, True
+
+    with transaction.atomic():
+        trabajo = TrabajoReporte.objects.create(
+            tipo=tipo, empresa=empresa, solicitado_por=usuario, parametros=parametros, huella=huella,
+        )
+        TareaPendiente.objects.create(tipo='GENERAR_REPORTE', datos={'trabajo_id': trabajo.id})
+    return trabajo, False
+
+
+# =======================================================
+# 4. GENERAR (worker)
+# =======================================================
+
+def _informar_avance(trabajo, tarea, hechos, total):
+    """Progreso hasta 95% (el resto es guardar el archivo)."""
+    ahora = timezone.now()
+    progreso = min(95, int(hechos * 95 / max(total, 1)))
+    TrabajoReporte.objects.filter(pk=trabajo.pk).update(progreso=progreso, updated_at=ahora)
+    # Latido: que otro worker no la retome por timeout mientras sigue avanzando
+    TareaPendiente.objects.filter(pk=tarea.pk).update(updated_at=ahora)
+
+
+def _con_avance(trabajo, tarea, filas, total):
+    """Deja pasar las filas informando el avance cada AVANCE_CADA."""
+    for i, fila in enumerate(filas, 1):
+        if i % AVANCE_CADA == 0:
+            _informar_avance(trabajo, tarea, i, total)
+        yield fila
+
+
+def _generar_archivo(trabajo, tarea):
+    """Devuelve (archivo, nombre) según el tipo de reporte."""
+    parametros = trabajo.parametros
+    desde, hasta = parsear_fecha(parametros.get('desde')), parsear_fecha(parametros.get('hasta'))
+    formato = parametros.get('formato', 'xlsx')
+    empresa = trabajo.empresa
+
+    if trabajo.tipo == 'LIBRO_PDF':
+        usuario = trabajo.solicitado_por
+        ruta, _ = libros.obtener_pdf(usuario, empresa, desde, hasta)
+        return File(default_storage.open(ruta, 'rb')), libros.nombre_archivo(usuario, desde, hasta)
+
+    if trabajo.tipo == 'LIBROS_EMPRESA':
+        resultado = libros.generar_libros_empresa(
+            empresa, desde, hasta, avance=lambda hechos, total: _informar_avance(trabajo, tarea, hechos, total)
+        )
+        return File(resultado['archivo']), resultado['nombre']
+
+    if trabajo.tipo == 'FISCALIZACION':
+        marcas = marcas_fiscalizacion(empresa, desde, hasta)
+        filas = _con_avance(trabajo, tarea, filas_fiscalizacion(marcas), marcas.count())
+        encabezados, construir = ENCABEZADOS_FISCALIZACION, libro_fiscalizacion
+        nombre = f"Reporte_Fiscalizacion_DT_{parametros.get('desde') or 'inicio'}_{parametros.get('hasta') or 'fin'}"
+    else:
+        filas = remuneraciones.filas_reporte(empresa, desde, hasta)
+        filas = _con_avance(trabajo, tarea, filas, Perfil.objects.filter(empresa=empresa).count())
+        encabezados, construir = remuneraciones.ENCABEZADOS, libro_remuneraciones
+        nombre = f"Remuneraciones_{empresa.nombre}_{desde}"
+
+    if formato == 'xlsx':
+        return File(exportacion.guardar_xlsx(construir(filas))), f"{nombre}.xlsx"
+    archivo = exportacion.guardar_csv(encabezados, filas, comprimir=(formato == 'csv.gz'))
+    return File(archivo), f"{nombre}.{formato}"
+
+
+def generar(tarea):
+    """Manejador de la tarea GENERAR_REPORTE (ver `tareas.MANEJADORES`)."""
+    trabajo = TrabajoReporte.objects.select_related('empresa', 'solicitado_por').get(pk=tarea.datos['trabajo_id'])
+    if trabajo.estado == 'COMPLETADO':
+        return
+
+    trabajo.estado = 'EN_PROCESO'
+    trabajo.progreso = 0
+    trabajo.save(update_fields=['estado', 'progreso', 'updated_at'])
+
+    try:
+        archivo, nombre = _generar_archivo(trabajo, tarea)
+        with archivo:
+            trabajo.archivo.save(nombre, archivo, save=False)
+    except Exception as e:
+        # La tarea se reintenta con backoff; el trabajo solo falla con el último intento
+        trabajo.estado = 'FALLIDO' if tarea.intentos >= tarea.max_intentos else 'PENDIENTE'
+        trabajo.error = f"{type(e).__name__}: {e}"
+        trabajo.save(update_fields=['estado', 'error', 'updated_at'])
+        raise
+
+    trabajo.nombre_archivo = nombre
+    trabajo.estado = 'COMPLETADO'
+    trabajo.progreso = 100
+    trabajo.error = None
+    trabajo.terminado_en = timezone.now()
+    trabajo.save(update_fields=['archivo', 'nombre_archivo', 'estado', 'progreso', 'error', 'terminado_en', 'updated_at'])
@@ -0,0 +1,220 @@
+"""
+Outbox de tareas en segundo plano para las marcas.
+
+`registrar_marca` solo guarda la marca (con su hash) y encola aquí el trabajo
+lento: geocodificación, subida de la foto a Cloudinary y comprobante por correo
+(que a su vez pasa por la bandeja de `correo.py`). Los reportes pesados de
+`reportes.py` y las nóminas de `importacion.py` usan la misma cola.
+El comando `procesar_tareas` consume la cola con reintentos y backoff.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import UnidentifiedImageError
+
+from . import contexto, correo, geocoding, imagenes, importacion, reportes
+from .models import Marcacion, TareaPendiente
+
+
+# Backoff exponencial: 30s, 60s, 120s... con tope de 1 hora
+BACKOFF_BASE_SEGUNDOS = getattr(settings, 'TAREAS_BACKOFF_BASE_SEGUNDOS', 30)
+BACKOFF_MAX_SEGUNDOS = getattr(settings, 'TAREAS_BACKOFF_MAX_SEGUNDOS', 3600)
+# Si un worker muere con una tarea tomada, otra la retoma pasado este tiempo
+TIMEOUT_EN_PROCESO = timedelta(minutes=getattr(settings, 'TAREAS_TIMEOUT_MINUTOS', 10))
+# Fotos recibidas esperando su subida a Cloudinary (storage por defecto, compartido con el worker)
+CARPETA_FOTOS = 'fotos_pendientes'
+
+
+# =======================================================
+# 1. ENCOLAR
+# =======================================================
+
+def encolar(tipo, marca=None, datos=None, archivo=None):
+    return TareaPendiente.objects.create(
+        tipo=tipo,
+        marca=marca,
+        datos=datos or {},
+        archivo=archivo,
+    )
+
+
+def encolar_marca(marca, foto=None, nombre_foto=None):
+    """
+    Encola el trabajo diferido de una marca recién guardada (misma transacción).
+    La foto (archivo) se deja en el storage y la tarea guarda solo su ruta: un temporal
+    subido se mueve sin leerlo a memoria y el binario no pasa por la BD.
+    """
+    if marca.direccion is None and marca.latitud and float(marca.latitud) != 0:
+        encolar('GEOCODIFICAR', marca=marca)
+
+    if foto:
+        ruta = default_storage.save(f'{CARPETA_FOTOS}/{nombre_foto}', foto)
+        try:
+            encolar('SUBIR_FOTO', marca=marca, datos={'nombre': nombre_foto, 'ruta': ruta})
+        except Exception:
+            default_storage.delete(ruta)
+            raise
+
+    if marca.trabajador.email:
+        encolar('ENVIAR_COMPROBANTE', marca=marca)
+
+
+# =======================================================
+# 2. MANEJADORES (uno por tipo de tarea)
+# =======================================================
+
+def geocodificar(tarea):
+    marca = tarea.marca
+    # Caché LRU/BD delante de Nominatim; si no hay turno (1 req/s) la tarea se reintenta
+    direccion = geocoding.obtener_direccion(marca.latitud, marca.longitud)
+
+    # update() directo: no re-ejecuta full_clean() ni toca el hash
+    Marcacion.objects.filter(pk=marca.pk).update(direccion=direccion[:255])
+
+
+def subir_foto(tarea):
+    marca = tarea.marca
+    nombre = tarea.datos.get('nombre') or f'marca_{marca.trabajador_id}_{marca.pk}.jpg'
+    ruta = tarea.datos.get('ruta')
+    if ruta:
+        with default_storage.open(ruta, 'rb') as archivo:
+            contenido = archivo.read()
+    else:
+        contenido = bytes(tarea.archivo)  # Tareas encoladas con la foto en la BD
+
+    try:
+        contenido, miniatura = imagenes.procesar_foto(contenido)
+        nombre = f"{nombre.rsplit('.', 1)[0]}.jpg"
+    except (UnidentifiedImageError, OSError):
+        # No es una imagen que Pillow entienda: se sube tal cual, sin miniatura
+        miniatura = None
+
+    # save=False: sube a Cloudinary y solo actualizamos las columnas de la foto
+    marca.foto.save(nombre, ContentFile(contenido), save=False)
+    if miniatura:
+        marca.miniatura.save(f"mini_{nombre}", ContentFile(miniatura), save=False)
+
+    Marcacion.objects.filter(pk=marca.pk).update(foto=marca.foto.name, miniatura=marca.miniatura.name or None)
+    if ruta:
+        default_storage.delete(ruta)
+
+
+def enviar_comprobante(tarea):
+    marca = Marcacion.objects.select_related('trabajador').get(pk=tarea.marca_id)
+    usuario = marca.trabajador
+    if not usuario.email:
+        return
+
+    # A. Preparar datos
+    hora_fmt = timezone.localtime(marca.timestamp).strftime('%H:%M:%S')
+    fecha_fmt = timezone.localtime(marca.timestamp).strftime('%d/%m/%Y')
+
+    # Empresa del trabajador (no la primera de la tabla: hay instalaciones multi-empresa)
+    perfil = contexto.obtener_perfil(usuario)
+    datos_empresa = perfil.empresa if perfil else None
+    nombre_empresa = datos_empresa.nombre if datos_empresa else "Su Empresa"
+    email_rrhh = datos_empresa.email_rrhh if datos_empresa else None
+
+    # Enlace a Google Maps
+    link_maps = f"https://www.google.com/maps?q={marca.latitud},{marca.longitud}"
+    ubicacion_texto = marca.direccion if marca.direccion else "Coordenadas GPS"
+
+    # B. Asunto y remitente
+    asunto = f'✅ Comprobante de Asistencia: {marca.tipo} - {usuario.get_full_name()}'
+    remitente = f"Sistema de Asistencia <{settings.EMAIL_HOST_USER}>"
+
+    # C. Se encola en la bandeja de correos (HTML desde plantilla; la copia a RRHH va como correo aparte)
+    correo.encolar_correo(
+        asunto,
+        usuario.email,
+        plantilla='correos/comprobante_marca.html',
+        contexto={
+            'marca': marca,
+            'usuario': usuario,
+            'nombre_empresa': nombre_empresa,
+            'fecha_fmt': fecha_fmt,
+            'hora_fmt': hora_fmt,
+            'link_maps': link_maps,
+            'ubicacion_texto': ubicacion_texto,
+        },
+        copia=[email_rrhh],
+        remitente=remitente,
+    )
+
+
+MANEJADORES = {
+    'GEOCODIFICAR': geocodificar,
+    'SUBIR_FOTO': subir_foto,
+    'ENVIAR_COMPROBANTE': enviar_comprobante,
+    'GENERAR_REPORTE': reportes.generar,
+    'IMPORTAR_NOMINA': importacion.procesar,
+}
+
+
+# =======================================================
+# 3. PROCESAMIENTO (worker)
+# =======================================================
+
+def calcular_backoff(intentos):
+    segundos = BACKOFF_BASE_SEGUNDOS * (2 ** max(intentos - 1, 0))
+    return timedelta(seconds=min(segundos, BACKOFF_MAX_SEGUNDOS))
+
+
+def tomar_lote(limite=20, tipos=None):
+    """
+    Reserva hasta `limite` tareas listas para ejecutarse.
+    skip_locked permite varios workers en paralelo sin pisarse (en PostgreSQL/MySQL).
+    """
+    ahora = timezone.now()
+    listas = Q(estado='PENDIENTE', ejecutar_desde__lte=ahora) | Q(
+        estado='EN_PROCESO', updated_at__lt=ahora - TIMEOUT_EN_PROCESO
+    )
+
+    with transaction.atomic():
+        qs = TareaPendiente.objects.select_for_update(skip_locked=True).filter(listas)
+        if tipos:
+            qs = qs.filter(tipo__in=tipos)
+        ids = list(qs.order_by('id').values_list('id', flat=True)[:limite])
+        TareaPendiente.objects.filter(id__in=ids).update(estado='EN_PROCESO', updated_at=ahora)
+
+    return list(TareaPendiente.objects.filter(id__in=ids).select_related('marca', 'marca__trabajador').order_by('id'))
+
+
+def ejecutar(tarea):
+    """Ejecuta una tarea y deja registrado su resultado. Devuelve True si terminó bien."""
+    manejador = MANEJADORES[tarea.tipo]
+    tarea.intentos += 1
+
+    try:
+        manejador(tarea)
+    except Exception as e:
+        tarea.ultimo_error = f"{type(e).__name__}: {e}"
+        if tarea.intentos >= tarea.max_intentos:
+            tarea.estado = 'FALLIDA'
+        else:
+            tarea.estado = 'PENDIENTE'
+            tarea.ejecutar_desde = timezone.now() + calcular_backoff(tarea.intentos)
+        tarea.save(update_fields=['estado', 'intentos', 'ejecutar_desde', 'ultimo_error', 'updated_at'])
+        return False
+
+    tarea.estado = 'COMPLETADA'
+    tarea.ultimo_error = None
+    tarea.archivo = None  # Liberamos el binario (la foto ya está en Cloudinary)
+    tarea.save(update_fields=['estado', 'intentos', 'ultimo_error', 'archivo', 'updated_at'])
+    return True
+
+
+def procesar_pendientes(limite=20, tipos=None):
+    """Procesa un lote. Devuelve (completadas, con_error)."""
+    completadas, con_error = 0, 0
+    for tarea in tomar_lote(limite, tipos):
+        if ejecutar(tarea):
+            completadas += 1
+        else:
+            con_error += 1
+    return completadas, con_error
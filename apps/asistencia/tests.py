@@ -1,9 +1,34 @@
-from django.test import TestCase
+import base64
+import importlib
+import io
+import tempfile
+import json
+import smtplib
+import csv
+import gzip
+import zipfile
+import openpyxl
+from pathlib import Path
+from unittest import mock
+from PIL import Image, UnidentifiedImageError
+from django.apps import apps as django_apps
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import timedelta, date, datetime, time as dt_time
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
-from .models import Marcacion, Perfil
+from django.db import IntegrityError
+from .models import Marcacion, Empresa, Perfil, Feriado, Vacacion, LicenciaMedica, LogAlerta, TareaPendiente, DireccionCache, CadenaMarcas, VerificacionCadena, CorreoSaliente, JornadaDiaria, AnimoDiario, TrabajoReporte, EstadoTrabajo, ImportacionNomina
+from . import views, tareas, geocoding, imagenes, correo, contexto, ntp_time, remuneraciones, reportes, libros, clima, paginacion, jornadas, alertas, planificador, importacion
 
 class CalculoJornadaTests(TestCase):
 
@@ -88,4 +113,1853 @@ class CalculoJornadaTests(TestCase):
                 latitud=0, longitud=0 # <-- AGREGADO
             )
 
-        print("   ✅ ÉXITO: El sistema bloqueó la inconsistencia temporal.")
\ No newline at end of file
+        print("   ✅ ÉXITO: El sistema bloqueó la inconsistencia temporal.")
+
+class OutboxTareasTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.user = User.objects.create_user(username='outbox', password='123', email='outbox@test.cl')
+
+    def crear_marca(self, **extra):
+        datos = dict(trabajador=self.user, tipo='ENTRADA', timestamp=timezone.now(), latitud='-33.4489000', longitud='-70.6693000')
+        datos.update(extra)
+        return Marcacion.objects.create(**datos)
+
+    def test_encolar_marca_crea_tareas(self):
+        """Una marca con GPS, foto y email genera las tres tareas diferidas"""
+        marca = self.crear_marca()
+        tareas.encolar_marca(marca, foto=ContentFile(b'jpeg'), nombre_foto='x.jpg')
+
+        tipos = set(TareaPendiente.objects.filter(marca=marca).values_list('tipo', flat=True))
+        self.assertEqual(tipos, {'GEOCODIFICAR', 'SUBIR_FOTO', 'ENVIAR_COMPROBANTE'})
+
+    def test_subir_foto_desde_el_storage(self):
+        """La tarea guarda solo la ruta de la foto; el worker la sube y borra el pendiente"""
+        marca = self.crear_marca()
+        imagen = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(imagen, format='JPEG')
+        tareas.encolar_marca(marca, foto=ContentFile(imagen.getvalue()), nombre_foto='x.jpg')
+
+        tarea = TareaPendiente.objects.get(tipo='SUBIR_FOTO')
+        self.assertIsNone(tarea.archivo)
+        self.assertTrue(default_storage.exists(tarea.datos['ruta']))
+
+        campos = [Marcacion._meta.get_field(nombre) for nombre in ('foto', 'miniatura')]
+        with mock.patch.object(campos[0], 'storage', default_storage), mock.patch.object(campos[1], 'storage', default_storage):
+            self.assertEqual(tareas.procesar_pendientes(tipos=['SUBIR_FOTO']), (1, 0))
+
+        marca.refresh_from_db()
+        self.assertTrue(marca.foto.name and marca.miniatura.name)
+        self.assertFalse(default_storage.exists(tarea.datos['ruta']))
+
+    def test_comprobante_se_envia(self):
+        marca = self.crear_marca(direccion='Av. Siempre Viva 742')
+        tarea = tareas.encolar('ENVIAR_COMPROBANTE', marca=marca)
+
+        completadas, con_error = tareas.procesar_pendientes()
+        self.assertEqual((completadas, con_error), (1, 0))
+
+        # El comprobante queda en la bandeja y sale en el siguiente lote de correos
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(correo.enviar_pendientes(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Av. Siempre Viva 742', mail.outbox[0].alternatives[0][0])
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, 'COMPLETADA')
+
+    def test_error_reintenta_con_backoff(self):
+        """Si el manejador falla, la tarea vuelve a PENDIENTE con backoff hasta agotar intentos"""
+        marca = self.crear_marca()
+        tarea = tareas.encolar('GEOCODIFICAR', marca=marca)
+
+        with mock.patch.dict(tareas.MANEJADORES, {'GEOCODIFICAR': mock.Mock(side_effect=TimeoutError('Nominatim'))}):
+            tareas.procesar_pendientes()
+            tarea.refresh_from_db()
+            self.assertEqual(tarea.estado, 'PENDIENTE')
+            self.assertEqual(tarea.intentos, 1)
+            self.assertGreater(tarea.ejecutar_desde, timezone.now())
+            self.assertIn('Nominatim', tarea.ultimo_error)
+
+            # Mientras dure el backoff no se vuelve a tomar
+            self.assertEqual(tareas.procesar_pendientes(), (0, 0))
+
+            tarea.intentos = tarea.max_intentos - 1
+            tarea.ejecutar_desde = timezone.now()
+            tarea.save()
+            tareas.procesar_pendientes()
+            tarea.refresh_from_db()
+            self.assertEqual(tarea.estado, 'FALLIDA')
+
+
+class BandejaCorreosTests(TestCase):
+
+    def encolar(self, destinatario, n=1):
+        for i in range(n):
+            correo.encolar_correo(f'Aviso {i}', destinatario, texto='hola')
+
+    def test_lote_usa_una_sola_conexion(self):
+        self.encolar('a@test.cl', 3)
+        self.encolar('b@test.cl', 2)
+
+        with mock.patch.object(correo, 'get_connection', wraps=correo.get_connection) as conexion:
+            self.assertEqual(correo.enviar_pendientes(), (5, 0))
+
+        conexion.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(CorreoSaliente.objects.exclude(estado='ENVIADO').exists())
+
+    def test_plantilla_y_copia(self):
+        marca_falsa = {'tipo': 'ENTRADA'}
+        correo.encolar_correo(
+            'Comprobante', 'trabajador@test.cl', plantilla='correos/comprobante_marca.html',
+            contexto={'marca': marca_falsa, 'nombre_empresa': 'ACME'}, copia=['rrhh@test.cl', None],
+        )
+        correo.enviar_pendientes()
+
+        # La copia sale como correo propio, con el mismo contenido
+        self.assertEqual([m.to for m in mail.outbox], [['trabajador@test.cl'], ['rrhh@test.cl']])
+        enviado = mail.outbox[0]
+        self.assertIn('ACME', enviado.alternatives[0][0])
+        self.assertNotIn('<table', enviado.body)
+        self.assertEqual(mail.outbox[1].alternatives[0][0], enviado.alternatives[0][0])
+
+    def test_limite_por_destinatario(self):
+        self.encolar('rrhh@test.cl', 3)
+
+        with mock.patch.object(correo, 'MAX_POR_DESTINATARIO', 2):
+            self.assertEqual(correo.enviar_pendientes(), (2, 0))
+
+        postergado = CorreoSaliente.objects.get(estado='PENDIENTE')
+        self.assertEqual(postergado.intentos, 0)
+        self.assertGreater(postergado.ejecutar_desde, timezone.now())
+
+    def test_limite_cuenta_las_copias(self):
+        """RRHH va en copia de cada comprobante: es el buzón que más recibe y el límite lo alcanza"""
+        for i in range(3):
+            correo.encolar_correo(f'Comprobante {i}', f'trabajador{i}@test.cl', texto='hola', copia=['rrhh@test.cl'])
+
+        with mock.patch.object(correo, 'MAX_POR_DESTINATARIO', 2):
+            self.assertEqual(correo.enviar_pendientes(), (5, 0))
+
+        # Los tres trabajadores reciben su comprobante; solo la tercera copia a RRHH espera
+        self.assertEqual(sum(m.to == ['rrhh@test.cl'] for m in mail.outbox), 2)
+        postergado = CorreoSaliente.objects.get(estado='PENDIENTE')
+        self.assertEqual((postergado.destinatario, postergado.asunto), ('rrhh@test.cl', 'Comprobante 2'))
+
+    def test_error_smtp_reintenta_con_backoff(self):
+        self.encolar('a@test.cl')
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPServerDisconnected('caído')):
+            self.assertEqual(correo.enviar_pendientes(), (0, 1))
+
+        pendiente = CorreoSaliente.objects.get()
+        self.assertEqual(pendiente.estado, 'PENDIENTE')
+        self.assertEqual(pendiente.intentos, 1)
+        self.assertGreater(pendiente.ejecutar_desde, timezone.now())
+        self.assertIn('caído', pendiente.ultimo_error)
+
+
+class ContextoEmpresaTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(nombre='ACME', rut='11.111.111-1', email_rrhh='rrhh@acme.cl')
+        self.user = User.objects.create_user(username='contexto', password='123', email='contexto@test.cl')
+        self.user.perfil.empresa = self.empresa
+        self.user.perfil.save()
+
+    def test_perfil_y_empresa_en_una_consulta_y_luego_cache(self):
+        usuario = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            perfil = contexto.obtener_perfil(usuario)
+            self.assertEqual(usuario.perfil.empresa.nombre, 'ACME')
+
+        otro_request = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            contexto.obtener_perfil(otro_request)
+            self.assertTrue(hasattr(otro_request, 'perfil'))
+            self.assertEqual(otro_request.perfil.empresa, self.empresa)
+
+    def test_guardar_empresa_invalida_cache(self):
+        contexto.obtener_perfil(self.user)
+        self.empresa.nombre = 'ACME Nueva'
+        self.empresa.save()
+
+        usuario = User.objects.get(pk=self.user.pk)
+        self.assertEqual(contexto.obtener_perfil(usuario).empresa.nombre, 'ACME Nueva')
+
+    def test_middleware_adjunta_empresa(self):
+        self.client.force_login(self.user)
+        respuesta = self.client.get(reverse('home'))
+        self.assertEqual(respuesta.wsgi_request.empresa, self.empresa)
+
+    def test_comprobante_usa_empresa_del_trabajador(self):
+        """Antes se tomaba Empresa.objects.first(), incorrecto con varias empresas"""
+        otra = Empresa.objects.create(nombre='Otra', rut='22.222.222-2', email_rrhh='rrhh@otra.cl')
+        self.user.perfil.empresa = otra
+        self.user.perfil.save()
+
+        marca = Marcacion.objects.create(trabajador=self.user, tipo='ENTRADA', timestamp=timezone.now(), latitud='-33.4489000', longitud='-70.6693000')
+        tareas.enviar_comprobante(tareas.encolar('ENVIAR_COMPROBANTE', marca=marca))
+
+        enviado = CorreoSaliente.objects.get(destinatario=self.user.email)
+        self.assertTrue(CorreoSaliente.objects.filter(destinatario='rrhh@otra.cl').exists())
+        self.assertIn('Otra', enviado.cuerpo_html)
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_guardar_usuario_no_pisa_perfil_con_la_cache(self):
+        """Un Perfil cambiado por otro proceso (su caché no se invalidó aquí) sobrevive al user.save()"""
+        self.user.set_password('clave-inicial')
+        self.user.save()
+        self.client.force_login(self.user)
+        self.client.get(reverse('home'))  # Deja el perfil en la caché del contexto
+
+        otra = Empresa.objects.create(nombre='Otra', rut='22.222.222-2', email_rrhh='rrhh@otra.cl')
+        Perfil.objects.filter(usuario=self.user).update(empresa=otra, cargo='Supervisor', trabaja_sabado=True)
+
+        self.client.post(reverse('cambiar_password_obligatorio'), {
+            'old_password': 'clave-inicial', 'new_password1': 'Nueva-Clave-2024', 'new_password2': 'Nueva-Clave-2024',
+        })
+
+        perfil = Perfil.objects.get(usuario=self.user)
+        self.assertEqual((perfil.empresa, perfil.cargo, perfil.trabaja_sabado), (otra, 'Supervisor', True))
+        self.assertFalse(perfil.cambiar_pass_inicial)
+
+
+class RelojNtpTests(TestCase):
+
+    def setUp(self):
+        self.reiniciar_reloj()
+        # El offset de estos tests no debe quedar aplicado a las marcas de otros tests
+        self.addCleanup(self.reiniciar_reloj)
+        parche = mock.patch.object(ntp_time, 'iniciar_servicio')
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def reiniciar_reloj(self):
+        cache.delete(ntp_time.CLAVE_ESTADO)
+        ntp_time._local.update(version=None, offset_ns=0, ancla_mono=None, ancla_oficial=None, releido=None)
+
+    def sincronizar_con_offset(self, offset):
+        respuesta = mock.Mock(offset=offset, delay=0.02)
+        with mock.patch('ntplib.NTPClient.request', return_value=respuesta):
+            return ntp_time.sincronizar()
+
+    def test_hora_oficial_aplica_offset_sin_red(self):
+        self.sincronizar_con_offset(90.0)
+
+        with mock.patch('ntplib.NTPClient.request') as consulta:
+            hora = ntp_time.hora_oficial()
+        consulta.assert_not_called()
+
+        desfase = (hora - timezone.now()).total_seconds()
+        self.assertAlmostEqual(desfase, 90.0, delta=1)
+        self.assertTrue(ntp_time.estado_reloj()['sincronizado'])
+        self.assertEqual(ntp_time.obtener_hora_oficial_chile()['origen'], 'SHOA (Oficial)')
+
+    def test_fallo_conserva_offset_y_se_vuelve_obsoleto(self):
+        self.sincronizar_con_offset(2.5)
+        with mock.patch('ntplib.NTPClient.request', side_effect=OSError('sin red')):
+            estado = ntp_time.sincronizar()
+        self.assertEqual(estado['offset_us'], 2_500_000)
+        self.assertEqual(estado['error'], 'sin red')
+
+        estado['sincronizado_en'] -= ntp_time.MAX_ANTIGUEDAD + 1
+        cache.set(ntp_time.CLAVE_ESTADO, estado, None)
+        self.assertFalse(ntp_time.estado_reloj()['sincronizado'])
+        self.assertFalse(ntp_time.obtener_hora_oficial_chile()['sincronizado'])
+
+    def test_fallo_queda_en_el_log(self):
+        with mock.patch('ntplib.NTPClient.request', side_effect=OSError('sin red')):
+            with self.assertLogs('apps.asistencia.ntp_time', level='WARNING') as registro:
+                ntp_time.sincronizar()
+        self.assertIn('sin red', registro.output[0])
+        self.assertIn('Reloj sin sincronizar', registro.output[1])
+
+    def test_salud_expone_el_reloj(self):
+        staff = User.objects.create_user(username='monitor', password='123', is_staff=True)
+        self.client.force_login(staff)
+
+        respuesta = self.client.get(reverse('estado_servicios'))
+        self.assertEqual(respuesta.status_code, 503)
+
+        self.sincronizar_con_offset(1.5)
+        datos = self.client.get(reverse('estado_servicios')).json()
+        self.assertEqual((datos['reloj']['sincronizado'], datos['reloj']['offset_us']), (True, 1_500_000))
+        self.assertIn('tasa_aciertos', datos['geocoding']['este_proceso'])
+
+    def test_sin_sincronizar_usa_hora_local(self):
+        self.assertAlmostEqual((ntp_time.hora_oficial() - timezone.now()).total_seconds(), 0, delta=1)
+        self.assertFalse(ntp_time.estado_reloj()['sincronizado'])
+
+
+class JornadaDiariaTests(TestCase):
+    """La tabla materializada se mantiene al marcar, rectificar y borrar"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.user = User.objects.create_user(username='jornada', password='123', first_name='Ana', last_name='Pérez')
+        self.user.perfil.empresa = self.empresa
+        self.user.perfil.save()
+
+    def marcar(self, tipo, hora, minuto, dia=3):
+        ts = timezone.make_aware(datetime(2025, 3, dia, hora, minuto))
+        return Marcacion.objects.create(trabajador=self.user, tipo=tipo, timestamp=ts, latitud='-33.4489000', longitud='-70.6693000')
+
+    def test_se_actualiza_con_cada_marca(self):
+        self.marcar('ENTRADA', 9, 0)
+        jornada = JornadaDiaria.objects.get(trabajador=self.user)
+        self.assertEqual(jornada.fecha, date(2025, 3, 3))
+        self.assertIsNone(jornada.salida)
+        self.assertEqual(jornada.estado, 'warning')  # Día pasado sin salida
+
+        self.marcar('INICIO_COLACION', 13, 0)
+        self.marcar('FIN_COLACION', 13, 45)
+        self.marcar('SALIDA', 18, 30)
+
+        jornada.refresh_from_db()
+        self.assertEqual(jornada.total_marcas, 4)
+        self.assertEqual(jornada.segundos_trabajados, 9 * 3600 + 30 * 60)
+        self.assertEqual(jornada.segundos_colacion, 45 * 60)
+        self.assertEqual((jornada.estado, jornada.duracion), ('success', '9h 30m'))
+
+    def test_rectificacion_y_borrado(self):
+        entrada = self.marcar('ENTRADA', 9, 0)
+        self.marcar('SALIDA', 18, 0)
+
+        # Rectificación: la marca vieja queda histórica y la nueva manda
+        entrada.estado = 'RECTIFICADA'
+        entrada.save()
+        Marcacion.objects.create(
+            trabajador=self.user, tipo='ENTRADA', es_manual=True, marca_reemplazada=entrada,
+            timestamp=timezone.make_aware(datetime(2025, 3, 3, 8, 0)), latitud='-33.4489000', longitud='-70.6693000',
+        )
+        jornada = JornadaDiaria.objects.get(trabajador=self.user)
+        self.assertEqual(jornada.segundos_trabajados, 10 * 3600)
+        self.assertTrue(jornada.tiene_manual)
+        self.assertFalse(jornada.doble_entrada)
+
+        Marcacion.objects.filter(trabajador=self.user).delete()
+        self.assertFalse(JornadaDiaria.objects.exists())
+
+    def test_doble_entrada(self):
+        self.marcar('ENTRADA', 9, 0)
+        self.marcar('ENTRADA', 10, 0)
+        self.marcar('SALIDA', 18, 0)
+        jornada = JornadaDiaria.objects.get()
+        self.assertTrue(jornada.doble_entrada)
+        self.assertEqual(jornada.entrada, timezone.make_aware(datetime(2025, 3, 3, 9, 0)))
+        self.assertEqual(jornada.estado, 'warning')
+
+    def test_marca_desordenada_rehace_el_dia(self):
+        """Una marca offline más antigua que la última del día no se suma al final"""
+        self.marcar('ENTRADA', 10, 0)
+        self.marcar('SALIDA', 18, 0)
+        self.marcar('ENTRADA', 8, 0)
+        jornada = JornadaDiaria.objects.get()
+        self.assertEqual(jornada.entrada, timezone.make_aware(datetime(2025, 3, 3, 8, 0)))
+        self.assertEqual(jornada.segundos_trabajados, 10 * 3600)
+        self.assertTrue(jornada.doble_entrada)
+        self.assertFalse(jornada.abierta)
+
+    def test_reconstruir_desde_las_marcas(self):
+        for dia in (3, 4, 5):
+            self.marcar('ENTRADA', 9, 0, dia)
+            self.marcar('SALIDA', 17, 0, dia)
+        esperado = list(JornadaDiaria.objects.order_by('fecha').values_list('fecha', 'entrada', 'salida', 'segundos_trabajados'))
+
+        JornadaDiaria.objects.all().delete()
+        call_command('reconstruir_jornadas', '--desde', '2025-03-04', stdout=io.StringIO())
+        self.assertEqual(JornadaDiaria.objects.count(), 2)
+
+        call_command('reconstruir_jornadas', '--empresa', str(self.empresa.id), '--lote', '2', stdout=io.StringIO())
+        self.assertEqual(
+            list(JornadaDiaria.objects.order_by('fecha').values_list('fecha', 'entrada', 'salida', 'segundos_trabajados')),
+            esperado,
+        )
+
+    def test_migracion_rellena_las_jornadas_existentes(self):
+        """Al migrar, las marcas históricas ya tienen su jornada (los reportes no quedan en blanco)"""
+        self.marcar('ENTRADA', 9, 0)
+        self.marcar('INICIO_COLACION', 13, 0)
+        self.marcar('FIN_COLACION', 14, 0)
+        self.marcar('SALIDA', 18, 0)
+        self.marcar('ENTRADA', 9, 0, dia=4)
+        self.marcar('ENTRADA', 10, 0, dia=4)
+        campos = [f.name for f in JornadaDiaria._meta.fields if f.name not in ('id', 'actualizado')]
+        esperado = list(JornadaDiaria.objects.order_by('fecha').values_list(*campos))
+        JornadaDiaria.objects.all().delete()  # Como justo después de crear la tabla
+
+        migracion = importlib.import_module('apps.asistencia.migrations.0015_jornadadiaria')
+        migracion.rellenar_jornadas(django_apps, None)
+
+        self.assertEqual(list(JornadaDiaria.objects.order_by('fecha').values_list(*campos)), esperado)
+        self.assertEqual(esperado[0][campos.index('segundos_trabajados')], 9 * 3600)
+
+    def test_panel_fiscalizador_lee_las_jornadas(self):
+        self.marcar('ENTRADA', 9, 0)
+        self.marcar('SALIDA', 18, 0)
+        self.marcar('SALIDA', 18, 0, dia=4)  # Salida huérfana
+
+        fiscalizador = User.objects.create_user(username='dt', password='123')
+        fiscalizador.perfil.empresa = self.empresa
+        fiscalizador.perfil.rol = 'FISCALIZADOR'
+        fiscalizador.perfil.save()
+        self.client.force_login(fiscalizador)
+
+        with self.assertNumQueries(4):  # sesión, usuario, perfil+empresa y jornadas
+            respuesta = self.client.get(reverse('panel_fiscalizador'), {'desde': '2025-03-01', 'hasta': '2025-03-31'})
+        jornadas = list(respuesta.context['jornadas'])
+        self.assertEqual([j.fecha for j in jornadas], [date(2025, 3, 4), date(2025, 3, 3)])
+        self.assertEqual([j.estado for j in jornadas], ['danger', 'success'])
+        self.assertContains(respuesta, '9h 0m')
+
+
+class RemuneracionesTests(TestCase):
+    """Mismos números que el cálculo día a día del reporte original"""
+    DESDE = date(2025, 3, 3)   # Lunes
+    HASTA = date(2025, 3, 9)   # Domingo
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.user = self.crear_trabajador('nomina')
+
+        Feriado.objects.create(fecha=date(2025, 3, 5), descripcion='Feriado de prueba')
+        Vacacion.objects.create(trabajador=self.user, inicio=date(2025, 3, 4), fin=date(2025, 3, 4), estado='APROBADA')
+        LicenciaMedica.objects.create(trabajador=self.user, inicio=date(2025, 3, 6), fin=date(2025, 3, 6))
+
+        self.marcar(self.user, 'ENTRADA', 3, 9, 20)          # Lunes: 20 min de atraso
+        self.marcar(self.user, 'SALIDA', 3, 20, 20)          # 10h netas => 9 ord + 1 H.E. 50%
+        self.marcar(self.user, 'ENTRADA', 5, 10, 0)          # Feriado => H.E. 100%
+        self.marcar(self.user, 'SALIDA', 5, 15, 0)
+        self.marcar(self.user, 'INICIO_COLACION', 8, 13, 0)  # Sábado: cuenta el día, sin horas
+        self.marcar(self.user, 'ENTRADA', 9, 8, 0)           # Domingo => H.E. 100%
+        self.marcar(self.user, 'SALIDA', 9, 12, 0)
+        # Viernes 7 sin marcas ni justificación => 1 ausencia
+
+    def crear_trabajador(self, username):
+        user = User.objects.create_user(username=username, password='123')
+        user.perfil.empresa = self.empresa
+        user.perfil.save()
+        return user
+
+    def marcar(self, user, tipo, dia, hora, minuto):
+        ts = timezone.make_aware(datetime(2025, 3, dia, hora, minuto))
+        Marcacion.objects.create(trabajador=user, tipo=tipo, timestamp=ts, latitud='-33.4489000', longitud='-70.6693000')
+
+    def test_totales_del_periodo(self):
+        fila = remuneraciones.calcular_periodo(self.empresa, self.DESDE, self.HASTA)[0]
+
+        self.assertEqual(fila['dias_trabajados'], 4)
+        self.assertEqual(remuneraciones.fmt_horas(fila['seg_ordinarios']), '09:00')
+        self.assertEqual(remuneraciones.fmt_horas(fila['seg_extra_50']), '01:00')
+        self.assertEqual(remuneraciones.fmt_horas(fila['seg_extra_100']), '07:00')
+        self.assertEqual(fila['minutos_atraso'], 20)
+        self.assertEqual(fila['dias_ausencia'], 1)
+        self.assertEqual(fila['observaciones'], ['1 Ausencias injustificadas'])
+
+    def test_consultas_constantes(self):
+        for i in range(3):
+            self.crear_trabajador(f'extra{i}')
+
+        with self.assertNumQueries(5):
+            filas = remuneraciones.calcular_periodo(self.empresa, self.DESDE, self.HASTA)
+        self.assertEqual(len(filas), 4)
+        # Sin marcas: falta los días hábiles salvo el feriado
+        self.assertEqual(filas[-1]['dias_ausencia'], 4)
+
+    def test_excel_de_remuneraciones(self):
+        self.user.perfil.rol = 'EMPLEADOR'  # La nómina de la empresa es solo para RRHH
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+        respuesta = self.client.get(reverse('reporte_remuneraciones'), {'fecha_inicio': '2025-03-03', 'fecha_fin': '2025-03-09'})
+
+        hoja = openpyxl.load_workbook(io.BytesIO(respuesta.getvalue())).active
+        fila = [c.value for c in hoja[2]]
+        self.assertEqual(fila[3:9], [4, '09:00', '01:00', '07:00', 20, 1])
+
+    def test_vacacion_el_ultimo_dia(self):
+        """Como antes, la observación de vacaciones mira solo el último día del periodo"""
+        perfil = self.user.perfil
+        fila = remuneraciones.calcular_trabajador(perfil, {}, self.DESDE, self.HASTA, dias_vacacion={self.HASTA})
+        self.assertIn('Periodo con Vacaciones', fila['observaciones'])
+
+        fila = remuneraciones.calcular_trabajador(perfil, {}, self.DESDE, self.HASTA, dias_vacacion={self.DESDE})
+        self.assertNotIn('Periodo con Vacaciones', fila['observaciones'])
+
+
+class ExportacionExcelTests(TestCase):
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.user = User.objects.create_user(username='export', password='123', first_name='Ana', last_name='Pérez')
+        self.user.perfil.empresa = self.empresa
+        self.user.perfil.rut = '11.111.111-1'
+        self.user.perfil.cargo = 'Analista'
+        self.user.perfil.rol = 'EMPLEADOR'
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+
+        for tipo, hora, minuto in [('ENTRADA', 9, 0), ('INICIO_COLACION', 13, 0), ('FIN_COLACION', 13, 45), ('SALIDA', 18, 30)]:
+            Marcacion.objects.create(
+                trabajador=self.user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000',
+                timestamp=timezone.make_aware(datetime(2025, 3, 3, hora, minuto)),
+                animo='FELIZ' if tipo == 'SALIDA' else None,
+            )
+
+    def descargar(self, nombre_url, **params):
+        respuesta = self.client.get(reverse(nombre_url), params)
+        self.assertTrue(respuesta.streaming)
+        contenido = b''.join(respuesta.streaming_content)
+        return [[c.value for c in fila] for fila in openpyxl.load_workbook(io.BytesIO(contenido)).active.iter_rows()]
+
+    def test_reporte_detallado_agrupa_por_dia(self):
+        filas = self.descargar('exportar_excel_empresa')
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1], ['03/03/2025', 'ACME', 'Ana Pérez', '11.111.111-1', 'Analista', '09:00', '13:00', '13:45', '00:45', '18:30', '09:30'])
+
+    def test_reporte_fiscalizacion(self):
+        filas = self.descargar('reporte_fiscalizacion', desde='2025-03-01', hasta='2025-03-31')
+        self.assertEqual(len(filas), 5)
+        self.assertEqual(filas[1][1:6], ['11.111.111-1', 'Ana Pérez', '03/03/2025', '18:30:00', 'SALIDA'])
+        self.assertEqual(len(filas[1][9]), 64)
+
+    def descargar_csv(self, nombre_url, **params):
+        respuesta = self.client.get(reverse(nombre_url), params)
+        contenido = b''.join(respuesta.streaming_content)
+        if params.get('formato') == 'csv.gz':
+            contenido = gzip.decompress(contenido)
+        return list(csv.reader(io.StringIO(contenido.decode('utf-8-sig'))))
+
+    def test_fiscalizacion_csv_con_hash_de_la_cadena(self):
+        filas = self.descargar_csv('reporte_fiscalizacion', formato='csv')
+        self.assertEqual(filas[0][-1], 'Hash Cadena')
+        self.assertEqual(len(filas), 5)
+
+        salida = Marcacion.objects.get(tipo='SALIDA')
+        self.assertEqual(filas[1][0], str(salida.id))
+        self.assertEqual(filas[1][-1], salida.hash_actual)
+
+    def test_csv_gz_igual_al_csv(self):
+        self.assertEqual(
+            self.descargar_csv('exportar_excel_empresa', formato='csv.gz'),
+            self.descargar_csv('exportar_excel_empresa', formato='csv'),
+        )
+
+    def test_remuneraciones_csv(self):
+        filas = self.descargar_csv('reporte_remuneraciones', formato='csv', fecha_inicio='2025-03-03', fecha_fin='2025-03-03')
+        self.assertEqual(filas[0], remuneraciones.ENCABEZADOS)
+        self.assertEqual(filas[1][:5], ['11.111.111-1', 'Ana Pérez', 'Analista', '1', '08:30'])
+
+    def test_clima_laboral(self):
+        filas = self.descargar('exportar_clima')
+        self.assertEqual(filas[1][2:7], ['Ana Pérez', '11.111.111-1', 'Analista', '😆 Feliz', '-'])
+
+    def test_reportes_de_empresa_solo_para_rrhh(self):
+        """Un trabajador no descarga el detalle de toda la empresa ni los comentarios de ánimo"""
+        self.user.perfil.rol = 'TRABAJADOR'
+        self.user.perfil.save()
+        for nombre_url in ('exportar_excel_empresa', 'exportar_clima'):
+            for formato in ('xlsx', 'csv', 'csv.gz'):
+                respuesta = self.client.get(reverse(nombre_url), {'formato': formato})
+                self.assertEqual(respuesta.status_code, 403)
+
+        self.client.logout()
+        respuesta = self.client.get(reverse('exportar_excel_empresa'))
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertIn(reverse('login'), respuesta.url)
+
+
+class PanelEmpresaPaginacionTests(TestCase):
+    """El panel de empresa dibuja una página y el resto llega por cursor, con los filtros en la BD"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.jefe = User.objects.create_user(username='jefe', password='123')
+        self.jefe.perfil.empresa = self.empresa
+        self.jefe.perfil.rol = 'EMPLEADOR'
+        self.jefe.perfil.save()
+        self.client.force_login(self.jefe)
+
+        self.ana = User.objects.create_user(username='ana', password='123', first_name='Ana', last_name='Pérez')
+        self.ana.perfil.empresa = self.empresa
+        self.ana.perfil.rut = '11.111.111-1'
+        self.ana.perfil.save()
+        self.luis = User.objects.create_user(username='luis', password='123', first_name='Luis', last_name='Soto')
+        self.luis.perfil.empresa = self.empresa
+        self.luis.perfil.save()
+
+        self.marcas = []
+        for dia in range(1, 5):
+            for trabajador in (self.ana, self.luis):
+                # Dos marcas con el mismo timestamp: el id desempata el cursor
+                self.marcas.append(Marcacion.objects.create(
+                    trabajador=trabajador, tipo='ENTRADA', latitud='-33.4489000', longitud='-70.6693000',
+                    timestamp=timezone.make_aware(datetime(2025, 3, dia, 9, 0)),
+                ))
+
+    def recorrer(self, tamano, **filtros):
+        ids, cursor = [], None
+        while True:
+            params = dict(filtros, tamano=tamano, **({'cursor': cursor} if cursor else {}))
+            datos = self.client.get(reverse('panel_empresa_marcas'), params).json()
+            ids += [m['id'] for m in datos['marcas']]
+            cursor = datos['siguiente']
+            if not cursor:
+                return ids
+
+    def test_cursor_recorre_todo_sin_repetir(self):
+        esperado = [m.id for m in sorted(self.marcas, key=lambda m: (m.timestamp, m.id), reverse=True)]
+        self.assertEqual(self.recorrer(3), esperado)
+
+    def test_filtros_en_el_servidor(self):
+        self.assertEqual(len(self.recorrer(3, busqueda='11.111')), 4)
+        self.assertEqual(len(self.recorrer(3, fecha_inicio='2025-03-02', fecha_fin='2025-03-03')), 4)
+
+    def test_panel_dibuja_solo_la_primera_pagina(self):
+        with mock.patch.object(paginacion, 'TAMANO_PAGINA', 5):
+            respuesta = self.client.get(reverse('panel_empresa'))
+        self.assertEqual(len(respuesta.context['marcas']), 5)
+        self.assertIsNotNone(respuesta.context['siguiente'])
+
+    def test_consultas_no_dependen_del_tamano(self):
+        self.client.get(reverse('panel_empresa_marcas'))  # Deja el contexto de empresa en caché
+        with CaptureQueriesContext(connection) as pocas:
+            self.client.get(reverse('panel_empresa_marcas'), {'tamano': 2})
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(reverse('panel_empresa_marcas'), {'tamano': 8})
+        self.assertEqual(len(pocas), len(muchas))
+
+    def test_cursor_alterado(self):
+        respuesta = self.client.get(reverse('panel_empresa_marcas'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(respuesta.status_code, 400)
+
+
+class RendimientoConsultasTests(TestCase):
+    """
+    Regresiones de rendimiento: con un volumen de datos realista las consultas calientes
+    de Marcacion usan sus índices (EXPLAIN) y cada vista hace un número fijo de consultas.
+    """
+    EMPRESAS, TRABAJADORES, DIAS = 2, 15, 20
+    # Consultas máximas por vista (sesión, usuario y contexto de empresa incluidos)
+    PRESUPUESTOS = {
+        'home': 5,
+        'panel_empresa': 4,
+        'panel_empresa_marcas': 4,
+        'panel_fiscalizador': 4,
+        'panel_rrhh': 8,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.empresas = [Empresa.objects.create(nombre=f'Empresa {i}', email_rrhh=f'rrhh{i}@x.cl') for i in range(cls.EMPRESAS)]
+        marcas = []
+        for empresa in cls.empresas:
+            for n in range(cls.TRABAJADORES):
+                user = User.objects.create_user(username=f'{empresa.id}-{n}')
+                user.perfil.empresa = empresa
+                user.perfil.cambiar_pass_inicial = False
+                user.perfil.save()
+                for dia in range(1, cls.DIAS + 1):
+                    for tipo, hora in (('ENTRADA', 9), ('INICIO_COLACION', 13), ('FIN_COLACION', 14), ('SALIDA', 18)):
+                        marcas.append(Marcacion(
+                            trabajador=user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000',
+                            timestamp=timezone.make_aware(datetime(2025, 3, dia, hora, n % 60)),
+                            animo='FELIZ' if tipo == 'SALIDA' else None,
+                        ))
+        # bulk_create: el volumen importa, no la cadena de hash
+        Marcacion.objects.bulk_create(marcas, batch_size=2000)
+        jornadas.reconstruir()
+
+        cls.trabajador = User.objects.get(username=f'{cls.empresas[0].id}-0')
+        cls.jefe = User.objects.create_user(username='jefe', is_staff=True)
+        cls.jefe.perfil.empresa = cls.empresas[0]
+        cls.jefe.perfil.rol = 'EMPLEADOR'
+        cls.jefe.perfil.cambiar_pass_inicial = False
+        cls.jefe.perfil.save()
+        cls.fiscalizador = User.objects.create_user(username='dt')
+        cls.fiscalizador.perfil.empresa = cls.empresas[0]
+        cls.fiscalizador.perfil.rol = 'FISCALIZADOR'
+        cls.fiscalizador.perfil.save()
+
+        # Estadísticas para el planificador de SQLite (como en una BD con historia)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsaIndice(self, consulta, indice):
+        plan = consulta.explain()
+        self.assertIn(indice, plan, f"La consulta no usa {indice}:\n{plan}")
+
+    def test_historial_del_trabajador(self):
+        self.assertUsaIndice(
+            Marcacion.objects.filter(trabajador=self.trabajador).order_by('-timestamp')[:5], 'marca_trabajador_ts_idx'
+        )
+
+    def test_ultima_entrada_del_trabajador(self):
+        self.assertUsaIndice(
+            Marcacion.objects.filter(trabajador=self.trabajador, tipo='ENTRADA').order_by('-timestamp')[:1],
+            'marca_trab_tipo_ts_idx',
+        )
+
+    def test_marcas_del_dia(self):
+        inicio, fin = JornadaDiaria.rango_dia(date(2025, 3, 5))
+        self.assertUsaIndice(
+            Marcacion.objects.filter(trabajador=self.trabajador, timestamp__gte=inicio, timestamp__lt=fin),
+            'marca_trabajador_ts_idx',
+        )
+        self.assertUsaIndice(Marcacion.objects.filter(timestamp__gte=inicio, timestamp__lt=fin), 'marca_ts_id_idx')
+
+    def test_marcas_de_la_empresa(self):
+        """El JOIN con perfil/empresa no recorre la tabla completa de marcas"""
+        inicio, fin = JornadaDiaria.rango_dia(date(2025, 3, 5))
+        for consulta in (
+            Marcacion.objects.filter(trabajador__perfil__empresa=self.empresas[0]).order_by('-timestamp', '-id')[:50],
+            Marcacion.objects.filter(trabajador__perfil__empresa=self.empresas[0], timestamp__gte=inicio, timestamp__lt=fin),
+        ):
+            plan = consulta.explain()
+            # "SCAN asistencia_marcacion" a secas = recorrido completo de la tabla
+            self.assertNotRegex(plan, r'(?m)SCAN asistencia_marcacion\s*$')
+            self.assertIn('asistencia_marcacion USING INDEX', plan)
+
+    def consultas(self, usuario, nombre_url, **params):
+        self.client.force_login(usuario)
+        self.client.get(reverse(nombre_url), params)  # Calienta la caché del contexto de empresa
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(reverse(nombre_url), params)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(capturadas)
+
+    def test_presupuesto_de_consultas_por_vista(self):
+        medidas = {
+            'home': self.consultas(self.trabajador, 'home'),
+            'panel_empresa': self.consultas(self.jefe, 'panel_empresa'),
+            'panel_empresa_marcas': self.consultas(self.jefe, 'panel_empresa_marcas'),
+            'panel_fiscalizador': self.consultas(self.fiscalizador, 'panel_fiscalizador', desde='2025-03-01', hasta='2025-03-20'),
+            'panel_rrhh': self.consultas(self.jefe, 'panel_rrhh'),
+        }
+        for vista, total in medidas.items():
+            with self.subTest(vista=vista):
+                self.assertLessEqual(total, self.PRESUPUESTOS[vista])
+
+
+class AlertasTests(TestCase):
+    """revisar_alertas evalúa a todos los trabajadores con unas pocas consultas y no duplica avisos"""
+    HOY = date(2025, 3, 5)  # Miércoles
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.ahora = timezone.make_aware(datetime(2025, 3, 5, 21, 0))
+
+    def trabajador(self, username, **perfil):
+        user = User.objects.create_user(username=username, first_name=username.title())
+        user.perfil.empresa = self.empresa
+        for campo, valor in perfil.items():
+            setattr(user.perfil, campo, valor)
+        user.perfil.save()
+        return user
+
+    def marcar(self, user, tipo, hora):
+        Marcacion.objects.create(
+            trabajador=user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.make_aware(datetime(2025, 3, 5, hora, 0)),
+        )
+
+    def test_reglas_de_ausencia_y_exceso(self):
+        ausente = self.trabajador('ausente')
+        cumplidor = self.trabajador('cumplidor')
+        self.marcar(cumplidor, 'ENTRADA', 9)
+        self.marcar(cumplidor, 'SALIDA', 18)
+        exceso = self.trabajador('exceso')
+        self.marcar(exceso, 'ENTRADA', 8)
+        self.marcar(exceso, 'INICIO_COLACION', 13)
+        self.marcar(exceso, 'FIN_COLACION', 14)
+        retirado = self.trabajador('retirado')
+        self.marcar(retirado, 'ENTRADA', 8)
+        self.marcar(retirado, 'SALIDA', 20)
+        self.trabajador('libre', trabaja_miercoles=False)
+        de_vacaciones = self.trabajador('vacaciones')
+        Vacacion.objects.create(trabajador=de_vacaciones, inicio=self.HOY, fin=self.HOY, estado='APROBADA')
+        con_licencia = self.trabajador('licencia')
+        LicenciaMedica.objects.create(trabajador=con_licencia, inicio=self.HOY, fin=self.HOY)
+
+        revisados, generadas = alertas.revisar(self.HOY, self.ahora)
+
+        self.assertEqual(revisados, 4)  # Sin el libre, el de vacaciones ni el con licencia
+        self.assertEqual({(u.username, tipo) for u, tipo, _ in generadas}, {('ausente', 'AUSENCIA'), ('exceso', 'EXCESO_HORAS')})
+        self.assertEqual(set(LogAlerta.objects.values_list('trabajador__username', 'fecha')), {('ausente', self.HOY), ('exceso', self.HOY)})
+        self.assertEqual(CorreoSaliente.objects.filter(destinatario='rrhh@acme.cl').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)  # Los despacha el worker de correos
+
+        # Segunda pasada el mismo día: nada nuevo
+        self.assertEqual(alertas.revisar(self.HOY, self.ahora)[1], [])
+        self.assertEqual(CorreoSaliente.objects.count(), 2)
+        self.assertEqual(ausente.logalerta_set.count(), 1)
+
+    def test_antes_de_la_tolerancia_no_hay_ausencia(self):
+        self.trabajador('tarde', hora_entrada=dt_time(20, 30))
+        self.assertEqual(alertas.revisar(self.HOY, self.ahora)[1], [])
+
+    def test_consultas_no_dependen_de_los_trabajadores(self):
+        for n in range(3):
+            self.trabajador(f'uno{n}')
+        with CaptureQueriesContext(connection) as pocos:
+            alertas.revisar(self.HOY, self.ahora)
+        LogAlerta.objects.all().delete()
+        for n in range(12):
+            self.marcar(self.trabajador(f'otro{n}'), 'ENTRADA', 6)
+        with CaptureQueriesContext(connection) as muchos:
+            alertas.revisar(self.HOY, self.ahora)
+        self.assertEqual(len(pocos), len(muchos))
+
+    def test_restriccion_unica(self):
+        user = self.trabajador('dup')
+        LogAlerta.objects.create(trabajador=user, fecha=self.HOY, tipo='AUSENCIA')
+        with self.assertRaises(IntegrityError):
+            LogAlerta.objects.create(trabajador=user, fecha=self.HOY, tipo='AUSENCIA')
+
+
+class OlvidosSalidaTests(TestCase):
+    """detectar_olvidos: una consulta (NOT EXISTS), límite según la jornada pactada y un solo UPDATE"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.ahora = timezone.make_aware(datetime(2025, 3, 5, 20, 0))
+
+    def trabajador(self, username, jornada=9):
+        user = User.objects.create_user(username=username, email=f'{username}@acme.cl', first_name=username.title())
+        user.perfil.empresa = self.empresa
+        user.perfil.jornada_diaria = jornada
+        user.perfil.save()
+        return user
+
+    def marcar(self, user, tipo, dia, hora):
+        return Marcacion.objects.create(
+            trabajador=user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.make_aware(datetime(2025, 3, dia, hora, 0)),
+        )
+
+    def test_detecta_segun_jornada_pactada(self):
+        olvido = self.marcar(self.trabajador('olvido'), 'ENTRADA', 5, 8)  # 12 h > 9 + 1
+        self.marcar(self.trabajador('larga', jornada=12), 'ENTRADA', 5, 8)  # 12 h < 12 + 1
+        cumplidor = self.trabajador('cumplidor')
+        self.marcar(cumplidor, 'ENTRADA', 5, 8)
+        self.marcar(cumplidor, 'SALIDA', 5, 17)
+
+        entradas, empresas = alertas.avisar_olvidos(self.ahora)
+
+        self.assertEqual([e.id for e in entradas], [olvido.id])
+        self.assertEqual(empresas, 1)
+        self.assertTrue(Marcacion.objects.get(pk=olvido.pk).alerta_olvido_enviada)
+        self.assertEqual(
+            sorted(CorreoSaliente.objects.values_list('destinatario', flat=True)), ['olvido@acme.cl', 'rrhh@acme.cl']
+        )
+        # Ya avisada: no se repite
+        self.assertEqual(alertas.avisar_olvidos(self.ahora)[0], [])
+
+    def test_dias_hacia_atras(self):
+        self.marcar(self.trabajador('ayer'), 'ENTRADA', 3, 8)
+        self.assertEqual(len(alertas.avisar_olvidos(self.ahora, dias=1)[0]), 0)
+        self.assertEqual(len(alertas.avisar_olvidos(self.ahora, dias=7)[0]), 1)
+
+    def test_una_semana_con_consultas_fijas(self):
+        for n in range(10):
+            user = self.trabajador(f't{n}', jornada=8 + n % 3)
+            for dia in range(1, 6):
+                self.marcar(user, 'ENTRADA', dia, 8)
+                if n % 2:
+                    self.marcar(user, 'SALIDA', dia, 17)
+
+        with CaptureQueriesContext(connection) as consultas:
+            entradas, _ = alertas.avisar_olvidos(self.ahora, dias=7)
+        # Los que nunca marcan salida (5 de 10): sus entradas de la semana
+        self.assertEqual(len(entradas), 25)
+        # Jornadas distintas + olvidos + transacción (bandeja + UPDATE)
+        self.assertLessEqual(len([q for q in consultas.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), 4)
+
+
+class SchedulerTests(TestCase):
+    """asistencia_scheduler: un nodo por trabajo (lease) y ticks que solo miran lo nuevo (marcas de agua)"""
+    HOY = date(2025, 3, 5)  # Miércoles
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+
+    def a_las(self, hora, minuto=0):
+        return timezone.make_aware(datetime(2025, 3, 5, hora, minuto))
+
+    def trabajador(self, username, **perfil):
+        user = User.objects.create_user(username=username, email=f'{username}@acme.cl', first_name=username.title())
+        user.perfil.empresa = self.empresa
+        for campo, valor in perfil.items():
+            setattr(user.perfil, campo, valor)
+        user.perfil.save()
+        return user
+
+    def marcar(self, user, tipo, hora, minuto=0):
+        return Marcacion.objects.create(
+            trabajador=user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000', timestamp=self.a_las(hora, minuto),
+        )
+
+    def alertas_de(self, tipo):
+        return set(LogAlerta.objects.filter(tipo=tipo).values_list('trabajador__username', flat=True))
+
+    def test_lease_de_otro_nodo_bloquea_el_trabajo(self):
+        EstadoTrabajo.objects.create(nombre='revisar_alertas', dueno='otro:1', lease_hasta=self.a_las(8, 10))
+
+        self.assertIsNone(planificador.ejecutar('revisar_alertas', 'yo:2', self.a_las(8)))
+        # El otro nodo murió: su lease vence y lo tomamos
+        self.assertIsNotNone(planificador.ejecutar('revisar_alertas', 'yo:2', self.a_las(8, 15)))
+        estado = EstadoTrabajo.objects.get(nombre='revisar_alertas')
+        self.assertEqual((estado.dueno, estado.lease_hasta), ('yo:2', None))
+
+        # Con intervalo: aún no le toca a nadie
+        self.assertIsNone(planificador.ejecutar('revisar_alertas', 'otro:1', self.a_las(8, 16), intervalo=300))
+        self.assertIsNotNone(planificador.ejecutar('revisar_alertas', 'otro:1', self.a_las(8, 20), intervalo=300))
+
+    def test_comando_no_se_pisa_con_el_scheduler(self):
+        EstadoTrabajo.objects.create(nombre='detectar_olvidos', dueno='otro:1', lease_hasta=timezone.now() + timedelta(minutes=5))
+        salida = io.StringIO()
+        call_command('detectar_olvidos', stdout=salida)
+        self.assertIn('en curso', salida.getvalue())
+
+    def test_ticks_solo_revisan_umbrales_cruzados_y_marcas_nuevas(self):
+        temprano = self.trabajador('temprano', hora_entrada=dt_time(8, 0))
+        self.trabajador('tarde', hora_entrada=dt_time(10, 0))
+
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(8))  # Primer tick: revisión completa
+        resumen, _ = planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(9))
+        self.assertEqual(resumen, "1 trabajadores revisados, 1 alertas")  # Solo a quien se le venció la hora
+        self.assertEqual(self.alertas_de('AUSENCIA'), {'temprano'})
+
+        entrada = self.marcar(temprano, 'ENTRADA', 9, 30)
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(11))
+        self.assertEqual(self.alertas_de('AUSENCIA'), {'temprano', 'tarde'})
+        self.assertEqual(EstadoTrabajo.objects.get(nombre='revisar_alertas').marca_hasta, entrada.id)
+
+        # Sin novedades: nadie que revisar
+        self.assertEqual(planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(12))[0], "0 trabajadores revisados, 0 alertas")
+        # 9:30 + 9 + 2 = 20:30: el umbral de exceso se cruza entre estos dos ticks
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(20))
+        self.assertEqual(self.alertas_de('EXCESO_HORAS'), set())
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(21))
+        self.assertEqual(self.alertas_de('EXCESO_HORAS'), {'temprano'})
+
+    def test_olvidos_por_umbral_y_por_marca_atrasada(self):
+        olvido = self.marcar(self.trabajador('olvido'), 'ENTRADA', 8)  # Límite 8 + 9 + 1 = 18:00
+        planificador.ejecutar('detectar_olvidos', 'yo:1', self.a_las(17))
+        self.assertFalse(Marcacion.objects.get(pk=olvido.pk).alerta_olvido_enviada)
+
+        planificador.ejecutar('detectar_olvidos', 'yo:1', self.a_las(19))
+        self.assertTrue(Marcacion.objects.get(pk=olvido.pk).alerta_olvido_enviada)
+
+        # Sincronizada tarde (offline): su límite se cruzó antes del tick anterior, pero es una marca nueva
+        atrasada = self.marcar(self.trabajador('offline'), 'ENTRADA', 7)
+        resumen, _ = planificador.ejecutar('detectar_olvidos', 'yo:1', self.a_las(19, 30))
+        self.assertEqual(resumen, "1 entradas sin salida en 1 empresas")
+        self.assertTrue(Marcacion.objects.get(pk=atrasada.pk).alerta_olvido_enviada)
+
+    def test_tick_sin_novedades_no_depende_de_la_dotacion(self):
+        def tick_sin_novedades(hora):
+            with CaptureQueriesContext(connection) as consultas:
+                resumen, _ = planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(hora))
+            self.assertEqual(resumen, "0 trabajadores revisados, 0 alertas")
+            return len(consultas.captured_queries)
+
+        for n in range(3):
+            self.marcar(self.trabajador(f'uno{n}', hora_entrada=dt_time(8, 0)), 'ENTRADA', 8)
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(9))
+        pocos = tick_sin_novedades(10)
+
+        for n in range(30):
+            self.marcar(self.trabajador(f'muchos{n}', hora_entrada=dt_time(8, 0)), 'ENTRADA', 8)
+        planificador.ejecutar('revisar_alertas', 'yo:1', self.a_las(11))
+        self.assertEqual(tick_sin_novedades(12), pocos)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CargarUsuariosTests(TestCase):
+    """cargar_usuarios: limpieza con pandas, escritura en bloque y re-ejecución sin cambios"""
+    ENCABEZADOS = ['RUT', 'Nombres', 'Apellidos', 'Empresa', 'Cargo', 'Email']
+
+    def planilla(self, filas):
+        archivo = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        self.addCleanup(Path(archivo.name).unlink)
+        wb = openpyxl.Workbook()
+        wb.active.append(self.ENCABEZADOS)
+        for fila in filas:
+            wb.active.append(fila)
+        wb.save(archivo.name)
+        return archivo.name
+
+    def cargar(self, ruta, *args):
+        salida = io.StringIO()
+        call_command('cargar_usuarios', ruta, '--procesos', '1', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_crea_y_se_puede_volver_a_correr(self):
+        ruta = self.planilla([
+            ['11111111-1', 'Ana', 'Pérez', 'ACME', 'Operaria', 'ana@acme.cl'],
+            [22222222, 'Luis', 'Soto', 'ACME', 'Bodega', None],  # RUT numérico en el Excel
+            [None, 'Sin', 'Rut', 'ACME', 'X', None],
+        ])
+        salida = self.cargar(ruta)
+
+        self.assertIn('CREADOS: 2', salida)
+        self.assertIn('1 sin RUT', salida)
+        ana = User.objects.select_related('perfil__empresa').get(username='11111111-1')
+        self.assertTrue(ana.check_password('1111'))
+        self.assertEqual((ana.email, ana.perfil.cargo, ana.perfil.rut, ana.perfil.empresa.nombre), ('ana@acme.cl', 'Operaria', '11111111-1', 'ACME'))
+        self.assertTrue(ana.perfil.cambiar_pass_inicial)
+        self.assertTrue(User.objects.filter(username='22222222').exists())
+        self.assertEqual(Empresa.objects.count(), 1)
+
+        # Misma planilla otra vez: no se escribe nada
+        with CaptureQueriesContext(connection) as consultas:
+            salida = self.cargar(ruta)
+        self.assertIn('SIN CAMBIOS: 2', salida)
+        self.assertFalse([q for q in consultas.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))])
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_actualiza_solo_lo_que_cambia(self):
+        self.cargar(self.planilla([['11111111-1', 'Ana', 'Pérez', 'ACME', 'Operaria', 'ana@acme.cl']]))
+        ana = User.objects.get(username='11111111-1')
+        ana.set_password('nueva')
+        ana.save()
+
+        salida = self.cargar(self.planilla([['11111111-1', 'Ana', 'Pérez', 'ACME', 'Supervisora', 'ana@acme.cl']]))
+
+        self.assertIn('ACTUALIZADOS: 1', salida)
+        self.assertIn('cargo (1)', salida)
+        ana.refresh_from_db()
+        self.assertEqual(ana.perfil.cargo, 'Supervisora')
+        self.assertTrue(ana.check_password('nueva'))  # La clave solo se asigna al crear
+
+    def test_claves_en_pool_de_procesos(self):
+        filas = [{'username': f'{n:08d}-K', 'rut': f'{n:08d}-K', 'clave_inicial': f'{n:04d}'} for n in range(importacion.MIN_CLAVES_POOL)]
+        resumen = importacion.importar(filas, procesos=2)
+
+        self.assertEqual(resumen['creados'], importacion.MIN_CLAVES_POOL)
+        self.assertTrue(User.objects.get(username='00000007-K').check_password('0007'))
+        self.assertEqual(Perfil.objects.filter(rut__endswith='-K').count(), importacion.MIN_CLAVES_POOL)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportarNominaTests(TestCase):
+    """La nómina web se guarda, la procesa el worker (primero simulada) y se confirma desde la página"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.admin = User.objects.create_superuser(username='admin', password='123')
+        self.admin.perfil.empresa = self.empresa
+        self.admin.perfil.save()
+        self.client.force_login(self.admin)
+
+    def excel(self, filas):
+        wb = openpyxl.Workbook()
+        wb.active.append(['username', 'email', 'nombres', 'apellidos', 'rut', 'cargo', 'hora_entrada',
+                          'lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo'])
+        for fila in filas:
+            wb.active.append(fila)
+        contenido = io.BytesIO()
+        wb.save(contenido)
+        return SimpleUploadedFile('nomina.xlsx', contenido.getvalue())
+
+    def subir(self, filas, simular=True):
+        datos = {'archivo_excel': self.excel(filas)}
+        if simular:
+            datos['simular'] = '1'
+        respuesta = self.client.post(reverse('importar_nomina'), datos)
+        carga = ImportacionNomina.objects.latest('id')
+        self.assertRedirects(respuesta, f"{reverse('importar_nomina')}?id={carga.id}")
+        return carga
+
+    def test_simula_y_luego_aplica_en_segundo_plano(self):
+        existente = User.objects.create_user(username='luis', email='luis@acme.cl')
+        existente.perfil.cargo = 'Bodega'
+        existente.perfil.save()
+
+        carga = self.subir([
+            ['ana', 'ana@acme.cl', 'Ana', 'Pérez', '11.111.111-1', 'Cajera', '08:30', 'SI', 'SI', 'SI', 'SI', 'SI', 'NO', 'NO'],
+            ['luis', 'luis@acme.cl', '', '', '', 'Jefe Bodega', None, 'SI', 'SI', 'SI', 'SI', 'SI', 'SI', 'NO'],
+        ])
+        # El request solo guarda el archivo y encola
+        self.assertEqual(carga.estado, 'PENDIENTE')
+        self.assertFalse(User.objects.filter(username='ana').exists())
+
+        tareas.procesar_pendientes()
+        estado = self.client.get(reverse('estado_importacion', args=[carga.id])).json()
+        self.assertEqual(estado['estado'], 'ANALIZADA')
+        self.assertEqual((estado['resumen']['creados'], estado['resumen']['actualizados']), (1, 1))
+        luis = next(d for d in estado['diferencias'] if d['username'] == 'luis')
+        self.assertEqual(luis['campos']['cargo'], ['Bodega', 'Jefe Bodega'])
+        self.assertEqual(luis['campos']['trabaja_sabado'], [False, True])
+        self.assertFalse(User.objects.filter(username='ana').exists())  # Simulación: nada guardado
+        self.assertContains(self.client.get(f"{reverse('importar_nomina')}?id={carga.id}"), 'Confirmar e Importar')
+
+        respuesta = self.client.post(estado['url_confirmar'])
+        self.assertEqual(respuesta.status_code, 202)
+        tareas.procesar_pendientes()
+
+        carga.refresh_from_db()
+        self.assertEqual((carga.estado, carga.progreso), ('COMPLETADA', 100))
+        ana = User.objects.select_related('perfil').get(username='ana')
+        self.assertTrue(ana.check_password('111111111'))
+        self.assertEqual((ana.perfil.empresa, ana.perfil.hora_entrada, ana.perfil.trabaja_sabado), (self.empresa, dt_time(8, 30), False))
+        self.assertEqual(User.objects.get(username='luis').perfil.cargo, 'Jefe Bodega')
+        # Ya aplicada: no se puede confirmar dos veces
+        self.assertEqual(self.client.post(reverse('confirmar_importacion', args=[carga.id])).status_code, 409)
+
+    def test_lee_en_streaming_y_guarda_por_lotes(self):
+        filas = [[f'user{n}', '', '', '', '', 'Operario', '09:00'] + ['SI'] * 5 + ['NO'] * 2 for n in range(5)]
+        carga = self.subir(filas, simular=False)
+
+        with mock.patch.object(importacion, 'TAMANO_LOTE', 2), \
+                mock.patch.object(importacion.openpyxl, 'load_workbook', wraps=openpyxl.load_workbook) as cargar, \
+                mock.patch.object(importacion, 'aplicar', wraps=importacion.aplicar) as aplicar:
+            tareas.procesar_pendientes()
+
+        self.assertTrue(cargar.call_args.kwargs['read_only'])
+        self.assertEqual(aplicar.call_count, 3)  # 2 + 2 + 1, cada lote en su transacción
+        carga.refresh_from_db()
+        self.assertEqual((carga.estado, carga.filas_total, carga.filas_procesadas), ('COMPLETADA', 5, 5))
+        self.assertEqual(Perfil.objects.filter(cargo='Operario', empresa=self.empresa).count(), 5)
+
+    def test_solo_administradores(self):
+        carga = self.subir([['ana', '', '', '', '', '', None]])
+        comun = User.objects.create_user(username='comun', password='123')
+        self.client.force_login(comun)
+        self.assertEqual(self.client.get(reverse('estado_importacion', args=[carga.id])).status_code, 403)
+        self.assertEqual(self.client.post(reverse('confirmar_importacion', args=[carga.id])).status_code, 403)
+        self.assertRedirects(self.client.get(reverse('importar_nomina')), reverse('home'), fetch_redirect_response=False)
+
+
+class ClimaLaboralTests(TestCase):
+    """El clima laboral se lee del resumen AnimoDiario y solo muestra la empresa del usuario"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.otra = Empresa.objects.create(nombre='Otra', email_rrhh='rrhh@otra.cl')
+        self.rrhh = User.objects.create_user(username='rrhh', password='123', is_staff=True)
+        self.rrhh.perfil.empresa = self.empresa
+        self.rrhh.perfil.rol = 'EMPLEADOR'
+        self.rrhh.perfil.save()
+        self.client.force_login(self.rrhh)
+
+    def trabajador(self, username, empresa, cargo):
+        user = User.objects.create_user(username=username, password='123')
+        user.perfil.empresa = empresa
+        user.perfil.cargo = cargo
+        user.perfil.save()
+        return user
+
+    def salida(self, user, animo, dias_atras=0):
+        return Marcacion.objects.create(
+            trabajador=user, tipo='SALIDA', animo=animo, latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.now() - timedelta(days=dias_atras),
+        )
+
+    def test_contador_sigue_a_las_marcas(self):
+        ana = self.trabajador('ana', self.empresa, 'Cajera')
+        marca = self.salida(ana, 'FELIZ')
+        self.salida(ana, 'FELIZ')
+        self.salida(ana, None)
+
+        contador = AnimoDiario.objects.get()
+        self.assertEqual((contador.empresa, contador.cargo, contador.animo, contador.total), (self.empresa, 'Cajera', 'FELIZ', 2))
+
+        marca.delete()
+        self.assertEqual(AnimoDiario.objects.get().total, 1)
+
+        # Reconstruir desde las marcas deja lo mismo que el conteo incremental
+        call_command('reconstruir_animo', stdout=io.StringIO())
+        self.assertEqual(list(AnimoDiario.objects.values_list('animo', 'total')), [('FELIZ', 1)])
+
+    def test_borrar_descuenta_del_cargo_con_que_se_conto(self):
+        """Si el trabajador cambió de cargo, el descuento no se pierde ni deja inflado el contador original"""
+        ana = self.trabajador('ana', self.empresa, 'Cajera')
+        marca = self.salida(ana, 'FELIZ')
+        self.salida(ana, 'FELIZ')
+
+        ana.perfil.cargo = 'Supervisora'
+        ana.perfil.save()
+        marca.delete()
+        self.assertEqual(list(AnimoDiario.objects.values_list('cargo', 'total')), [('Cajera', 1)])
+
+        # Reconstruir usa el mismo cargo guardado en la marca
+        call_command('reconstruir_animo', stdout=io.StringIO())
+        self.assertEqual(list(AnimoDiario.objects.values_list('cargo', 'total')), [('Cajera', 1)])
+
+    def test_migracion_rellena_los_contadores(self):
+        """Al migrar, el gráfico de clima ya cuenta las marcas con ánimo anteriores"""
+        ana = self.trabajador('ana', self.empresa, 'Cajera')
+        self.salida(ana, 'FELIZ')
+        self.salida(ana, 'FELIZ')
+        AnimoDiario.objects.all().delete()  # Como justo después de crear la tabla
+
+        migracion = importlib.import_module('apps.asistencia.migrations.0018_animodiario')
+        migracion.rellenar_animos(django_apps, None)
+
+        self.assertEqual(list(AnimoDiario.objects.values_list('cargo', 'animo', 'total')), [('Cajera', 'FELIZ', 2)])
+
+    def test_panel_rrhh_solo_de_su_empresa(self):
+        self.salida(self.trabajador('ana', self.empresa, 'Cajera'), 'MOLESTO')
+        self.salida(self.trabajador('ajeno', self.otra, 'Cajero'), 'FELIZ')
+        self.salida(self.trabajador('antiguo', self.empresa, 'Cajera'), 'FELIZ', dias_atras=30)
+
+        respuesta = self.client.get(reverse('panel_rrhh'))
+        self.assertEqual(
+            (respuesta.context['grafico_feliz'], respuesta.context['grafico_neutral'], respuesta.context['grafico_molesto']),
+            (0, 0, 1),
+        )
+
+    def test_tendencia_por_cargo(self):
+        self.salida(self.trabajador('ana', self.empresa, 'Cajera'), 'FELIZ')
+        self.salida(self.trabajador('luis', self.empresa, 'Bodeguero'), 'NEUTRAL')
+        self.salida(self.trabajador('ajeno', self.otra, 'Gerente'), 'MOLESTO')
+
+        datos = self.client.get(reverse('tendencia_clima'), {'agrupar': 'mes', 'periodos': 3}).json()
+        self.assertEqual(len(datos['periodos']), 3)
+        self.assertEqual(datos['cargos'], ['Bodeguero', 'Cajera'])
+        self.assertEqual((datos['series']['FELIZ'][-1], datos['series']['NEUTRAL'][-1], datos['series']['MOLESTO'][-1]), (1, 1, 0))
+
+        datos = self.client.get(reverse('tendencia_clima'), {'cargo': 'Cajera'}).json()
+        self.assertEqual(datos['agrupar'], 'semana')
+        self.assertEqual((sum(datos['series']['FELIZ']), sum(datos['series']['NEUTRAL'])), (1, 0))
+
+    def test_exportacion_solo_de_su_empresa(self):
+        self.salida(self.trabajador('ana', self.empresa, 'Cajera'), 'FELIZ')
+        self.salida(self.trabajador('ajeno', self.otra, 'Gerente'), 'MOLESTO')
+
+        respuesta = self.client.get(reverse('exportar_clima'), {'formato': 'csv'})
+        filas = list(csv.reader(io.StringIO(b''.join(respuesta.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1][4:6], ['Cajera', '😆 Feliz'])
+
+
+class ReportesSegundoPlanoTests(TestCase):
+    """Los reportes pesados se encolan, los genera el worker y se reutilizan si no hay datos nuevos"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.user = User.objects.create_user(username='rrhh', password='123', first_name='Ana', last_name='Pérez')
+        self.user.perfil.empresa = self.empresa
+        self.user.perfil.rut = '11.111.111-1'
+        self.user.perfil.rol = 'EMPLEADOR'
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+        self.marcar(9)
+
+    def marcar(self, hora, tipo='ENTRADA'):
+        Marcacion.objects.create(
+            trabajador=self.user, tipo=tipo, latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.make_aware(datetime(2025, 3, 3, hora, 0)),
+        )
+
+    def solicitar(self, **datos):
+        datos = {'tipo': 'FISCALIZACION', 'desde': '2025-03-01', 'hasta': '2025-03-31', **datos}
+        return self.client.post(reverse('solicitar_reporte'), datos)
+
+    def test_encola_genera_y_descarga(self):
+        respuesta = self.solicitar()
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo = respuesta.json()
+        self.assertEqual((trabajo['estado'], trabajo['url_descarga']), ('PENDIENTE', None))
+        self.assertEqual(self.client.get(reverse('descargar_reporte', args=[trabajo['id']])).status_code, 409)
+
+        # Mientras está en cola, pedir lo mismo devuelve el mismo trabajo
+        self.assertEqual(self.solicitar().json()['id'], trabajo['id'])
+
+        self.assertEqual(tareas.procesar_pendientes(tipos=['GENERAR_REPORTE']), (1, 0))
+        estado = self.client.get(trabajo['url_estado']).json()
+        self.assertEqual((estado['estado'], estado['progreso']), ('COMPLETADO', 100))
+
+        descarga = self.client.get(estado['url_descarga'])
+        contenido = b''.join(descarga.streaming_content)
+        filas = list(openpyxl.load_workbook(io.BytesIO(contenido)).active.iter_rows(values_only=True))
+        self.assertEqual(filas[0][-1], 'Hash Cadena')
+        self.assertEqual(filas[1][1:3], ('11.111.111-1', 'Ana Pérez'))
+
+    def test_reutiliza_si_no_cambian_los_datos(self):
+        primero = self.solicitar().json()
+        tareas.procesar_pendientes()
+
+        repetido = self.solicitar()
+        self.assertEqual(repetido.status_code, 200)
+        self.assertEqual((repetido.json()['id'], repetido.json()['reutilizado']), (primero['id'], True))
+
+        # Otro formato u otra marca en el periodo => archivo nuevo
+        self.assertNotEqual(self.solicitar(formato='csv').json()['id'], primero['id'])
+        self.marcar(18, 'SALIDA')
+        self.assertNotEqual(self.solicitar().json()['id'], primero['id'])
+
+    def test_remuneraciones_csv_en_segundo_plano(self):
+        trabajo = self.solicitar(tipo='REMUNERACIONES', formato='csv', desde='', hasta='', fecha_inicio='2025-03-03', fecha_fin='2025-03-03').json()
+        tareas.procesar_pendientes()
+
+        trabajo = TrabajoReporte.objects.get(pk=trabajo['id'])
+        self.assertEqual(trabajo.parametros['desde'], '2025-03-03')
+        self.assertEqual(trabajo.nombre_archivo, 'Remuneraciones_ACME_2025-03-03.csv')
+        with trabajo.archivo.open('rb') as archivo:
+            filas = list(csv.reader(io.StringIO(archivo.read().decode('utf-8-sig'))))
+        self.assertEqual(filas[0], remuneraciones.ENCABEZADOS)
+        self.assertEqual(filas[1][:4], ['11.111.111-1', 'Ana Pérez', '', '1'])
+
+    def test_libro_pdf_es_personal(self):
+        trabajo = self.solicitar(tipo='LIBRO_PDF').json()
+        tareas.procesar_pendientes()
+        descarga = self.client.get(reverse('descargar_reporte', args=[trabajo['id']]))
+        self.assertTrue(b''.join(descarga.streaming_content).startswith(b'%PDF'))
+
+        # Un compañero de la misma empresa no ve el libro ajeno
+        otro = User.objects.create_user(username='otro', password='123')
+        otro.perfil.empresa = self.empresa
+        otro.perfil.save()
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(reverse('estado_reporte', args=[trabajo['id']])).status_code, 404)
+
+    def test_reportes_de_la_empresa_no_son_para_trabajadores(self):
+        """Nómina y reporte DT de toda la empresa: un trabajador no los pide ni los descarga adivinando el id"""
+        nomina = self.solicitar(tipo='REMUNERACIONES').json()
+        dt = self.solicitar().json()
+        tareas.procesar_pendientes()
+
+        otro = User.objects.create_user(username='otro', password='123')
+        otro.perfil.empresa = self.empresa
+        otro.perfil.save()
+        self.client.force_login(otro)
+        for trabajo in (nomina, dt):
+            self.assertEqual(self.client.get(reverse('descargar_reporte', args=[trabajo['id']])).status_code, 404)
+        self.assertEqual(self.solicitar(tipo='REMUNERACIONES').status_code, 403)
+        self.assertEqual(self.solicitar().status_code, 403)
+
+        # El fiscalizador sí ve el reporte DT, pero no la nómina
+        otro.perfil.rol = 'FISCALIZADOR'
+        otro.perfil.save()
+        self.assertEqual(self.client.get(reverse('descargar_reporte', args=[dt['id']])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('descargar_reporte', args=[nomina['id']])).status_code, 404)
+
+    def test_error_se_reintenta_y_luego_falla(self):
+        trabajo = self.solicitar().json()
+        with mock.patch.object(reportes, 'libro_fiscalizacion', side_effect=RuntimeError('disco lleno')):
+            tareas.procesar_pendientes()
+            self.assertEqual(TrabajoReporte.objects.get(pk=trabajo['id']).estado, 'PENDIENTE')
+
+            tarea = TareaPendiente.objects.get(tipo='GENERAR_REPORTE')
+            tarea.intentos = tarea.max_intentos - 1
+            tarea.ejecutar_desde = timezone.now()
+            tarea.save()
+            tareas.procesar_pendientes()
+
+        estado = self.client.get(trabajo['url_estado']).json()
+        self.assertEqual(estado['estado'], 'FALLIDO')
+        self.assertIn('disco lleno', estado['error'])
+
+
+class LibroAsistenciaPdfTests(TestCase):
+    """El libro PDF es de un periodo y se sirve desde el storage mientras no haya marcas nuevas"""
+
+    def setUp(self):
+        media = override_settings(MEDIA_ROOT=self.directorio())
+        media.enable()
+        self.addCleanup(media.disable)
+        logos = mock.patch.object(libros, 'CACHE_DIR', Path(self.directorio()))
+        logos.start()
+        self.addCleanup(logos.stop)
+
+        self.empresa = Empresa.objects.create(nombre='ACME', email_rrhh='rrhh@acme.cl')
+        self.user = User.objects.create_user(username='libro', password='123')
+        self.user.perfil.empresa = self.empresa
+        self.user.perfil.save()
+        self.client.force_login(self.user)
+        self.marcar(3)
+
+    def directorio(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        return carpeta.name
+
+    def marcar(self, dia):
+        Marcacion.objects.create(
+            trabajador=self.user, tipo='ENTRADA', latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.make_aware(datetime(2025, 3, dia, 9, 0)),
+        )
+
+    def descargar(self):
+        respuesta = self.client.get(reverse('reporte_pdf'), {'desde': '2025-03-01', 'hasta': '2025-03-31'})
+        self.assertIn('asistencia_libro_20250301_20250331.pdf', respuesta['Content-Disposition'])
+        return b''.join(respuesta.streaming_content)
+
+    def test_descarga_repetida_no_renderiza(self):
+        with mock.patch.object(libros, 'renderizar', wraps=libros.renderizar) as renderizar:
+            primero = self.descargar()
+            self.assertEqual(self.descargar(), primero)
+            self.assertEqual(renderizar.call_count, 1)
+
+            # Una marca nueva mueve la cabeza de la cadena => se vuelve a generar
+            self.marcar(4)
+            self.descargar()
+            self.assertEqual(renderizar.call_count, 2)
+
+    def test_direccion_geocodificada_regenera_el_libro(self):
+        """El geocoder completa la dirección con update() (sin mover la cadena): el libro no debe quedar con 'Coordenadas GPS'"""
+        with mock.patch.object(libros, 'renderizar', wraps=libros.renderizar) as renderizar:
+            self.descargar()
+            marca = Marcacion.objects.get(trabajador=self.user)
+            with mock.patch.object(geocoding, 'obtener_direccion', return_value='Moneda 975, Santiago'):
+                tareas.geocodificar(mock.Mock(marca=marca))
+            self.descargar()
+            self.assertEqual(renderizar.call_count, 2)
+
+        # Solo queda la versión vigente del libro del periodo
+        carpeta = f"{libros.CARPETA_STORAGE}/{self.user.id}/20250301_20250331"
+        self.assertEqual(len(default_storage.listdir(carpeta)[1]), 1)
+
+    def test_limpiar_libros_de_periodos_viejos(self):
+        self.descargar()
+        salida = io.StringIO()
+        call_command('limpiar_libros', '--dias', '0', stdout=salida)
+
+        self.assertIn('1 libros borrados', salida.getvalue())
+        self.assertEqual(default_storage.listdir(f"{libros.CARPETA_STORAGE}/{self.user.id}/20250301_20250331")[1], [])
+
+    def test_solo_marcas_del_periodo(self):
+        self.marcar(31)
+        Marcacion.objects.create(
+            trabajador=self.user, tipo='ENTRADA', latitud='-33.4489000', longitud='-70.6693000',
+            timestamp=timezone.make_aware(datetime(2025, 4, 1, 0, 30)),
+        )
+        with mock.patch.object(libros, 'render_to_string', return_value='<html></html>') as render:
+            libros.renderizar(self.user, self.empresa, date(2025, 3, 1), date(2025, 3, 31))
+
+        marcas = render.call_args[0][1]['marcas']
+        self.assertEqual([timezone.localtime(m.timestamp).day for m in marcas], [3, 31])
+
+    def test_logo_se_copia_una_vez(self):
+        self.empresa.logo.save('logo.png', ContentFile(b'\x89PNG logo'), save=True)
+
+        uri = libros.logo_local(self.empresa)
+        self.assertTrue(uri.startswith('file://'))
+        with mock.patch.object(type(self.empresa.logo), 'open', side_effect=AssertionError('no debe leer el storage')):
+            self.assertEqual(libros.logo_local(self.empresa), uri)
+
+    def test_logo_que_no_se_copia_no_deja_temporales(self):
+        """Si la copia falla se registra un aviso y no quedan archivos a medias en el caché"""
+        self.empresa.logo.save('logo.png', ContentFile(b'\x89PNG logo'), save=True)
+
+        with mock.patch.object(libros.os, 'replace', side_effect=OSError('disco lleno')), \
+                self.assertLogs('apps.asistencia.libros', level='WARNING') as registro:
+            self.assertIsNone(libros.logo_local(self.empresa))
+
+        self.assertIn('disco lleno', registro.output[0])
+        self.assertEqual(list((libros.CACHE_DIR / 'logos').iterdir()), [])
+
+    def test_libros_de_la_empresa_en_un_zip(self):
+        otro = User.objects.create_user(username='otro', password='123')
+        otro.perfil.empresa = self.empresa
+        otro.perfil.save()
+        User.objects.create_user(username='ajeno', password='123')  # Otra empresa: no va en el ZIP
+
+        salida = Path(self.directorio()) / 'libros.zip'
+        call_command('generar_libros', '--empresa', str(self.empresa.id), '--mes', '2025-03', '--procesos', '1',
+                     '--salida', str(salida), stdout=io.StringIO(), stderr=io.StringIO())
+
+        with zipfile.ZipFile(salida) as zf:
+            self.assertEqual(len(zf.namelist()), 2)
+            self.assertTrue(all(nombre.endswith('.pdf') for nombre in zf.namelist()))
+
+        # La segunda vez los PDF sin marcas nuevas salen del storage
+        with mock.patch.object(libros, 'renderizar', side_effect=AssertionError('no debe renderizar')):
+            resultado = libros.generar_libros_empresa(self.empresa, date(2025, 3, 1), date(2025, 3, 31), procesos=1)
+        resultado['archivo'].close()
+        self.assertEqual((resultado['total'], resultado['reutilizados'], resultado['errores']), (2, 2, []))
+
+    def test_zip_de_la_empresa_solo_para_rrhh(self):
+        datos = {'tipo': 'LIBROS_EMPRESA', 'mes': '2025-03'}
+        self.assertEqual(self.client.post(reverse('solicitar_reporte'), datos).status_code, 403)
+
+        self.user.perfil.rol = 'EMPLEADOR'
+        self.user.perfil.save()
+        respuesta = self.client.post(reverse('solicitar_reporte'), datos)
+        self.assertEqual(respuesta.status_code, 202)
+        tareas.procesar_pendientes()
+
+        trabajo = TrabajoReporte.objects.get(pk=respuesta.json()['id'])
+        self.assertEqual(trabajo.estado, 'COMPLETADO')
+        self.assertEqual(trabajo.parametros['desde'], '2025-03-01')
+        descarga = self.client.get(reverse('descargar_reporte', args=[trabajo.id]))
+        with zipfile.ZipFile(io.BytesIO(b''.join(descarga.streaming_content))) as zf:
+            self.assertEqual(len(zf.namelist()), 1)
+
+
+class GeocodingCacheTests(TestCase):
+
+    def setUp(self):
+        geocoding.limpiar_memoria()
+
+    def test_coordenadas_cercanas_comparten_clave(self):
+        """Dos marcas en el mismo edificio (diferencia < 5 m) usan la misma entrada"""
+        self.assertEqual(
+            geocoding.clave_coordenadas('-33.4489001', '-70.6693002'),
+            geocoding.clave_coordenadas('-33.4489203', '-70.6692954'),
+        )
+
+    def test_segunda_consulta_no_llama_a_nominatim(self):
+        with mock.patch.object(geocoding, '_consultar_nominatim', return_value='Moneda 975, Santiago') as nominatim:
+            primera = geocoding.obtener_direccion('-33.4489000', '-70.6693000')
+            geocoding.limpiar_memoria()  # Simula otro worker: debe salir de la tabla
+            segunda = geocoding.obtener_direccion('-33.4489100', '-70.6693100')
+
+        self.assertEqual(primera, segunda)
+        self.assertEqual(nominatim.call_count, 1)
+        self.assertEqual(DireccionCache.objects.get().aciertos, 1)
+
+    def test_entrada_vencida_no_se_usa(self):
+        geocoding.guardar_en_cache('-33.4489000', '-70.6693000', 'Dirección antigua')
+        DireccionCache.objects.update(actualizado=timezone.now() - geocoding.TTL - timedelta(days=1))
+        geocoding.limpiar_memoria()
+
+        self.assertIsNone(geocoding.buscar_en_cache('-33.4489000', '-70.6693000'))
+
+    def test_worker_publica_sus_contadores(self):
+        """Los aciertos/fallos del worker quedan a la vista en EstadoTrabajo (admin y /salud/)"""
+        with mock.patch.dict(geocoding.ESTADISTICAS, dict.fromkeys(geocoding.ESTADISTICAS, 0)), \
+                mock.patch.object(geocoding, '_consultar_nominatim', return_value='Moneda 975, Santiago'):
+            geocoding.obtener_direccion('-33.4489000', '-70.6693000')
+            geocoding.obtener_direccion('-33.4489000', '-70.6693000')
+            call_command('procesar_tareas', '--una-vez', stdout=io.StringIO())
+
+        estado = EstadoTrabajo.objects.get(nombre='procesar_tareas')
+        self.assertIn('1 memoria', estado.ultimo_resumen)
+        self.assertIn('50% aciertos', estado.ultimo_resumen)
+
+    def test_limitador_respeta_tasa(self):
+        """Con capacidad 1 y 1 token/s, la segunda petición inmediata no obtiene turno"""
+        self.assertTrue(geocoding.consumir_token('prueba', tasa=1.0, espera_max=0))
+        self.assertFalse(geocoding.consumir_token('prueba', tasa=1.0, espera_max=0))
+        self.assertTrue(geocoding.consumir_token('prueba', tasa=1.0, espera_max=2))
+
+
+class SincronizacionLoteTests(TestCase):
+    FOTO = 'data:image/jpeg;base64,' + base64.b64encode(b'jpeg-falso').decode()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_user(username='offline', password='123')
+        self.client.force_login(self.user)
+        self.base = timezone.now().replace(microsecond=0) - timedelta(hours=10)
+
+    def item(self, clave, tipo, horas):
+        return {
+            'clave_idempotencia': clave,
+            'tipo': tipo,
+            'latitud': '-33.4489', 'longitud': '-70.6693',
+            'foto_base64': self.FOTO,
+            'fecha_offline': (self.base + timedelta(hours=horas)).isoformat(),
+        }
+
+    def enviar(self, items):
+        return self.client.post(reverse('registrar_marcas_lote'), data=json.dumps({'marcas': items}), content_type='application/json')
+
+    def test_lote_se_inserta_en_orden_cronologico(self):
+        """Aunque lleguen desordenadas, la cadena de hash sigue el orden de los timestamps"""
+        respuesta = self.enviar([
+            self.item('c-salida', 'SALIDA', 9),
+            self.item('c-entrada', 'ENTRADA', 0),
+            self.item('c-colacion', 'INICIO_COLACION', 4),
+        ])
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([r['status'] for r in respuesta.json()['resultados']], ['ok', 'ok', 'ok'])
+
+        marcas = list(Marcacion.objects.filter(trabajador=self.user).order_by('id'))
+        self.assertEqual([m.tipo for m in marcas], ['ENTRADA', 'INICIO_COLACION', 'SALIDA'])
+        self.assertEqual(marcas[0].hash_previo, 'GENESIS_BLOCK')
+        self.assertEqual(marcas[1].hash_previo, marcas[0].hash_actual)
+        self.assertEqual(marcas[2].hash_previo, marcas[1].hash_actual)
+
+    def test_reintento_no_duplica(self):
+        items = [self.item('c-1', 'ENTRADA', 0), self.item('c-2', 'SALIDA', 8)]
+        self.enviar(items[:1])
+        respuesta = self.enviar(items)
+
+        self.assertEqual([r['status'] for r in respuesta.json()['resultados']], ['duplicada', 'ok'])
+        self.assertEqual(Marcacion.objects.filter(trabajador=self.user).count(), 2)
+
+    def test_item_invalido_no_tumba_el_lote(self):
+        sin_foto = self.item('c-mala', 'ENTRADA', 0)
+        sin_foto['foto_base64'] = ''
+        respuesta = self.enviar([sin_foto, self.item('c-buena', 'INICIO_COLACION', 4)])
+
+        resultados = respuesta.json()['resultados']
+        self.assertEqual(resultados[0]['status'], 'error')
+        self.assertEqual(resultados[1]['status'], 'ok')
+        self.assertEqual(Marcacion.objects.filter(trabajador=self.user).count(), 1)
+
+    def test_lote_mas_grande_del_cliente_pasa_entero(self):
+        """El lote máximo que arma el teléfono (cantidad y bytes al tope) entra en un solo POST multipart"""
+        n = views.MARCAS_POR_LOTE_CLIENTE
+        foto = b'\xff\xd8' + b'x' * (views.BYTES_POR_LOTE_CLIENTE // n - 2)
+        items = [self.item(f'c-{i}', 'ENTRADA', i * 0.1) for i in range(n)]
+        datos = {'marcas': json.dumps([{k: v for k, v in it.items() if k != 'foto_base64'} for it in items])}
+        for it in items:
+            datos[f"foto_{it['clave_idempotencia']}"] = SimpleUploadedFile('marca.jpg', foto, content_type='image/jpeg')
+
+        respuesta = self.client.post(reverse('registrar_marcas_lote'), data=datos)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([r['status'] for r in respuesta.json()['resultados']], ['ok'] * n)
+        self.assertEqual(TareaPendiente.objects.filter(tipo='SUBIR_FOTO').count(), n)
+        self.assertEqual(default_storage.size(TareaPendiente.objects.filter(tipo='SUBIR_FOTO').first().datos['ruta']), len(foto))
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_json_demasiado_grande_responde_413(self):
+        """Clientes antiguos (base64 en JSON): 413 para que partan el lote, no un 400 que lo deja pegado"""
+        items = [self.item(f'c-{i}', 'ENTRADA', i) for i in range(20)]
+        self.assertEqual(self.enviar(items).status_code, 413)
+        self.assertEqual(self.enviar(items[:1]).status_code, 200)
+
+
+class MarcaMultipartTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_user(username='multipart', password='123')
+        self.client.force_login(self.user)
+
+    def datos(self, **extra):
+        return {'tipo': 'ENTRADA', 'latitud': '-33.4489', 'longitud': '-70.6693', **extra}
+
+    def test_foto_binaria_se_encola(self):
+        foto = SimpleUploadedFile('marca.jpg', b'jpeg-binario', content_type='image/jpeg')
+        # El temporal se mueve al storage sin volver a leerlo
+        with mock.patch.object(TemporaryUploadedFile, 'chunks', side_effect=AssertionError('foto leída a memoria')):
+            respuesta = self.client.post(reverse('registrar_marca'), data=self.datos(foto=foto))
+
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        tarea = TareaPendiente.objects.get(tipo='SUBIR_FOTO')
+        self.assertIsNone(tarea.archivo)  # El binario no pasa por la BD
+        with default_storage.open(tarea.datos['ruta'], 'rb') as archivo:
+            self.assertEqual(archivo.read(), b'jpeg-binario')
+        self.assertTrue(tarea.datos['nombre'].endswith('.jpg'))
+
+    def test_base64_sigue_funcionando(self):
+        """Clientes con el JS antiguo en caché siguen enviando JSON con la foto en base64"""
+        cuerpo = self.datos(foto_base64='data:image/jpeg;base64,' + base64.b64encode(b'jpeg-viejo').decode())
+        respuesta = self.client.post(reverse('registrar_marca'), data=json.dumps(cuerpo), content_type='application/json')
+
+        self.assertEqual(respuesta.json()['status'], 'ok')
+        with default_storage.open(TareaPendiente.objects.get(tipo='SUBIR_FOTO').datos['ruta'], 'rb') as archivo:
+            self.assertEqual(archivo.read(), b'jpeg-viejo')
+
+    def test_multipart_sin_foto_se_rechaza(self):
+        respuesta = self.client.post(reverse('registrar_marca'), data=self.datos())
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_csrf_se_sigue_validando(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.force_login(self.user)
+        foto = SimpleUploadedFile('marca.jpg', b'jpeg-binario', content_type='image/jpeg')
+        respuesta = cliente.post(reverse('registrar_marca'), data=self.datos(foto=foto))
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class CadenaHashTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cadena', password='123')
+        self.ahora = timezone.now()
+
+    def marcar(self, tipo, horas=0):
+        return Marcacion.objects.create(trabajador=self.user, tipo=tipo, timestamp=self.ahora + timedelta(hours=horas), latitud=0, longitud=0)
+
+    def test_cadena_encadena_y_actualiza_cabeza(self):
+        entrada = self.marcar('ENTRADA')
+        salida = self.marcar('SALIDA', 9)
+
+        self.assertEqual(entrada.hash_previo, 'GENESIS_BLOCK')
+        self.assertEqual(salida.hash_previo, entrada.hash_actual)
+        self.assertEqual(salida.hash_actual, salida.calcular_hash())
+
+        cabeza = CadenaMarcas.objects.get(trabajador=self.user)
+        self.assertEqual(cabeza.ultimo_hash, salida.hash_actual)
+        self.assertEqual(cabeza.ultimo_tipo, 'SALIDA')
+        self.assertEqual(cabeza.ultima_entrada, entrada.timestamp)
+
+    def test_cabeza_se_reconstruye_desde_historico(self):
+        """Trabajadores con marcas anteriores a la tabla de cabezas continúan su cadena"""
+        entrada = self.marcar('ENTRADA')
+        CadenaMarcas.objects.all().delete()
+
+        with self.assertRaises(ValidationError):
+            self.marcar('SALIDA', -1)
+
+        salida = self.marcar('SALIDA', 8)
+        self.assertEqual(salida.hash_previo, entrada.hash_actual)
+
+    def test_insercion_no_busca_ultima_marca(self):
+        """Con la cabeza creada, insertar no consulta la tabla de marcas"""
+        self.marcar('ENTRADA')
+        with CaptureQueriesContext(connection) as consultas:
+            self.marcar('INICIO_COLACION', 4)
+
+        selects = [q['sql'] for q in consultas.captured_queries if q['sql'].startswith('SELECT')]
+        # Cabeza de la cadena y la jornada del día (que se actualiza sin releer las marcas)
+        self.assertEqual(len(selects), 2)
+        self.assertIn('asistencia_cadenamarcas', selects[0])
+        self.assertIn('asistencia_jornadadiaria', selects[1])
+        self.assertFalse([sql for sql in selects if 'asistencia_marcacion' in sql])
+
+    def test_rectificar_marca_antigua(self):
+        """Pasar una SALIDA antigua a RECTIFICADA no re-evalúa la regla cronológica"""
+        self.marcar('ENTRADA')
+        salida = self.marcar('SALIDA', 9)
+        self.marcar('ENTRADA', 24)
+
+        salida.estado = 'RECTIFICADA'
+        salida.save()
+        self.assertEqual(Marcacion.objects.get(pk=salida.pk).estado, 'RECTIFICADA')
+
+
+class VerificarCadenaTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditado', password='123')
+        self.ahora = timezone.now()
+        self.marcas = [
+            Marcacion.objects.create(trabajador=self.user, tipo=tipo, timestamp=self.ahora + timedelta(hours=h), latitud=0, longitud=0)
+            for tipo, h in [('ENTRADA', 0), ('INICIO_COLACION', 4), ('FIN_COLACION', 5), ('SALIDA', 9)]
+        ]
+
+    def verificar(self, *args):
+        with tempfile.NamedTemporaryFile(suffix='.json') as archivo:
+            call_command('verificar_cadena', '--procesos', '1', '--salida', archivo.name, *args, stderr=io.StringIO())
+            return json.load(open(archivo.name, encoding='utf-8'))
+
+    def test_cadena_integra(self):
+        reporte = self.verificar()
+        self.assertEqual(reporte['marcas_verificadas'], 4)
+        self.assertEqual(reporte['rupturas'], [])
+
+        checkpoint = VerificacionCadena.objects.get(trabajador=self.user)
+        self.assertEqual(checkpoint.ultima_marca_id, self.marcas[-1].id)
+
+    def test_detecta_marca_alterada(self):
+        """Cambiar la hora de una marca en la BD rompe su firma"""
+        Marcacion.objects.filter(pk=self.marcas[1].pk).update(timestamp=self.ahora + timedelta(hours=3))
+
+        reporte = self.verificar()
+        self.assertEqual([(r['marca_id'], r['tipo']) for r in reporte['rupturas']], [(self.marcas[1].id, 'HASH_ALTERADO')])
+
+    def test_segunda_ejecucion_solo_verifica_lo_nuevo(self):
+        self.verificar()
+        Marcacion.objects.create(trabajador=self.user, tipo='ENTRADA', timestamp=self.ahora + timedelta(days=1), latitud=0, longitud=0)
+
+        reporte = self.verificar()
+        self.assertEqual(reporte['marcas_verificadas'], 1)
+        self.assertEqual(reporte['rupturas'], [])
+        self.assertEqual(self.verificar('--desde-cero')['marcas_verificadas'], 5)
+
+    def encadenar_como_antes(self):
+        """Rehace la cadena con la regla anterior a CadenaMarcas: cada marca, en orden de
+        inserción, se encadena a la más reciente por timestamp que ya existía."""
+        CadenaMarcas.objects.all().delete()
+        previas = []
+        for marca in Marcacion.objects.filter(trabajador=self.user).order_by('id'):
+            ultima = max(previas, key=lambda m: m.timestamp, default=None)
+            marca.hash_previo = ultima.hash_actual if ultima else 'GENESIS_BLOCK'
+            marca.hash_actual = Marcacion.firmar(self.user.id, marca.timestamp, marca.tipo, marca.hash_previo)
+            Marcacion.objects.filter(pk=marca.pk).update(hash_previo=marca.hash_previo, hash_actual=marca.hash_actual)
+            previas.append(marca)
+
+    def test_historico_encadenado_por_timestamp(self):
+        """Una marca retroactiva del histórico (id mayor, hora anterior) no es un enlace roto"""
+        retroactiva = Marcacion(trabajador=self.user, tipo='ENTRADA', timestamp=self.ahora - timedelta(days=1), latitud=0, longitud=0)
+        Marcacion.objects.bulk_create([retroactiva])
+        Marcacion.objects.bulk_create([
+            Marcacion(trabajador=self.user, tipo='ENTRADA', timestamp=self.ahora + timedelta(days=1), latitud=0, longitud=0),
+        ])
+        self.encadenar_como_antes()
+
+        # Con la cabeza: la cadena sigue desde la más reciente del histórico y luego por id
+        nueva = Marcacion.objects.create(trabajador=self.user, tipo='SALIDA', timestamp=self.ahora + timedelta(days=1, hours=9), latitud=0, longitud=0)
+        Marcacion.objects.create(trabajador=self.user, tipo='ENTRADA', timestamp=self.ahora + timedelta(days=2), latitud=0, longitud=0)
+        self.assertEqual(CadenaMarcas.objects.get(trabajador=self.user).legada_hasta_id, nueva.id - 1)
+
+        reporte = self.verificar()
+        self.assertEqual(reporte['marcas_verificadas'], 8)
+        self.assertEqual(reporte['rupturas'], [])
+
+        # Un enlace roto de verdad en el histórico se sigue detectando
+        Marcacion.objects.filter(pk=retroactiva.pk).update(hash_previo='X' * 64)
+        reporte = self.verificar('--desde-cero')
+        self.assertEqual([r['tipo'] for r in reporte['rupturas'] if r['marca_id'] == retroactiva.id], ['ENLACE_ROTO', 'HASH_ALTERADO'])
+
+    def test_regla_antigua_no_aplica_despues_de_la_cabeza(self):
+        """Una marca nueva encadenada a la más reciente por timestamp (no a la anterior) sí es ruptura"""
+        Marcacion.objects.filter(trabajador=self.user).delete()
+        CadenaMarcas.objects.all().delete()
+        entrada = Marcacion.objects.create(trabajador=self.user, tipo='ENTRADA', timestamp=self.ahora + timedelta(hours=9), latitud=0, longitud=0)
+        Marcacion.objects.create(trabajador=self.user, tipo='INICIO_COLACION', timestamp=self.ahora + timedelta(hours=4), latitud=0, longitud=0)
+        bifurcada = Marcacion.objects.create(trabajador=self.user, tipo='FIN_COLACION', timestamp=self.ahora + timedelta(hours=10), latitud=0, longitud=0)
+        firma = Marcacion.firmar(self.user.id, bifurcada.timestamp, bifurcada.tipo, entrada.hash_actual)
+        Marcacion.objects.filter(pk=bifurcada.pk).update(hash_previo=entrada.hash_actual, hash_actual=firma)
+
+        reporte = self.verificar()
+        self.assertEqual([(r['marca_id'], r['tipo']) for r in reporte['rupturas']], [(bifurcada.id, 'ENLACE_ROTO')])
+
+
+class ProcesarFotoTests(TestCase):
+
+    def foto_camara(self):
+        """JPEG 1920x1080 con EXIF (orientación + modelo de cámara), como lo manda un teléfono"""
+        imagen = Image.new('RGB', (1920, 1080), (120, 80, 40))
+        exif = Image.Exif()
+        exif[0x0112] = 6           # Orientation: rotada 90°
+        exif[0x0110] = 'Pixel 7'   # Model
+        buffer = io.BytesIO()
+        imagen.save(buffer, format='JPEG', quality=95, exif=exif)
+        return buffer.getvalue()
+
+    def test_reduce_rota_y_quita_exif(self):
+        original = self.foto_camara()
+        foto, miniatura = imagenes.procesar_foto(original)
+
+        with Image.open(io.BytesIO(foto)) as img:
+            self.assertEqual(img.size, (450, 800))  # Rotada según EXIF y al máximo de 800px
+            self.assertEqual(len(img.getexif()), 0)
+        with Image.open(io.BytesIO(miniatura)) as img:
+            self.assertEqual(img.size, (imagenes.MINIATURA_LADO, imagenes.MINIATURA_LADO))
+
+        self.assertLess(len(foto), len(original))
+
+    def test_contenido_invalido(self):
+        with self.assertRaises(UnidentifiedImageError):
+            imagenes.procesar_foto(b'no-es-una-imagen')
@@ -5,20 +5,29 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('marcar/', views.registrar_marca, name='registrar_marca'),
+    path('marcar/lote/', views.registrar_marcas_lote, name='registrar_marcas_lote'),
     path('mis-marcas/', views.mis_marcas, name='mis_marcas'),
     path('solicitudes/responder/<int:solicitud_id>/<str:accion>/', views.responder_solicitud, name='responder_solicitud'),
     path('panel-empresa/', views.panel_empresa, name='panel_empresa'),
+    path('panel-empresa/marcas/', views.panel_empresa_marcas, name='panel_empresa_marcas'),
     # path('fiscalizacion/', views.panel_fiscalizador_dt, name='panel_fiscalizador'),
     path('rrhh/panel/', views.panel_rrhh, name='panel_rrhh'),
+    path('rrhh/clima/tendencia/', views.tendencia_clima, name='tendencia_clima'),
     path('reportes/fiscalizacion/', views.exportar_reporte_fiscalizacion, name='reporte_fiscalizacion'),
     path('reportes/remuneraciones/', views.exportar_reporte_remuneraciones, name='reporte_remuneraciones'),
+    path('reportes/solicitar/', views.solicitar_reporte, name='solicitar_reporte'),
+    path('reportes/<int:trabajo_id>/', views.estado_reporte, name='estado_reporte'),
+    path('reportes/<int:trabajo_id>/descargar/', views.descargar_reporte, name='descargar_reporte'),
     path('fiscalizacion-dt/', views.panel_fiscalizador, name='panel_fiscalizador'),
     path('fiscalizacion/exportar-excel/', views.exportar_reporte_fiscalizacion, name='exportar_reporte_fiscalizacion'),
     path('exportar-excel/', views.exportar_excel_empresa, name='exportar_excel_empresa'),
     path('exportar-clima/', views.exportar_clima_laboral, name='exportar_clima'),
     path('descargar-pdf/', views.generar_pdf, name='reporte_pdf'),
     path('privacidad/', views.privacidad, name='privacidad'),
+    path('salud/', views.estado_servicios, name='estado_servicios'),
     path('rrhh/importar-nomina/', views.importar_nomina, name='importar_nomina'),
+    path('rrhh/importar-nomina/<int:importacion_id>/', views.estado_importacion, name='estado_importacion'),
+    path('rrhh/importar-nomina/<int:importacion_id>/confirmar/', views.confirmar_importacion, name='confirmar_importacion'),
     path('mis-vacaciones/', views.mis_vacaciones, name='mis_vacaciones'),
     path('mis-dias-administrativos/', views.mis_dias_administrativos, name='mis_dias_administrativos'),
     path('gestionar-dia/<int:solicitud_id>/<str:accion>/', views.gestionar_dia_administrativo, name='gestionar_dia_administrativo'),
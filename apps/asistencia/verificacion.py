@@ -0,0 +1,103 @@
+"""
+Verificación de la cadena de hash de las marcas (hash_previo → hash_actual).
+
+Cada trabajador se verifica de forma independiente, por eso `verificar_trabajador`
+es una función de módulo: el comando `verificar_cadena` la reparte en un pool de procesos
+(ver `procesos.inicializar_proceso`).
+
+Antes de existir la cabeza (CadenaMarcas) cada marca se encadenaba a la marca más reciente
+por timestamp, no a la anterior por id: una marca retroactiva o sincronizada tarde deja la
+cadena histórica fuera del orden de id. Esas marcas se validan con la regla con que se firmaron.
+"""
+import hashlib
+
+from django.utils import timezone
+
+from .models import Marcacion, CadenaMarcas
+
+
+TAMANO_BLOQUE = 2000
+
+
+def _firma_valida(trabajador_id, timestamp, tipo, hash_previo, hash_actual):
+    if Marcacion.firmar(trabajador_id, timestamp, tipo, hash_previo) == hash_actual:
+        return True
+    # Marcas históricas firmadas con la hora local (ej: marcas manuales por solicitud)
+    local = timezone.localtime(timestamp)
+    raw_data = f"{trabajador_id}{local}{tipo}{hash_previo}"
+    return hashlib.sha256(raw_data.encode('utf-8')).hexdigest() == hash_actual
+
+
+def _mas_recientes(trabajador_id, hasta_marca_id):
+    """Timestamp y hashes de las marcas más recientes (por timestamp) con id <= hasta_marca_id."""
+    anteriores = Marcacion.objects.filter(trabajador_id=trabajador_id, id__lte=hasta_marca_id)
+    ultima = anteriores.order_by('-timestamp').values_list('timestamp', flat=True).first()
+    if ultima is None:
+        return None, set()
+    return ultima, set(anteriores.filter(timestamp=ultima).values_list('hash_actual', flat=True))
+
+
+def verificar_trabajador(trabajador_id, desde_marca_id=0, hash_inicial="GENESIS_BLOCK"):
+    """
+    Recorre las marcas del trabajador posteriores al checkpoint, en el orden en que
+    se encadenaron (id), y recalcula cada enlace. Lee en bloques con .iterator().
+
+    Hasta `CadenaMarcas.legada_hasta_id` (o todas, si la cabeza es anterior a ese campo)
+    el enlace también vale contra la marca más reciente por timestamp insertada antes.
+    """
+    legada_hasta = (
+        CadenaMarcas.objects.filter(trabajador_id=trabajador_id)
+        .values_list('legada_hasta_id', flat=True).first()
+    )
+
+    def es_legada(marca_id):
+        return legada_hasta is None or marca_id <= legada_hasta
+
+    reciente_ts, recientes = (None, set())
+    if desde_marca_id and es_legada(desde_marca_id):
+        reciente_ts, recientes = _mas_recientes(trabajador_id, desde_marca_id)
+
+    marcas = (
+        Marcacion.objects.filter(trabajador_id=trabajador_id, id__gt=desde_marca_id)
+        .order_by('id')
+        .values_list('id', 'timestamp', 'tipo', 'hash_previo', 'hash_actual')
+    )
+
+    anterior = hash_inicial
+    ultima_marca_id = desde_marca_id
+    verificadas = 0
+    rupturas = []
+
+    for marca_id, timestamp, tipo, hash_previo, hash_actual in marcas.iterator(chunk_size=TAMANO_BLOQUE):
+        # La primera marca con cabeza se encadenó a la más reciente del histórico
+        regla_antigua = es_legada(ultima_marca_id) and hash_previo in recientes
+        if hash_previo != anterior and not regla_antigua:
+            rupturas.append({
+                'marca_id': marca_id,
+                'tipo': 'ENLACE_ROTO',
+                'detalle': f"hash_previo {hash_previo[:16]}... no coincide con la marca anterior {anterior[:16]}...",
+            })
+        if not _firma_valida(trabajador_id, timestamp, tipo, hash_previo, hash_actual):
+            rupturas.append({
+                'marca_id': marca_id,
+                'tipo': 'HASH_ALTERADO',
+                'detalle': f"hash_actual no corresponde a los datos de la marca ({tipo} {timestamp.isoformat()})",
+            })
+
+        # Seguimos desde el hash guardado para no arrastrar una ruptura a toda la cadena
+        anterior = hash_actual
+        if es_legada(marca_id):
+            if reciente_ts is None or timestamp > reciente_ts:
+                reciente_ts, recientes = timestamp, {hash_actual}
+            elif timestamp == reciente_ts:
+                recientes.add(hash_actual)
+        ultima_marca_id = marca_id
+        verificadas += 1
+
+    return {
+        'trabajador_id': trabajador_id,
+        'verificadas': verificadas,
+        'ultima_marca_id': ultima_marca_id,
+        'ultimo_hash': anterior,
+        'rupturas': rupturas,
+    }
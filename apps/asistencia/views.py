@@ -1,39 +1,36 @@
 import base64
-import openpyxl
-import hashlib
 import datetime
 import calendar
 import json
 import google.generativeai as genai
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.http import JsonResponse, FileResponse, Http404
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from django.db import models
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.db.models import Min, Max, Count
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from datetime import datetime, timedelta, time
 from django.db.models import Q
 from django.http import HttpResponse
 from django.template.loader import render_to_string
-from django.core.files.base import ContentFile
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
 from django.contrib import messages
-from weasyprint import HTML
-from django.core.exceptions import ValidationError
-from geopy.geocoders import Nominatim
+from django.core.exceptions import ValidationError, RequestDataTooBig
 from django.views.decorators.cache import cache_control
 from django.views.generic import TemplateView
 from django.contrib.admin.views.decorators import staff_member_required
-from django.utils.html import strip_tags
-from .models import Marcacion, Empresa, SolicitudMarca, Feriado, Vacacion, LicenciaMedica, Perfil, DiaAdministrativo
+from .models import Marcacion, JornadaDiaria, TrabajoReporte, ImportacionNomina, EstadoTrabajo, DireccionCache, Empresa, SolicitudMarca, Feriado, Vacacion, LicenciaMedica, Perfil, DiaAdministrativo
 from .forms import VacacionForm, LicenciaForm
+from . import tareas, geocoding, ntp_time, remuneraciones, exportacion, jornadas, reportes, libros, clima, paginacion, importacion
 
 
 
@@ -66,243 +63,281 @@ class ServiceWorkerView(TemplateView):
 @login_required
 def home(request):
     # 1. Chequeo de cambio de contraseña obligatorio
-    if hasattr(request.user, 'perfil') and request.user.perfil.cambiar_pass_inicial:
+    if request.perfil and request.perfil.cambiar_pass_inicial:
         return redirect('cambiar_password_obligatorio')
 
     # 2. Cargar datos para el Dashboard
-    ultimas_marcas = Marcacion.objects.filter(trabajador=request.user).order_by('-timestamp')[:5]
-    ultima_marca = Marcacion.objects.filter(trabajador=request.user).order_by('-timestamp').first()
+    ultimas_marcas = list(Marcacion.objects.filter(trabajador=request.user).order_by('-timestamp')[:5])
+    ultima_marca = ultimas_marcas[0] if ultimas_marcas else None
     solicitudes_pendientes = SolicitudMarca.objects.filter(trabajador=request.user, estado='PENDIENTE').exclude(solicitante=request.user) # <--- ESTO HACE LA MAGIA
 
     contexto = {
         'marcas': ultimas_marcas,
         'ultima_marca': ultima_marca,
         'solicitudes': solicitudes_pendientes,
+        # Límites con que el teléfono arma los lotes de marcas offline
+        'lote_max_marcas': MARCAS_POR_LOTE_CLIENTE,
+        'lote_max_bytes': BYTES_POR_LOTE_CLIENTE,
     }
 
     return render(request, 'asistencia/dashboard.html', contexto)
 
-@login_required
-def registrar_marca(request):
-    # Validamos que sea POST
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Método no permitido'}, status=405)
-
-    # =================================================================
-    # 1. OBTENCIÓN DE DATOS HÍBRIDA (Fuera del Try Principal)
-    # =================================================================
-    try:
-        data = json.loads(request.body)
-    except (json.JSONDecodeError, AttributeError):
-        data = request.POST
-
+def _construir_marca(usuario, data, ip, foto_archivo=None):
+    """
+    Arma (sin guardar) una Marcacion con los datos enviados por el dashboard.
+    Devuelve (marca, foto, nombre_foto) o lanza ValidationError; `foto` es un archivo
+    (el temporal subido o el base64 decodificado) que `tareas.encolar_marca` deja en el storage.
+    La usan /marcar/ y /marcar/lote/ para validar igual en ambos casos.
+    `foto_archivo` es el JPEG subido en modo multipart; si no viene se usa `foto_base64`.
+    """
     # Extraemos variables
     tipo = data.get('tipo', 'ENTRADA')
     raw_lat = data.get('latitud')
     raw_lon = data.get('longitud')
     foto_b64 = data.get('foto_base64')
-    ip = request.META.get('REMOTE_ADDR')
-    
+
     # Datos extra
-    animo_recibido = data.get('animo')
+    animo_recibido = data.get('animo') or None
     comentario_recibido = data.get('comentario_animo')
     fecha_offline_str = data.get('fecha_offline')
 
-    # Procesar fecha (si viene de offline)
-    timestamp_real = timezone.now()
+    # --- 1. PROCESAR FECHA (hora SHOA; si viene de offline, la del teléfono) ---
+    timestamp_real = ntp_time.hora_oficial()
     if fecha_offline_str:
         try:
             timestamp_real = datetime.fromisoformat(fecha_offline_str.replace('Z', '+00:00'))
+            if timezone.is_naive(timestamp_real):
+                timestamp_real = timezone.make_aware(timestamp_real)
         except ValueError:
             pass
 
+    # --- 2. PROCESAR GPS ---
+    lat, lon = 0, 0
+    if raw_lat and str(raw_lat).lower() != 'nan':
+        try:
+            lat = "{:.7f}".format(float(raw_lat))
+            lon = "{:.7f}".format(float(raw_lon))
+        except (ValueError, TypeError):
+            lat, lon = 0, 0
+
+    # --- 3. DIRECCIÓN (solo caché; si no está, la resuelve el worker de tareas) ---
+    direccion_texto = "Ubicación no detectada"
+    if float(lat) != 0:
+        direccion_texto = geocoding.buscar_en_cache(lat, lon)
+
+    # --- 4. CREAR INSTANCIA ---
+    nueva_marca = Marcacion(
+        trabajador=usuario,
+        tipo=tipo,
+        latitud=lat,
+        longitud=lon,
+        timestamp=timestamp_real,
+        direccion=direccion_texto,
+        ip_address=ip,
+        animo=animo_recibido,
+        comentario_animo=comentario_recibido
+    )
+
+    # --- 5. DECODIFICAR FOTO (se sube a Cloudinary en segundo plano) ---
+    foto, nombre_foto = None, None
+    if foto_archivo is not None:
+        # Modo multipart: el JPEG llega binario (sin base64) y ya está en un archivo temporal,
+        # que se mueve tal cual al storage (no se lee a memoria)
+        ext = foto_archivo.name.rsplit('.', 1)[-1].lower() if '.' in foto_archivo.name else 'jpg'
+        nombre_foto = f'marca_{usuario.id}_{int(timestamp_real.timestamp())}.{ext}'
+        foto = foto_archivo if foto_archivo.size else None
+    elif foto_b64:
+        try:
+            if ";base64," in foto_b64:
+                format_data, imgstr = foto_b64.split(';base64,')
+                ext = format_data.split('/')[-1]
+                if not ext: ext = "jpg"
+            else:
+                imgstr = foto_b64
+                ext = "jpg"
+
+            nombre_foto = f'marca_{usuario.id}_{int(timestamp_real.timestamp())}.{ext}'
+            contenido = base64.b64decode(imgstr)
+            foto = ContentFile(contenido) if contenido else None
+        except Exception as e:
+            print(f"Error procesando foto: {e}")
+            raise ValidationError('Error al procesar la imagen.')
+
+    # --- 6. VALIDACIONES HARDWARE ---
+    if tipo in ['ENTRADA', 'SALIDA']:
+        if float(nueva_marca.latitud) == 0:
+            raise ValidationError('Hardware: GPS no detectado.')
+        if not foto:
+            raise ValidationError('Hardware: Foto no detectada.')
+
+    return nueva_marca, foto, nombre_foto
+
+
+@csrf_exempt
+@login_required
+def registrar_marca(request):
+    # Las fotos multipart se escriben a un archivo temporal en vez de quedar en memoria.
+    # Los upload handlers se deben cambiar antes de que el middleware CSRF lea request.POST,
+    # por eso el CSRF se valida recién en la vista interna (ver docs de Django).
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    return _registrar_marca(request)
+
+
+@csrf_protect
+def _registrar_marca(request):
+    # Validamos que sea POST
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+
     # =================================================================
-    # INICIO DEL TRY PRINCIPAL (Aquí empieza la protección lógica)
+    # 1. OBTENCIÓN DE DATOS HÍBRIDA (multipart, JSON o formulario)
     # =================================================================
+    foto_archivo = None
+    if request.content_type == 'multipart/form-data':
+        # Modo binario: no tocamos request.body para no cargar el archivo completo en memoria
+        data = request.POST
+        foto_archivo = request.FILES.get('foto')
+    else:
+        # Modo base64-en-JSON (clientes antiguos con el JS en caché)
+        try:
+            data = json.loads(request.body)
+        except (json.JSONDecodeError, AttributeError):
+            data = request.POST
+
+    # Reintento de una marca ya registrada: respondemos OK sin duplicarla
+    clave = data.get('clave_idempotencia')
+    if clave and Marcacion.objects.filter(trabajador=request.user, clave_idempotencia=clave).exists():
+        return JsonResponse({'status': 'ok', 'mensaje': 'Marca ya registrada.', 'duplicada': True})
+
+    # El temporal de la foto se mueve al storage al encolar; si no, lo borra Django al cerrar el request
     try:
-        # --- 2. PROCESAR GPS ---
-        lat, lon = 0, 0
-        if raw_lat and str(raw_lat).lower() != 'nan':
-            try:
-                lat = "{:.7f}".format(float(raw_lat))
-                lon = "{:.7f}".format(float(raw_lon))
-            except (ValueError, TypeError):
-                lat, lon = 0, 0
-
-        # --- 3. OBTENER DIRECCIÓN (GEOCODING) ---
-        direccion_texto = "Ubicación no detectada"
-        if lat and lon:
-            try:
-                geolocator = Nominatim(user_agent="asistencia_perseus_v1", timeout=5)
-                location = geolocator.reverse(f"{lat}, {lon}", timeout=5)
-                if location:
-                        direccion_texto = location.address
-            except Exception as e:
-                print(f"Error Geopy: {e}")
-                direccion_texto = "Error de conexión con mapa"
-
-        # --- 4. CREAR INSTANCIA ---
-        nueva_marca = Marcacion(
-            trabajador=request.user,
-            tipo=tipo,
-            latitud=lat,
-            longitud=lon,
-            timestamp=timestamp_real,
-            direccion=direccion_texto,
-            ip_address=ip,
-            animo=animo_recibido,
-            comentario_animo=comentario_recibido
+        nueva_marca, foto, nombre_foto = _construir_marca(
+            request.user, data, request.META.get('REMOTE_ADDR'), foto_archivo=foto_archivo
         )
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
 
-        # --- 5. PROCESAR FOTO (Cloudinary) ---
-        if foto_b64:
-            try:
-                if ";base64," in foto_b64:
-                    format_data, imgstr = foto_b64.split(';base64,')
-                    ext = format_data.split('/')[-1]
-                    if not ext: ext = "jpg"
-                else:
-                    imgstr = foto_b64
-                    ext = "jpg"
-
-                nombre_foto = f'marca_{request.user.id}_{int(timezone.now().timestamp())}.{ext}'
-                archivo_imagen = ContentFile(base64.b64decode(imgstr), name=nombre_foto)
-                
-                # Asignamos al modelo
-                nueva_marca.foto = archivo_imagen
-            except Exception as e:
-                print(f"Error procesando foto: {e}")
-                return JsonResponse({'error': 'Error al procesar la imagen.'}, status=400)
-
-        # --- 6. VALIDACIONES HARDWARE ---
-        if tipo in ['ENTRADA', 'SALIDA']:
-            if float(nueva_marca.latitud) == 0:
-                return JsonResponse({'error': 'Hardware: GPS no detectado.'}, status=400)
-            if not nueva_marca.foto:
-                return JsonResponse({'error': 'Hardware: Foto no detectada.'}, status=400)
-
-        # --- 7. GUARDAR (Sube a Cloudinary y guarda en BD) ---
-        nueva_marca.save()
-
-        # --- 8. ENVÍO DE CORREO PROFESIONAL (HTML) ---
-        if request.user.email:
-            try:
-                # A. Preparar datos
-                hora_fmt = timezone.localtime(nueva_marca.timestamp).strftime('%H:%M:%S')
-                fecha_fmt = timezone.localtime(nueva_marca.timestamp).strftime('%d/%m/%Y')
-
-                # Obtener datos de la empresa
-                datos_empresa = Empresa.objects.first()
-                nombre_empresa = datos_empresa.nombre if datos_empresa else "Su Empresa"
-                email_rrhh = datos_empresa.email_rrhh if datos_empresa else None
-
-                # Enlace a Google Maps
-                link_maps = f"https://www.google.com/maps?q={nueva_marca.latitud},{nueva_marca.longitud}"
-                ubicacion_texto = nueva_marca.direccion if nueva_marca.direccion else "Coordenadas GPS"
-
-                # B. Definir Asunto
-                asunto = f'✅ Comprobante de Asistencia: {tipo} - {request.user.get_full_name()}'
-
-                # C. Crear el Mensaje en HTML (TU DISEÑO EXACTO)
-                html_message = f"""
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <style>
-                            body {{ font-family: Arial, sans-serif; color: #333333; }}
-                            .container {{ max-width: 600px; margin: 0 auto; border: 1px solid #e0e0e0; border-radius: 8px; overflow: hidden; }}
-                            .header {{ background-color: #004085; color: #ffffff; padding: 20px; text-align: center; }}
-                            .content {{ padding: 25px; background-color: #ffffff; }}
-                            .detail-table {{ width: 100%; border-collapse: collapse; margin-top: 15px; margin-bottom: 20px; }}
-                            .detail-table td {{ padding: 10px; border-bottom: 1px solid #f0f0f0; }}
-                            .label {{ font-weight: bold; color: #555555; width: 40%; }}
-                            .footer {{ background-color: #f8f9fa; padding: 15px; text-align: center; font-size: 12px; color: #888888; border-top: 1px solid #e0e0e0; }}
-                            .btn {{ display: inline-block; padding: 8px 12px; background-color: #28a745; color: white; text-decoration: none; border-radius: 4px; font-size: 12px; }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="container">
-                            <div class="header">
-                                <h2 style="margin:0;">Registro de Asistencia</h2>
-                                <p style="margin:5px 0 0; font-size: 14px; opacity: 0.9;">{nombre_empresa}</p>
-                            </div>
-                            <div class="content">
-                                <p>Estimado/a <strong>{request.user.first_name} {request.user.last_name}</strong>,</p>
-                                <p>El sistema ha procesado exitosamente su marcación. A continuación se detallan los datos del registro:</p>
-
-                                <table class="detail-table">
-                                    <tr>
-                                        <td class="label">Tipo de Marca:</td>
-                                        <td><strong style="color: #004085;">{tipo}</strong></td>
-                                    </tr>
-                                    <tr>
-                                        <td class="label">Fecha:</td>
-                                        <td>{fecha_fmt}</td>
-                                    </tr>
-                                    <tr>
-                                        <td class="label">Hora Registrada:</td>
-                                        <td>{hora_fmt}</td>
-                                    </tr>
-                                    <tr>
-                                        <td class="label">Ubicación:</td>
-                                        <td>
-                                            {ubicacion_texto}<br>
-                                            <a href="{link_maps}" class="btn" style="color: white; margin-top:5px;">Ver en Mapa</a>
-                                        </td>
-                                    </tr>
-                                    <tr>
-                                        <td class="label">Estado:</td>
-                                        <td><span style="color:green;">✔ Validado Exitosamente</span></td>
-                                    </tr>
-                                </table>
-
-                                <p style="font-size: 13px; color: #666;">Este registro ha sido almacenado en nuestra base de datos segura y servirá como respaldo oficial de su jornada laboral.</p>
-                            </div>
-                            <div class="footer">
-                                <p>Este es un mensaje automático generado por el Sistema de Gestión de Asistencia de {nombre_empresa}.<br>
-                                Por favor, no responda a este correo.</p>
-                            </div>
-                        </div>
-                    </body>
-                    </html>
-                    """
-
-                # D. Versión Texto Plano y Remitente
-                plain_message = strip_tags(html_message)
-                nombre_mostrar = "Sistema de Asistencia"
-                # Usamos el remitente configurado en settings
-                remitente = f"{nombre_mostrar} <{settings.EMAIL_HOST_USER}>"
-
-                # E. Configurar Destinatarios (AQUÍ ESTABA EL ERROR DE INDENTACIÓN CORREGIDO)
-                destinatarios = [request.user.email]
-                if email_rrhh:
-                    destinatarios.append(email_rrhh)
-                    print(f"✅ Copia enviada a RRHH: {email_rrhh}")
-
-                # F. Enviar (AHORA FUERA DEL IF DE RRHH)
-                send_mail(
-                    subject=asunto,
-                    message=plain_message,
-                    from_email=remitente, # Usa settings para evitar error de sender
-                    recipient_list=destinatarios,
-                    html_message=html_message,
-                    fail_silently=False # <--- Activado para ver errores
-                )
-                print("✅ Correo enviado exitosamente.")
-
-            except Exception as e:
-                print(f"❌ Error enviando correo: {e}")
-
-        # --- 9. RESPUESTA FINAL EXITOSA ---
-        return JsonResponse({'status': 'ok', 'mensaje': 'Marca registrada correctamente.'})
+    nueva_marca.clave_idempotencia = clave or None
 
     # =================================================================
-    # CIERRE DEL TRY PRINCIPAL (Los excepts van aquí, alineados con el try)
+    # 2. GUARDAR MARCA + ENCOLAR TAREAS (misma transacción)
     # =================================================================
+    # Geocoding, subida de foto y correo los hace `procesar_tareas` con reintentos
+    try:
+        with transaction.atomic():
+            nueva_marca.save()
+            tareas.encolar_marca(nueva_marca, foto=foto, nombre_foto=nombre_foto)
+
+        return JsonResponse({'status': 'ok', 'mensaje': 'Marca registrada correctamente.'})
+
+    except IntegrityError:
+        # Mismo reintento llegando en paralelo: la clave_idempotencia ya quedó guardada
+        return JsonResponse({'status': 'ok', 'mensaje': 'Marca ya registrada.', 'duplicada': True})
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
     except Exception as e:
         print(f"Error crítico en servidor: {e}")
         return JsonResponse({'error': f"Error del sistema: {str(e)}"}, status=500)
-    
+
+
+MAX_MARCAS_LOTE = 100
+# El cliente arma lotes bastante más chicos que el máximo: así un lote nunca choca con
+# MAX_MARCAS_LOTE ni con el tamaño de request que acepte el proxy (fotos de ~300 KB)
+MARCAS_POR_LOTE_CLIENTE = 20
+BYTES_POR_LOTE_CLIENTE = 2 * 1024 * 1024
+
+@csrf_exempt
+@login_required
+def registrar_marcas_lote(request):
+    # Igual que /marcar/: las fotos multipart van a archivos temporales y el CSRF se valida adentro
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    return _registrar_marcas_lote(request)
+
+
+@csrf_protect
+def _registrar_marcas_lote(request):
+    """
+    Sincronización offline: recibe las marcas guardadas en el teléfono en un solo POST.
+    Cada marca trae una `clave_idempotencia` generada en el cliente, así que reenviar
+    el mismo lote (ej: se cortó la conexión a mitad) no crea duplicados.
+
+    Formato multipart (el actual): campo `marcas` con el JSON sin fotos y un archivo
+    `foto_<clave_idempotencia>` por marca. Se sigue aceptando el JSON con `foto_base64`
+    de los clientes antiguos; si ese cuerpo excede el límite de Django se responde 413
+    para que el cliente parta el lote.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+    fotos = {}
+    try:
+        if request.content_type == 'multipart/form-data':
+            items = json.loads(request.POST.get('marcas') or 'null')
+            fotos = request.FILES
+        else:
+            items = json.loads(request.body).get('marcas')
+    except RequestDataTooBig:
+        return JsonResponse({'error': 'Lote demasiado grande, envíelo en partes.'}, status=413)
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'error': 'JSON inválido.'}, status=400)
+
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'error': 'Se esperaba una lista de marcas.'}, status=400)
+    if len(items) > MAX_MARCAS_LOTE:
+        return JsonResponse({'error': f'Máximo {MAX_MARCAS_LOTE} marcas por lote.'}, status=413)
+
+    ip = request.META.get('REMOTE_ADDR')
+    claves = [item.get('clave_idempotencia') if isinstance(item, dict) else None for item in items]
+
+    # 1. Claves ya registradas (reintentos): una sola consulta
+    existentes = dict(
+        Marcacion.objects.filter(trabajador=request.user, clave_idempotencia__in=[c for c in claves if c])
+        .values_list('clave_idempotencia', 'id')
+    )
+
+    # 2. Validar cada ítem antes de tocar la BD
+    resultados = [None] * len(items)
+    preparadas = []
+    vistas = set()
+    for i, (item, clave) in enumerate(zip(items, claves)):
+        if not clave:
+            resultados[i] = {'clave_idempotencia': None, 'status': 'error', 'error': 'Falta clave_idempotencia.'}
+            continue
+        if clave in existentes or clave in vistas:
+            resultados[i] = {'clave_idempotencia': clave, 'status': 'duplicada', 'id': existentes.get(clave)}
+            continue
+        vistas.add(clave)
+
+        # Los temporales de request.FILES los borra Django al cerrar el request
+        try:
+            marca, foto, nombre_foto = _construir_marca(request.user, item, ip, foto_archivo=fotos.get(f'foto_{clave}'))
+        except ValidationError as e:
+            resultados[i] = {'clave_idempotencia': clave, 'status': 'error', 'error': e.messages[0]}
+            continue
+
+        marca.clave_idempotencia = clave
+        preparadas.append((i, marca, foto, nombre_foto))
+
+    # 3. Insertar en orden cronológico (así la cadena de hash queda en el orden real)
+    preparadas.sort(key=lambda p: p[1].timestamp)
+
+    with transaction.atomic():
+        for i, marca, foto, nombre_foto in preparadas:
+            clave = marca.clave_idempotencia
+            try:
+                with transaction.atomic():  # Savepoint: un ítem inválido no tumba el lote
+                    marca.save()
+                    tareas.encolar_marca(marca, foto=foto, nombre_foto=nombre_foto)
+                resultados[i] = {'clave_idempotencia': clave, 'status': 'ok', 'id': marca.id}
+            except IntegrityError:
+                # Otro request guardó la misma clave en paralelo
+                previa = Marcacion.objects.filter(trabajador=request.user, clave_idempotencia=clave).first()
+                resultados[i] = {'clave_idempotencia': clave, 'status': 'duplicada', 'id': previa.id if previa else None}
+            except ValidationError as e:
+                resultados[i] = {'clave_idempotencia': clave, 'status': 'error', 'error': e.messages[0]}
+
+    return JsonResponse({'status': 'ok', 'resultados': resultados})
+
 
 @login_required
 def mis_marcas(request):
@@ -315,35 +350,77 @@ def mis_marcas(request):
 # 3. PANELES DE GESTIÓN (EMPLEADOR Y FISCALIZADOR)
 # =======================================================
 
+def _marcas_panel_empresa(empresa, fecha_inicio, fecha_fin, busqueda):
+    """
+    Marcas de la empresa con los filtros del panel aplicados en la BD. Las fechas se
+    filtran como rango de timestamps (no con __date, que obliga a convertir cada fila).
+    """
+    marcas = Marcacion.objects.filter(trabajador__perfil__empresa=empresa).select_related('trabajador__perfil').only(
+        'id', 'timestamp', 'tipo', 'latitud', 'longitud', 'direccion', 'foto', 'miniatura', 'animo', 'comentario_animo',
+        'trabajador__first_name', 'trabajador__last_name', 'trabajador__perfil__rut', 'trabajador__perfil__cargo',
+    )
+
+    desde = reportes.parsear_fecha(fecha_inicio)
+    hasta = reportes.parsear_fecha(fecha_fin)
+    if desde:
+        marcas = marcas.filter(timestamp__gte=JornadaDiaria.rango_dia(desde)[0])
+    if hasta:
+        marcas = marcas.filter(timestamp__lt=JornadaDiaria.rango_dia(hasta)[1])
+
+    if busqueda:
+        marcas = marcas.filter(
+            Q(trabajador__first_name__icontains=busqueda) |
+            Q(trabajador__last_name__icontains=busqueda) |
+            Q(trabajador__perfil__rut__icontains=busqueda)
+        )
+    return marcas
+
+def _json_marca(marca):
+    """Datos mínimos de una fila del panel (el navegador arma la tabla y las tarjetas)."""
+    trabajador = marca.trabajador
+    perfil = getattr(trabajador, 'perfil', None)
+    local = timezone.localtime(marca.timestamp)
+    foto = marca.foto.url if marca.foto else None
+    return {
+        'id': marca.id,
+        'nombre': f"{trabajador.first_name} {trabajador.last_name}",
+        'rut': perfil.rut if perfil else None,
+        'cargo': perfil.cargo if perfil else None,
+        'fecha': local.strftime("%d/%m/%Y %H:%M"),
+        'fecha_corta': local.strftime("%d/%m %H:%M"),
+        'tipo': marca.tipo,
+        'latitud': str(marca.latitud) if marca.latitud is not None else None,
+        'longitud': str(marca.longitud) if marca.longitud is not None else None,
+        'direccion': marca.direccion,
+        'foto': foto,
+        'miniatura': marca.miniatura.url if marca.miniatura else foto,
+        'animo': marca.animo,
+        'comentario_animo': marca.comentario_animo,
+    }
+
 @login_required
 @user_passes_test(es_empleador)
 def panel_empresa(request):
-    """Panel para el Jefe/RRHH con filtros y buscador."""
-    try:
-        mi_empresa = request.user.perfil.empresa
-    except AttributeError:
+    """
+    Panel para el Jefe/RRHH con filtros y buscador. Solo se dibuja la primera página
+    de marcas; las siguientes las pide el scroll infinito a `panel_empresa_marcas`.
+    """
+    # Perfil y Empresa ya vienen resueltos por ContextoEmpresaMiddleware
+    if request.perfil is None:
         messages.error(request, "Su usuario no tiene empresa asignada.")
         return redirect('home')
-
-    marcas = Marcacion.objects.filter(trabajador__perfil__empresa=mi_empresa).order_by('-timestamp')
+    mi_empresa = request.empresa
 
     # Filtros
     fecha_inicio = request.GET.get('fecha_inicio')
     fecha_fin = request.GET.get('fecha_fin')
     busqueda = request.GET.get('busqueda')
 
-    if fecha_inicio and fecha_fin:
-        marcas = marcas.filter(timestamp__date__range=[fecha_inicio, fecha_fin])
-
-    if busqueda:
-        marcas = marcas.filter(
-            Q(trabajador__first_name__icontains=busqueda) |
-            Q(trabajador__last_name__icontains=busqueda) |
-            Q(trabajador__perfil__rut__icontains=busqueda)
-        )
+    marcas, siguiente = paginacion.pagina(_marcas_panel_empresa(mi_empresa, fecha_inicio, fecha_fin, busqueda))
 
     context = {
         'marcas': marcas,
+        'siguiente': siguiente,
         'nombre_empresa': mi_empresa.nombre,
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin,
@@ -351,6 +428,28 @@ def panel_empresa(request):
     }
     return render(request, 'asistencia/panel_empresa.html', context)
 
+@login_required
+@user_passes_test(es_empleador)
+def panel_empresa_marcas(request):
+    """Página siguiente de marcas del panel en JSON (?cursor=, mismos filtros que el panel)."""
+    if request.empresa is None:
+        return JsonResponse({'error': 'Su usuario no tiene empresa asignada.'}, status=403)
+
+    try:
+        tamano = int(request.GET.get('tamano', 0))
+    except ValueError:
+        tamano = None
+
+    marcas = _marcas_panel_empresa(
+        request.empresa, request.GET.get('fecha_inicio'), request.GET.get('fecha_fin'), request.GET.get('busqueda')
+    )
+    try:
+        marcas, siguiente = paginacion.pagina(marcas, request.GET.get('cursor'), tamano)
+    except paginacion.CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'marcas': [_json_marca(m) for m in marcas], 'siguiente': siguiente})
+
 @staff_member_required
 def panel_rrhh(request):
     # 1. LOGICA ORIGINAL: Buscamos solicitudes de marcas
@@ -372,23 +471,8 @@ def panel_rrhh(request):
     ).order_by('fecha')
     # -----------------------------------------------------
 
-    # 1. FILTRO: Últimos 7 días
-    fecha_inicio = timezone.now() - timedelta(days=7)
-
-    # 2. CONSULTA AGRUPADA (La magia de Django)
-    # Esto devuelve algo como: [{'animo': 'FELIZ', 'total': 15}, {'animo': 'MOLESTO', 'total': 3}]
-    data_animo = Marcacion.objects.filter(
-        timestamp__gte=fecha_inicio,
-        animo__isnull=False
-    ).values('animo').annotate(total=Count('animo'))
-
-    # 3. PROCESAR PARA EL GRÁFICO
-    # Inicializamos contadores en 0 por si nadie ha marcado alguna emoción
-    conteo = {'FELIZ': 0, 'NEUTRAL': 0, 'MOLESTO': 0}
-
-    for item in data_animo:
-        if item['animo'] in conteo:
-            conteo[item['animo']] = item['total']
+    # 4. CLIMA LABORAL (últimos 7 días) desde el resumen diario, solo de su empresa
+    conteo = clima.conteo(request.empresa, dias=7)
 
     # Calculamos el total para sacar porcentajes si quisieras, o pasamos los números directos
     context = {
@@ -403,6 +487,24 @@ def panel_rrhh(request):
     # 3. Enviamos ambas listas al template
     return render(request, 'asistencia/panel_rrhh.html', context)
 
+@staff_member_required
+def tendencia_clima(request):
+    """
+    JSON con la evolución del ánimo por semana o mes (?agrupar=semana|mes, ?periodos=12,
+    ?cargo=) para el gráfico de tendencia del panel RRHH.
+    """
+    try:
+        periodos = int(request.GET.get('periodos', 12))
+    except ValueError:
+        periodos = 12
+    datos = clima.tendencia(
+        request.empresa,
+        agrupar=request.GET.get('agrupar', 'semana'),
+        periodos=periodos,
+        cargo=request.GET.get('cargo') or None,
+    )
+    return JsonResponse(datos)
+
 @login_required
 @user_passes_test(es_fiscalizador)
 def panel_fiscalizador(request):
@@ -410,7 +512,7 @@ def panel_fiscalizador(request):
     Panel Auditoría DT con cálculo de jornadas (Entrada vs Salida).
     """
     # 1. SEGURIDAD: Obtener empresa del fiscalizador logueado
-    perfil = getattr(request.user, 'perfil', None)
+    perfil = request.perfil
     if not perfil or not perfil.empresa:
         messages.error(request, "Usuario fiscalizador sin empresa asignada.")
         return redirect('home')
@@ -420,100 +522,22 @@ def panel_fiscalizador(request):
     # 2. FILTROS DE FECHA (Vital para que no colapse el sistema)
     desde = request.GET.get('desde')
     hasta = request.GET.get('hasta')
-
-    # Base de consulta: Solo marcas de ESTA empresa, ordenadas para el algoritmo
-    # select_related optimiza la consulta a la BD
-    marcas_qs = Marcacion.objects.filter(
-        trabajador__perfil__empresa=empresa
-    ).select_related('trabajador', 'trabajador__perfil').order_by('trabajador', 'timestamp')
-
-    if desde and hasta:
-        # Agregamos un día extra al final para asegurar cobertura completa de fechas
-        marcas_qs = marcas_qs.filter(timestamp__range=[desde, hasta + " 23:59:59"])
-    else:
-        # Por defecto: Últimos 30 días si no hay filtro (para no cargar años de historia)
-        mes_atras = timezone.now() - datetime.timedelta(days=30)
-        marcas_qs = marcas_qs.filter(timestamp__gte=mes_atras)
-
-    # 3. ALGORITMO DE EMPAREJAMIENTO (Tu lógica, optimizada) 🧠
-    jornadas = []
-    entrada_pendiente = None
-
-    # Iteramos sobre el QuerySet ya filtrado
-    for marca in marcas_qs:
-        # Si cambiamos de trabajador, reiniciamos el ciclo (por seguridad)
-        if entrada_pendiente and entrada_pendiente.trabajador != marca.trabajador:
-             # Cerramos la anterior como inconclusa
-             jornadas.append({
-                'trabajador': entrada_pendiente.trabajador,
-                'fecha': entrada_pendiente.timestamp,
-                'entrada': entrada_pendiente.timestamp,
-                'salida': None,
-                'duracion': 'Sin marcación de salida',
-                'estado': 'warning' # Amarillo
-            })
-             entrada_pendiente = None
-
-        if marca.tipo == 'ENTRADA':
-            if entrada_pendiente:
-                # Doble entrada (Error)
-                jornadas.append({
-                    'trabajador': entrada_pendiente.trabajador,
-                    'fecha': entrada_pendiente.timestamp,
-                    'entrada': entrada_pendiente.timestamp,
-                    'salida': None,
-                    'duracion': 'Error: Doble Entrada',
-                    'estado': 'warning'
-                })
-            entrada_pendiente = marca
-
-        elif marca.tipo == 'SALIDA':
-            if entrada_pendiente:
-                # CICLO CORRECTO: Entrada + Salida
-                diferencia = marca.timestamp - entrada_pendiente.timestamp
-                total_segundos = int(diferencia.total_seconds())
-                horas = total_segundos // 3600
-                minutos = (total_segundos % 3600) // 60
-
-                jornadas.append({
-                    'trabajador': marca.trabajador,
-                    'fecha': marca.timestamp,
-                    'entrada': entrada_pendiente.timestamp,
-                    'salida': marca.timestamp,
-                    'duracion': f"{horas}h {minutos}m",
-                    'estado': 'success' # Verde
-                })
-                entrada_pendiente = None
-            else:
-                # Salida huérfana (Sin entrada previa)
-                jornadas.append({
-                    'trabajador': marca.trabajador,
-                    'fecha': marca.timestamp,
-                    'entrada': None,
-                    'salida': marca.timestamp,
-                    'duracion': 'Error: Falta Entrada',
-                    'estado': 'danger' # Rojo
-                })
-
-        # Ignoramos Colaciones por ahora para simplificar el reporte DT
-
-    # Check final por si quedó alguno colgado
-    if entrada_pendiente:
-        jornadas.append({
-            'trabajador': entrada_pendiente.trabajador,
-            'fecha': entrada_pendiente.timestamp,
-            'entrada': entrada_pendiente.timestamp,
-            'salida': None,
-            'duracion': 'En curso (Trabajando)',
-            'estado': 'info' # Azul
-        })
-
-    # Invertimos para ver lo más reciente arriba
-    jornadas.reverse()
+    # Por defecto: Últimos 30 días si no hay filtro (para no cargar años de historia)
+    fecha_desde, fecha_hasta = jornadas.rango_fechas(desde, hasta)
+
+    # 3. JORNADAS YA EMPAREJADAS (tabla JornadaDiaria, una fila por trabajador y día) 🧠
+    # Las colaciones no se muestran en el reporte DT: solo días con Entrada o Salida
+    jornadas_qs = (
+        JornadaDiaria.objects
+        .filter(trabajador__perfil__empresa=empresa, fecha__range=[fecha_desde, fecha_hasta])
+        .filter(Q(entrada__isnull=False) | Q(salida__isnull=False))
+        .select_related('trabajador', 'trabajador__perfil')
+        .order_by('-fecha', '-trabajador_id')  # Lo más reciente arriba
+    )
 
     context = {
         'empresa': empresa,
-        'jornadas': jornadas,
+        'jornadas': jornadas_qs,
         'desde': desde,
         'hasta': hasta
     }
@@ -524,18 +548,56 @@ def panel_fiscalizador(request):
 # 4. REPORTES Y EXPORTACIÓN
 # =======================================================
 
+def _hhmm(segundos):
+    return f"{int(segundos//3600):02d}:{int((segundos%3600)//60):02d}"
+
+
+def _filas_detalle_empresa(jornadas_qs, nombre_empresa):
+    """
+    Una fila por trabajador y día (Entrada, colación, Salida, horas), leída
+    directo de JornadaDiaria: el emparejamiento ya está hecho al marcar.
+    """
+    filas = jornadas_qs.values_list(
+        'fecha', 'trabajador__first_name', 'trabajador__last_name',
+        'trabajador__perfil__rut', 'trabajador__perfil__cargo',
+        'entrada', 'inicio_colacion', 'fin_colacion', 'salida',
+        'segundos_colacion', 'segundos_trabajados',
+    ).iterator(chunk_size=exportacion.CHUNK_FILAS)
+
+    def hora(ts):
+        return timezone.localtime(ts).strftime("%H:%M") if ts else "--"
+
+    for fecha, nombre, apellido, rut, cargo, entrada, inicio_col, fin_col, salida, seg_col, seg_trab in filas:
+        yield [
+            fecha.strftime("%d/%m/%Y"),
+            nombre_empresa,
+            f"{nombre} {apellido}",
+            rut,
+            cargo,
+            hora(entrada),
+            hora(inicio_col),
+            hora(fin_col),
+            _hhmm(seg_col) if inicio_col and fin_col else "",  # Tiempo Colación
+            hora(salida),
+            _hhmm(seg_trab) if entrada and salida else "",  # Bruto: Salida - Entrada
+        ]
+
+
+@login_required
 def exportar_excel_empresa(request):
     """
     Genera el reporte interno para RRHH (Imagen: Detalle de marcas, colación y horas).
-    NO incluye Hash. Es para gestión.
+    NO incluye Hash. Es para gestión. Con ?formato=csv|csv.gz se entrega como CSV.
     """
-    # 1. Validar Empresa
-    perfil = getattr(request.user, 'perfil', None)
+    # 1. Validar Empresa y rol
+    perfil = request.perfil
     if not perfil or not perfil.empresa:
         return redirect('home')
+    if not es_empleador(request.user):
+        return HttpResponse("Error: Reporte solo para RRHH.", status=403)
 
-    # 2. Obtener marcas de la empresa
-    marcas = Marcacion.objects.filter(trabajador__perfil__empresa=perfil.empresa).order_by('trabajador', 'timestamp')
+    # 2. Jornadas de la empresa (una fila por trabajador y día)
+    jornadas_qs = JornadaDiaria.objects.filter(trabajador__perfil__empresa=perfil.empresa).order_by('trabajador', 'fecha')
 
     # 3. Filtros de Fecha (Opcional)
     fecha_inicio = request.GET.get('fecha_inicio')
@@ -543,191 +605,113 @@ def exportar_excel_empresa(request):
 
     if fecha_inicio and fecha_fin:
         try:
-            marcas = marcas.filter(timestamp__date__range=[fecha_inicio, fecha_fin])
+            jornadas_qs = jornadas_qs.filter(fecha__range=[fecha_inicio, fecha_fin])
         except: pass
 
-    # 4. Procesar Datos (Agrupar por Día y Persona)
-    reporte = {}
-    for marca in marcas:
-        fecha_local = timezone.localtime(marca.timestamp)
-        # Clave única: ID Trabajador + Fecha
-        key = (marca.trabajador.id, fecha_local.date())
-
-        if key not in reporte:
-            p = getattr(marca.trabajador, 'perfil', None)
-            reporte[key] = {
-                'fecha': fecha_local.date(),
-                'empresa': perfil.empresa.nombre,
-                'trabajador': f"{marca.trabajador.first_name} {marca.trabajador.last_name}",
-                'rut': p.rut if p else "S/I",
-                'cargo': p.cargo if p else "S/I",
-                'entrada': None, 'inicio_col': None, 'fin_col': None, 'salida': None
-            }
-
-        hora = fecha_local.time()
-        if marca.tipo == 'ENTRADA':
-            if reporte[key]['entrada'] is None or hora < reporte[key]['entrada']: reporte[key]['entrada'] = hora
-        elif marca.tipo == 'INICIO_COLACION': reporte[key]['inicio_col'] = hora
-        elif marca.tipo == 'FIN_COLACION': reporte[key]['fin_col'] = hora
-        elif marca.tipo == 'SALIDA':
-             if reporte[key]['salida'] is None or hora > reporte[key]['salida']: reporte[key]['salida'] = hora
-
-    # 5. Crear Excel
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="Reporte_Detallado_{perfil.empresa.nombre}.xlsx"'
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Detalle Asistencia"
-
     # Encabezados (IDÉNTICOS A TU FOTO)
     headers = ["Fecha", "Empresa", "Trabajador", "RUT", "Cargo", "Entrada", "Ini Col", "Fin Col", "Tiempo Col.", "Salida", "Horas Trab"]
-    ws.append(headers)
-
-    # Estilo Encabezado
-    fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.fill = fill
-
-    # 6. Llenar Filas y Calcular
-    for data in reporte.values():
-        entrada, salida = data['entrada'], data['salida']
-        inicio_col, fin_col = data['inicio_col'], data['fin_col']
-
-        tiempo_col_str = ""
-        horas_trab_str = ""
-
-        # A. Calcular Tiempo Colación
-        if inicio_col and fin_col:
-            dummy = datetime.min
-            diff = datetime.combine(dummy, fin_col) - datetime.combine(dummy, inicio_col)
-            segundos = diff.total_seconds()
-            tiempo_col_str = f"{int(segundos//3600):02d}:{int((segundos%3600)//60):02d}"
-
-        # B. Calcular Horas Trabajadas (Bruto: Salida - Entrada)
-        # Nota: Si quieres restar colación automáticamente, descomenta la lógica de resta
-        if entrada and salida:
-            dummy = datetime.min
-            diff = datetime.combine(dummy, salida) - datetime.combine(dummy, entrada)
-            segundos = diff.total_seconds()
-            horas_trab_str = f"{int(segundos//3600):02d}:{int((segundos%3600)//60):02d}"
-
-        ws.append([
-            data['fecha'].strftime("%d/%m/%Y"),
-            data['empresa'],
-            data['trabajador'],
-            data['rut'],
-            data['cargo'],
-            entrada.strftime("%H:%M") if entrada else "--",
-            inicio_col.strftime("%H:%M") if inicio_col else "--",
-            fin_col.strftime("%H:%M") if fin_col else "--",
-            tiempo_col_str, # Columna Nueva
-            salida.strftime("%H:%M") if salida else "--",
-            horas_trab_str  # Columna Final
-        ])
-
-    # Auto-ancho
-    for col in ws.columns:
-        ws.column_dimensions[col[0].column_letter].width = 15
-    ws.column_dimensions['C'].width = 25 # Nombre más ancho
-
-    wb.save(response)
-    return response
+    filas = _filas_detalle_empresa(jornadas_qs, perfil.empresa.nombre)
+    nombre_archivo = f"Reporte_Detallado_{perfil.empresa.nombre}"
+
+    formato = exportacion.formato_solicitado(request)
+    if formato != 'xlsx':
+        return exportacion.respuesta_csv(nombre_archivo, headers, filas, comprimir=(formato == 'csv.gz'))
 
+    # 4. Crear Excel (write_only: cada fila va directo a disco)
+    wb, ws = exportacion.libro_solo_escritura(
+        "Detalle Asistencia",
+        anchos={letra: 15 for letra in "ABCDEFGHIJK"} | {'C': 25},  # Nombre más ancho
+    )
+    exportacion.encabezados(ws, headers, 'encabezado_gris')
+    for fila in filas:
+        ws.append(fila)
+
+    return exportacion.respuesta_xlsx(wb, f"{nombre_archivo}.xlsx")
+
+@login_required
 def exportar_clima_laboral(request):
-    # 1. Crear el libro de Excel y la hoja
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Clima Laboral"
+    """
+    Ánimo y comentario de cada salida de la empresa del usuario (?desde=&hasta= opcionales).
+    Con ?formato=csv|csv.gz se entrega como CSV.
+    """
+    empresa = request.empresa
+    if not empresa:
+        return redirect('home')
+    if not es_empleador(request.user):
+        return HttpResponse("Error: Reporte solo para RRHH.", status=403)
 
-    # 2. Definir los Encabezados de la tabla
-    headers = ['Fecha', 'Hora', 'Trabajador', 'RUT', 'Cargo', 'Estado de Ánimo', 'Comentario / Motivo']
-    ws.append(headers)
-
-    # 3. Estilo para el encabezado (Negrita, fondo gris, centrado)
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F4F4F", end_color="4F4F4F", fill_type="solid")
-
-    for cell in ws[1]:  # Fila 1
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-
-    # 4. Obtener solo las marcas de SALIDA que tengan algún ánimo registrado
-    marcas = Marcacion.objects.filter(tipo='SALIDA', animo__isnull=False).order_by('-timestamp')
-
-    # 5. Escribir los datos
-    for marca in marcas:
-        # Convertir fecha y hora para que se vean bien
-        fecha = marca.timestamp.strftime("%d/%m/%Y")
-        hora = marca.timestamp.strftime("%H:%M")
-
-        # Poner un Emoji en el Excel según el ánimo
-        animo_texto = marca.get_animo_display() # Obtiene "Feliz" en vez de "FELIZ"
-        if marca.animo == 'FELIZ':
-            animo_display = f"😆 {animo_texto}"
-        elif marca.animo == 'NEUTRAL':
-            animo_display = f"😐 {animo_texto}"
-        elif marca.animo == 'MOLESTO':
-            animo_display = f"😫 {animo_texto}"
-        else:
-            animo_display = animo_texto
-
-        # Si no hay comentario, poner guion
-        comentario = marca.comentario_animo if marca.comentario_animo else "-"
-
-        # Agregar la fila
-        ws.append([
-            fecha,
-            hora,
-            f"{marca.trabajador.first_name} {marca.trabajador.last_name}",
-            marca.trabajador.perfil.rut,
-            marca.trabajador.perfil.cargo,
-            animo_display,
-            comentario
-        ])
-
-    # 6. Ajustar ancho de columnas automáticamente (estético)
-    ws.column_dimensions['A'].width = 12 # Fecha
-    ws.column_dimensions['C'].width = 25 # Nombre
-    ws.column_dimensions['E'].width = 20 # Cargo
-    ws.column_dimensions['F'].width = 15 # Animo
-    ws.column_dimensions['G'].width = 50 # Comentario (ancho para leer bien)
-
-    # 7. Preparar la respuesta HTTP para descargar el archivo
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    # 1. Solo las marcas de SALIDA (de su empresa) que tengan algún ánimo registrado.
+    #    values_list trae trabajador y perfil en el mismo JOIN (sin una consulta por fila)
+    marcas = Marcacion.objects.filter(
+        trabajador__perfil__empresa=empresa, tipo='SALIDA', animo__isnull=False
+    ).order_by('-timestamp', '-id')
+    desde = reportes.parsear_fecha(request.GET.get('desde'))
+    hasta = reportes.parsear_fecha(request.GET.get('hasta'))
+    if desde:
+        marcas = marcas.filter(timestamp__gte=JornadaDiaria.rango_dia(desde)[0])
+    if hasta:
+        marcas = marcas.filter(timestamp__lt=JornadaDiaria.rango_dia(hasta)[1])
+    marcas = marcas.values_list(
+        'timestamp', 'animo', 'comentario_animo', 'trabajador__first_name', 'trabajador__last_name',
+        'trabajador__perfil__rut', 'trabajador__perfil__cargo'
     )
-    response['Content-Disposition'] = 'attachment; filename="Reporte_Clima_Laboral.xlsx"'
 
-    wb.save(response)
-    return response
+    # Emoji en el Excel según el ánimo ("Feliz" en vez de "FELIZ")
+    emojis = {'FELIZ': "😆 ", 'NEUTRAL': "😐 ", 'MOLESTO': "😫 "}
+    nombres_animo = dict(Marcacion.ANIMO_CHOICES)
+
+    def filas():
+        for timestamp, animo, comentario, nombre, apellido, rut, cargo in marcas.iterator(chunk_size=exportacion.CHUNK_FILAS):
+            local = timezone.localtime(timestamp)
+            yield [
+                local.strftime("%d/%m/%Y"),
+                local.strftime("%H:%M"),
+                f"{nombre} {apellido}",
+                rut,
+                cargo,
+                f"{emojis.get(animo, '')}{nombres_animo.get(animo, animo)}",
+                comentario if comentario else "-",  # Si no hay comentario, poner guion
+            ]
+
+    headers = ['Fecha', 'Hora', 'Trabajador', 'RUT', 'Cargo', 'Estado de Ánimo', 'Comentario / Motivo']
+    nombre_archivo = f"Reporte_Clima_Laboral_{empresa.nombre}"
+
+    formato = exportacion.formato_solicitado(request)
+    if formato != 'xlsx':
+        return exportacion.respuesta_csv(nombre_archivo, headers, filas(), comprimir=(formato == 'csv.gz'))
+
+    # 2. Excel (write_only) con anchos fijos: cada fila va directo a disco
+    wb, ws = exportacion.libro_solo_escritura("Clima Laboral", anchos={
+        'A': 12,  # Fecha
+        'C': 25,  # Nombre
+        'E': 20,  # Cargo
+        'F': 15,  # Animo
+        'G': 50,  # Comentario (ancho para leer bien)
+    })
+    exportacion.encabezados(ws, headers, 'encabezado_oscuro')
+    for fila in filas():
+        ws.append(fila)
+
+    return exportacion.respuesta_xlsx(wb, f"{nombre_archivo}.xlsx")
 
 @login_required
 def generar_pdf(request):
-    """Genera comprobante PDF para el trabajador."""
-    timezone.activate(timezone.get_current_timezone())
-    marcas = Marcacion.objects.filter(trabajador=request.user).order_by('timestamp')
-    empresa = request.user.perfil.empresa
-    logo_path = None
-    if empresa and empresa.logo:
-        # 1. Obtenemos la ruta física
-        ruta_absoluta = empresa.logo.path
-        logo_path = f"file://{ruta_absoluta}"
-    contexto = {
-        'marcas': marcas,
-        'usuario': request.user,
-        'fecha_generacion': timezone.localtime(timezone.now()),
-        'empresa': empresa,
-        'logo_path': logo_path,
-    }
-
-    html_string = render_to_string('reportes/libro_asistencia.html', contexto)
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="asistencia_{request.user.username}.pdf"'
-    HTML(string=html_string).write_pdf(response)
-    return response
+    """
+    Libro de Asistencia del trabajador en PDF (?desde=&hasta=, por defecto el mes en curso).
+    Si no hay marcas nuevas desde la última descarga se entrega el mismo archivo sin renderizar.
+    """
+    desde = reportes.parsear_fecha(request.GET.get('desde'))
+    hasta = reportes.parsear_fecha(request.GET.get('hasta'))
+    if not (desde and hasta) or desde > hasta:
+        desde, hasta = reportes.mes_actual()
+
+    ruta, _ = libros.obtener_pdf(request.user, request.empresa, desde, hasta)
+    return FileResponse(
+        default_storage.open(ruta, 'rb'),
+        as_attachment=True,
+        filename=libros.nombre_archivo(request.user, desde, hasta),
+        content_type='application/pdf',
+    )
 
 
 # =======================================================
@@ -742,8 +726,9 @@ def cambiar_password_obligatorio(request):
             user = form.save()
             update_session_auth_hash(request, user)
             if hasattr(user, 'perfil'):
+                # Solo este campo: el resto del perfil puede venir de la caché
                 user.perfil.cambiar_pass_inicial = False
-                user.perfil.save()
+                user.perfil.save(update_fields=['cambiar_pass_inicial'])
             messages.success(request, '¡Contraseña actualizada!')
             return redirect('home')
     else:
@@ -880,132 +865,41 @@ def crear_solicitud_trabajador(request):
 
 @login_required
 def exportar_reporte_fiscalizacion(request):
-    # 1. Configuración del Excel
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # 1. Validar empresa del usuario
+    perfil = request.perfil
+    if not perfil or not perfil.empresa:
+        return HttpResponse("Error: Usuario sin empresa asignada.", status=403)
+    if not _puede_ver_reporte(request.user, 'FISCALIZACION'):
+        return HttpResponse("Error: Reporte solo para RRHH o fiscalizadores.", status=403)
+
+    empresa_actual = perfil.empresa
 
     # Obtenemos fechas del GET para el nombre del archivo
     desde = request.GET.get('desde', 'inicio')
     hasta = request.GET.get('hasta', 'fin')
-    response['Content-Disposition'] = f'attachment; filename="Reporte_Fiscalizacion_DT_{desde}_{hasta}.xlsx"'
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Registro de Asistencia"
-
-    # 2. Estilos (Normativa DT)
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="003366", end_color="003366", fill_type="solid") # Azul oscuro
-    center_align = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    # 3. Definir Columnas
-    headers = [
-        "ID Registro",
-        "RUT Trabajador",
-        "Nombre Completo",
-        "Fecha",
-        "Hora",
-        "Tipo de Marca",
-        "Origen",
-        "Geolocalización",
-        "Estado",
-        "Checksum (Hash)"
-    ]
-
-    # Escribir encabezados
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center_align
-        cell.border = thin_border
-
-    # 4. Obtener datos
-    perfil = getattr(request.user, 'perfil', None)
-    if not perfil or not perfil.empresa:
-        return HttpResponse("Error: Usuario sin empresa asignada.", status=403)
 
-    empresa_actual = perfil.empresa
+    # 2. Obtener datos (Filtro Base: Empresa + Fechas en hora de Chile)
+    marcas = reportes.marcas_fiscalizacion(
+        empresa_actual, reportes.parsear_fecha(request.GET.get('desde')), reportes.parsear_fecha(request.GET.get('hasta'))
+    )
+    filas = reportes.filas_fiscalizacion(marcas)
+    nombre_archivo = f"Reporte_Fiscalizacion_DT_{desde}_{hasta}"
 
-    # Filtro Base: Empresa
-    marcas = Marcacion.objects.filter(
-        trabajador__perfil__empresa=empresa_actual
-    ).select_related('trabajador', 'trabajador__perfil').order_by('-timestamp')
-
-    # Filtro de Fechas (IMPORTANTE)
-    if request.GET.get('desde') and request.GET.get('hasta'):
-        desde_fmt = request.GET.get('desde')
-        hasta_fmt = request.GET.get('hasta')
-        marcas = marcas.filter(timestamp__range=[desde_fmt, hasta_fmt + " 23:59:59"])
-
-    # 5. Llenar filas
-    for row_num, marca in enumerate(marcas, 2):
-        # A. Preparar datos de Fecha/Hora
-        fecha_local = timezone.localtime(marca.timestamp)
-        fecha_str = fecha_local.strftime('%d/%m/%Y')
-        hora_str = fecha_local.strftime('%H:%M:%S')
-
-        # B. Obtener RUT seguro (CORRECCIÓN CRÍTICA 🛠️)
-        # Si existe el perfil y tiene RUT, úsalo. Si no, pon "S/I"
-        if hasattr(marca.trabajador, 'perfil') and marca.trabajador.perfil.rut:
-            rut_real = marca.trabajador.perfil.rut
-        else:
-            rut_real = "S/I"
-
-        # C. Generar HASH (Huella digital)
-        # Usamos el ID + RUT + Fecha + Hora para que sea único
-        raw_data = f"{marca.id}{rut_real}{fecha_str}{hora_str}{marca.tipo}".encode('utf-8')
-        hash_seguridad = hashlib.sha256(raw_data).hexdigest()
-
-        # D. Escribir en celdas
-        ws.cell(row=row_num, column=1, value=marca.id).alignment = center_align
-        ws.cell(row=row_num, column=2, value=rut_real).alignment = center_align  # <--- RUT Real
-        ws.cell(row=row_num, column=3, value=marca.trabajador.get_full_name())
-        ws.cell(row=row_num, column=4, value=fecha_str).alignment = center_align
-        ws.cell(row=row_num, column=5, value=hora_str).alignment = center_align
-
-        # Color según tipo
-        cell_tipo = ws.cell(row=row_num, column=6, value=marca.tipo)
-        cell_tipo.alignment = center_align
-        if marca.tipo == 'ENTRADA':
-            cell_tipo.font = Font(color="006600", bold=True)
-        elif marca.tipo == 'SALIDA':
-            cell_tipo.font = Font(color="990000", bold=True)
-
-        ws.cell(row=row_num, column=7, value="WEB/APP").alignment = center_align
-
-        # Geolocalización limpia
-        geo_info = marca.direccion if marca.direccion else f"{marca.latitud}, {marca.longitud}"
-        ws.cell(row=row_num, column=8, value=geo_info[:60]) # Recortar para que no rompa el Excel
-
-        # Estado
-        estado_texto = "VIGENTE" # Por defecto
-        # (Aquí podrías poner lógica si tienes marcas anuladas o rectificadas)
-        ws.cell(row=row_num, column=9, value=estado_texto).alignment = center_align
-
-        # Hash (Fuente monoespaciada)
-        cell_hash = ws.cell(row=row_num, column=10, value=hash_seguridad)
-        cell_hash.font = Font(name='Courier New', size=9, color="555555")
-
-    # 6. Ajustar ancho de columnas manualmente (Más seguro que automático)
-    ws.column_dimensions['A'].width = 12 # ID
-    ws.column_dimensions['B'].width = 15 # RUT
-    ws.column_dimensions['C'].width = 30 # Nombre
-    ws.column_dimensions['D'].width = 12 # Fecha
-    ws.column_dimensions['E'].width = 12 # Hora
-    ws.column_dimensions['H'].width = 40 # Geo
-    ws.column_dimensions['J'].width = 65 # Hash
-
-    wb.save(response)
-    return response
+    formato = exportacion.formato_solicitado(request)
+    if formato != 'xlsx':
+        return exportacion.respuesta_csv(nombre_archivo, reportes.ENCABEZADOS_FISCALIZACION, filas, comprimir=(formato == 'csv.gz'))
+
+    # 3. Libro write_only con estilos compartidos (Normativa DT)
+    return exportacion.respuesta_xlsx(reportes.libro_fiscalizacion(filas), f"{nombre_archivo}.xlsx")
 
 @login_required
 def exportar_reporte_remuneraciones(request):
     # 1. Obtener Empresa y Validar
-    perfil_admin = getattr(request.user, 'perfil', None)
+    perfil_admin = request.perfil
     if not perfil_admin or not perfil_admin.empresa:
         return HttpResponse("Error: No tiene empresa asignada.", status=403)
+    if not _puede_ver_reporte(request.user, 'REMUNERACIONES'):
+        return HttpResponse("Error: Reporte solo para RRHH.", status=403)
 
     empresa = perfil_admin.empresa
 
@@ -1018,190 +912,114 @@ def exportar_reporte_remuneraciones(request):
         end_date = datetime.strptime(fecha_fin_str, "%Y-%m-%d").date()
     else:
         # Por defecto mes actual
-        hoy = timezone.localdate()
-        start_date = hoy.replace(day=1)
-        # Truco fin de mes
-        next_month = start_date.replace(day=28) + timedelta(days=4)
-        end_date = next_month - timedelta(days=next_month.day)
-
-    # 3. Preparar Excel
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f"Remuneraciones_{empresa.nombre}_{start_date}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Pre-Nomina LRE"
-
-    # Estilos
-    header_fill = PatternFill(start_color="2F75B5", end_color="2F75B5", fill_type="solid")
-    font_white = Font(color="FFFFFF", bold=True)
-    align_center = Alignment(horizontal='center')
-
-    # 4. ENCABEZADOS
-    headers = [
-        "RUT", "Nombre Completo", "Cargo",
-        "Días Trab. (Cód 1102)", "Horas Ordinarias",
-        "H.E. 50% (Cód 2101)", "H.E. 100% (Dom/Fest)",
-        "Min. Atraso", "Días Ausencia (Cód 1106)", "Observaciones"
-    ]
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = font_white
-        cell.alignment = align_center
-
-    # 5. OPTIMIZACIÓN: Cargar Feriados y Ausencias en Memoria 🚀
-    # Esto evita hacer miles de consultas a la base de datos dentro del bucle
-    feriados_set = set(Feriado.objects.filter(fecha__range=[start_date, end_date]).values_list('fecha', flat=True))
-
-    # Trabajadores de la empresa
-    trabajadores = User.objects.filter(perfil__empresa=empresa, is_active=True).distinct()
-
-    # 6. ITERACIÓN POR TRABAJADOR
-    for trabajador in trabajadores:
-        perfil = getattr(trabajador, 'perfil', None)
-        if not perfil: continue
-
-        # Configuración personal
-        horas_jornada = perfil.jornada_diaria if perfil.jornada_diaria else 9
-        hora_entrada_oficial = perfil.hora_entrada if perfil.hora_entrada else time(9,0)
-
-        JORNADA_SEGUNDOS = horas_jornada * 3600
-
-        # Acumuladores
-        dias_trabajados = 0
-        seg_ordinarios = 0
-        seg_extra_50 = 0
-        seg_extra_100 = 0
-        minutos_atraso = 0
-        dias_ausencia = 0
-        observaciones = []
-
-        # --- RECORRIDO DÍA A DÍA ---
-        delta_days = (end_date - start_date).days + 1
-
-        for i in range(delta_days):
-            dia_actual = start_date + timedelta(days=i) # Es objeto date
-            dia_semana = dia_actual.weekday() # 0=Lunes ... 6=Domingo
-
-        # Mapa rápido para saber si le toca trabajar este día específico
-            mapa_turno = {
-                0: perfil.trabaja_lunes,
-                1: perfil.trabaja_martes,
-                2: perfil.trabaja_miercoles,
-                3: perfil.trabaja_jueves,
-                4: perfil.trabaja_viernes,
-                5: perfil.trabaja_sabado,
-                6: perfil.trabaja_domingo,
-            }
-            le_toca_trabajar = mapa_turno.get(dia_semana, False)
-
-            # A. Revisar si hay justificaciones (Vacaciones / Licencias)
-            # Consultamos si HOY cae en un rango de vacación o licencia
-            es_vacacion = Vacacion.objects.filter(
-                trabajador=trabajador,
-                inicio__lte=dia_actual,
-                fin__gte=dia_actual,
-                estado='APROBADA'
-            ).exists()
-            es_licencia = LicenciaMedica.objects.filter(trabajador=trabajador, inicio__lte=dia_actual, fin__gte=dia_actual).exists()
-            es_feriado = dia_actual in feriados_set
-            es_domingo = (dia_actual.weekday() == 6)
-            es_sabado = (dia_actual.weekday() == 5)
-
-            # B. Buscar Marcas
-            marcas_dia = Marcacion.objects.filter(trabajador=trabajador, timestamp__date=dia_actual)
-
-            if marcas_dia.exists():
-                dias_trabajados += 1
-
-                # Calcular Tiempos
-                entrada = marcas_dia.filter(tipo='ENTRADA').aggregate(Min('timestamp'))['timestamp__min']
-                salida = marcas_dia.filter(tipo='SALIDA').aggregate(Max('timestamp'))['timestamp__max']
-
-                if entrada and salida:
-                    duracion = (salida - entrada).total_seconds()
-
-                    # Descuento Colación (1 hora estándar)
-                    tiempo_neto = max(0, duracion - 3600)
-
-                    # --- LÓGICA DE HORAS EXTRAS ---
-                    # Si es Domingo O Feriado => Todo es al 100%
-                    if es_domingo or es_feriado:
-                        seg_extra_100 += tiempo_neto
-                    else:
-                        # Día normal
-                        if tiempo_neto > JORNADA_SEGUNDOS:
-                            seg_ordinarios += JORNADA_SEGUNDOS
-                            seg_extra_50 += (tiempo_neto - JORNADA_SEGUNDOS)
-                        else:
-                            seg_ordinarios += tiempo_neto
-
-                    # --- CÁLCULO DE ATRASO ---
-                    # Solo calculamos atraso si NO es feriado y NO es fin de semana (salvo que tenga turno)
-                    if not es_feriado and not es_domingo and not es_sabado:
-                        hora_real = timezone.localtime(entrada).time()
-                        # Comparación de horas usando datetime dummy
-                        dummy = datetime.today().date()
-                        dt_real = datetime.combine(dummy, hora_real)
-                        dt_oficial = datetime.combine(dummy, hora_entrada_oficial)
-                        # Tolerancia 10 min
-                        if dt_real > (dt_oficial + timedelta(minutes=10)):
-                            diff = dt_real - dt_oficial
-                            minutos_atraso += int(diff.total_seconds() / 60)
+        start_date, end_date = reportes.mes_actual()
 
-            else:
-                # NO HAY MARCAS (Posible Ausencia)
-                # Aquí aplicamos la lógica inteligente:
-
-                if es_feriado:
-                    pass # Es feriado, no es ausencia, se paga igual.
-                elif es_vacacion:
-                    pass # Está de vacaciones pagadas.
-                elif es_licencia:
-                    pass # Tiene licencia (paga la caja de compensación/Isapre).
-                elif not le_toca_trabajar:
-                    # Si NO le toca trabajar hoy, NO es ausencia. Es su día libre.
-                    pass
-
-                else:
-                    # Es día hábil, NO es feriado, LE TOCA trabajar y NO vino => FALTA
-                    dias_ausencia += 1
-
-        # Agregar observaciones si tiene muchas faltas
-        if dias_ausencia > 0:
-            observaciones.append(f"{dias_ausencia} Ausencias injustificadas")
-        if es_vacacion: # Solo como dato del último día revisado, mejorable
-            observaciones.append("Periodo con Vacaciones")
-
-        # Función auxiliar formateo HH:MM
-        def fmt_horas(segundos):
-            h = int(segundos // 3600)
-            m = int((segundos % 3600) // 60)
-            return f"{h:02d}:{m:02d}"
-
-        # 7. ESCRIBIR FILA
-        row = [
-            perfil.rut,
-            f"{trabajador.first_name} {trabajador.last_name}",
-            perfil.cargo,
-            dias_trabajados,
-            fmt_horas(seg_ordinarios),
-            fmt_horas(seg_extra_50),
-            fmt_horas(seg_extra_100),
-            minutos_atraso,
-            dias_ausencia,
-            ", ".join(observaciones)
-        ]
-        ws.append(row)
+    # 3. CÁLCULO: marcas, vacaciones, licencias y feriados de toda la empresa
+    # en un número fijo de consultas (ver remuneraciones.py) 🚀
+    filas = remuneraciones.filas_reporte(empresa, start_date, end_date)
+    nombre_archivo = f"Remuneraciones_{empresa.nombre}_{start_date}"
+
+    formato = exportacion.formato_solicitado(request)
+    if formato != 'xlsx':
+        return exportacion.respuesta_csv(nombre_archivo, remuneraciones.ENCABEZADOS, filas, comprimir=(formato == 'csv.gz'))
+
+    # 4. Excel
+    return exportacion.respuesta_xlsx(reportes.libro_remuneraciones(filas), f"{nombre_archivo}.xlsx")
+
+
+# =======================================================
+# 4.1 REPORTES EN SEGUNDO PLANO (encolar, consultar, descargar)
+# =======================================================
+
+def _json_trabajo(trabajo, **extra):
+    datos = {
+        'id': trabajo.id,
+        'tipo': trabajo.tipo,
+        'estado': trabajo.estado,
+        'progreso': trabajo.progreso,
+        'error': trabajo.error if trabajo.estado == 'FALLIDO' else None,
+        'url_estado': reverse('estado_reporte', args=[trabajo.id]),
+        'url_descarga': reverse('descargar_reporte', args=[trabajo.id]) if trabajo.estado == 'COMPLETADO' else None,
+    }
+    datos.update(extra)
+    return datos
+
+
+def _puede_ver_reporte(user, tipo):
+    """Los reportes de toda la empresa (nómina, DT, ZIP de libros) son solo para RRHH y fiscalizadores."""
+    if tipo == 'LIBRO_PDF':
+        return True  # Cada trabajador pide el suyo
+    if tipo == 'FISCALIZACION':
+        return es_empleador(user) or es_fiscalizador(user)
+    return es_empleador(user)
+
+
+def _trabajo_del_usuario(request, trabajo_id):
+    """Reportes de su empresa; el libro PDF solo lo ve quien lo pidió y los de toda la empresa solo RRHH/DT."""
+    trabajo = get_object_or_404(TrabajoReporte, pk=trabajo_id, empresa=request.empresa)
+    if trabajo.tipo == 'LIBRO_PDF' and trabajo.solicitado_por_id != request.user.id:
+        raise Http404("Reporte no encontrado")
+    if not _puede_ver_reporte(request.user, trabajo.tipo):
+        raise Http404("Reporte no encontrado")
+    return trabajo
+
+
+@login_required
+def solicitar_reporte(request):
+    """
+    Encola un reporte pesado (POST tipo, desde, hasta, formato) y devuelve su estado.
+    Si hay uno idéntico con los mismos datos, se devuelve ese (reutilizado=True).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    if not request.empresa:
+        return JsonResponse({'error': 'Usuario sin empresa asignada.'}, status=403)
+
+    tipo = request.POST.get('tipo')
+    if tipo not in dict(TrabajoReporte.TIPOS):
+        return JsonResponse({'error': 'Tipo de reporte inválido.'}, status=400)
+    if not _puede_ver_reporte(request.user, tipo):
+        return JsonResponse({'error': 'Este reporte es solo para RRHH o fiscalizadores.'}, status=403)
 
-    # Ajuste anchos
-    for col in ws.columns:
-        ws.column_dimensions[col[0].column_letter].width = 18
+    trabajo, reutilizado = reportes.solicitar(tipo, request.user, request.empresa, request.POST)
+    return JsonResponse(_json_trabajo(trabajo, reutilizado=reutilizado), status=200 if reutilizado else 202)
 
-    wb.save(response)
-    return response
+
+@login_required
+def estado_reporte(request, trabajo_id):
+    return JsonResponse(_json_trabajo(_trabajo_del_usuario(request, trabajo_id)))
+
+
+@login_required
+def descargar_reporte(request, trabajo_id):
+    trabajo = _trabajo_del_usuario(request, trabajo_id)
+    if trabajo.estado != 'COMPLETADO' or not trabajo.archivo:
+        return HttpResponse("El reporte aún no está listo.", status=409)
+    return FileResponse(trabajo.archivo.open('rb'), as_attachment=True, filename=trabajo.nombre_archivo)
+
+@staff_member_required
+def estado_servicios(request):
+    """
+    Salud de los servicios de fondo para monitoreo: reloj SHOA de este proceso,
+    contadores de geocoding y último estado de cada trabajo. Responde 503 si el
+    reloj no está sincronizado (las marcas estarían usando la hora local).
+    """
+    reloj = ntp_time.estado_reloj()
+    trabajos = {
+        estado.nombre: {
+            'dueno': estado.dueno,
+            'ultima_ejecucion': estado.ultima_ejecucion,
+            'resumen': estado.ultimo_resumen,
+            'error': estado.ultimo_error,
+        }
+        for estado in EstadoTrabajo.objects.order_by('nombre')
+    }
+    datos = {
+        'reloj': reloj,
+        'geocoding': {'este_proceso': geocoding.estadisticas(), 'direcciones_en_cache': DireccionCache.objects.count()},
+        'trabajos': trabajos,
+    }
+    return JsonResponse(datos, status=200 if reloj['sincronizado'] else 503)
 
 def privacidad(request):
     return render(request, 'asistencia/privacidad.html')
@@ -1366,109 +1184,72 @@ def gestionar_dia_administrativo(request, solicitud_id, accion):
     solicitud.save()
     return redirect('panel_rrhh')
 
+def _json_importacion(carga):
+    terminada = carga.estado in ('ANALIZADA', 'COMPLETADA')
+    return {
+        'id': carga.id,
+        'estado': carga.estado,
+        'estado_texto': carga.get_estado_display(),
+        'simular': carga.simular,
+        'progreso': carga.progreso,
+        'filas_total': carga.filas_total,
+        'filas_procesadas': carga.filas_procesadas,
+        'resumen': carga.resumen if terminada else None,
+        'diferencias': carga.diferencias if terminada else None,
+        'error': carga.error,
+        'url_estado': reverse('estado_importacion', args=[carga.id]),
+        'url_confirmar': reverse('confirmar_importacion', args=[carga.id]) if carga.estado == 'ANALIZADA' else None,
+    }
+
+
 @login_required
 def importar_nomina(request):
+    """
+    Sube la nómina y la deja al worker (ver `importacion.py`). La página consulta el
+    avance, muestra la simulación (conteos y cambios por campo) y pide confirmar.
+    """
     # Solo administradores
     if not request.user.is_superuser:
         messages.error(request, "⛔ Acceso denegado. Esta herramienta es solo para administración técnica.")
         return redirect('home')
 
-    if request.method == 'POST' and request.FILES['archivo_excel']:
-        excel_file = request.FILES['archivo_excel']
+    if request.method == 'POST':
+        excel_file = request.FILES.get('archivo_excel')
+        if not excel_file or not excel_file.name.lower().endswith('.xlsx'):
+            messages.error(request, "Sube un archivo Excel (.xlsx).")
+            return redirect('importar_nomina')
+
+        carga = importacion.solicitar(request.user, request.empresa, excel_file, simular=bool(request.POST.get('simular')))
+        return redirect(f"{reverse('importar_nomina')}?id={carga.id}")
+
+    carga = None
+    if request.GET.get('id', '').isdigit():
+        carga = get_object_or_404(ImportacionNomina, pk=request.GET['id'])
+
+    return render(request, 'asistencia/importar_nomina.html', {
+        'carga': carga,
+        'carga_json': _json_importacion(carga) if carga else None,
+        'recientes': ImportacionNomina.objects.select_related('solicitado_por')[:5],
+    })
 
-        try:
-            wb = openpyxl.load_workbook(excel_file)
-            ws = wb.active
-
-            # Contadores
-            creados = 0
-            actualizados = 0
-
-            # Iteramos desde la fila 2 (saltando encabezados)
-            with transaction.atomic(): # Si algo falla grave, no guarda nada a medias
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    # Asignamos variables según el orden de columnas (0 a 13)
-                    # Ajusta estos índices si cambias el orden del Excel
-                    if not row[0]: continue # Si no hay username, saltar
-
-                    username = str(row[0]).strip()
-                    email = str(row[1]).strip() if row[1] else ""
-                    first_name = str(row[2]).strip() if row[2] else ""
-                    last_name = str(row[3]).strip() if row[3] else ""
-                    rut = str(row[4]).strip() if row[4] else ""
-                    cargo = str(row[5]).strip() if row[5] else ""
-
-                    # Hora: Excel a veces devuelve datetime o string
-                    hora_entrada = row[6] # Trataremos de procesarlo en el perfil
-
-                    # Función auxiliar para leer SI/NO
-                    def es_si(valor):
-                        return str(valor).upper().strip() in ['SI', 'S', 'YES', '1', 'TRUE']
-
-                    dias_config = {
-                        'lunes': es_si(row[7]),
-                        'martes': es_si(row[8]),
-                        'miercoles': es_si(row[9]),
-                        'jueves': es_si(row[10]),
-                        'viernes': es_si(row[11]),
-                        'sabado': es_si(row[12]),
-                        'domingo': es_si(row[13]),
-                    }
-
-                    # 1. Crear o Buscar Usuario
-                    user, created = User.objects.get_or_create(username=username)
-                    user.email = email
-                    user.first_name = first_name
-                    user.last_name = last_name
-
-                    if created:
-                        # Contraseña por defecto: El RUT (sin puntos ni guion) o '123456'
-                        password = rut.replace(".", "").replace("-", "") if rut else "123456"
-                        user.set_password(password)
-                        creados += 1
-                    else:
-                        actualizados += 1
-
-                    user.save()
-
-                    # 2. Configurar Perfil
-                    perfil, _ = Perfil.objects.get_or_create(usuario=user)
-                    perfil.rut = rut
-                    perfil.cargo = cargo
-
-                    # Asignar Empresa (Asumimos la del admin que carga)
-                    if request.user.perfil.empresa:
-                        perfil.empresa = request.user.perfil.empresa
-
-                    # Asignar Hora Entrada
-                    if hora_entrada:
-                        import datetime
-                        if isinstance(hora_entrada, datetime.time):
-                            perfil.hora_entrada = hora_entrada
-                        elif isinstance(hora_entrada, datetime.datetime):
-                            perfil.hora_entrada = hora_entrada.time()
-                        elif isinstance(hora_entrada, str):
-                            # Intentar convertir string "09:00"
-                            try:
-                                h, m = map(int, hora_entrada.split(':'))
-                                perfil.hora_entrada = datetime.time(h, m)
-                            except:
-                                pass # Si falla, queda la default
-
-                    # 3. Asignar Días de Trabajo (Lo nuevo)
-                    perfil.trabaja_lunes = dias_config['lunes']
-                    perfil.trabaja_martes = dias_config['martes']
-                    perfil.trabaja_miercoles = dias_config['miercoles']
-                    perfil.trabaja_jueves = dias_config['jueves']
-                    perfil.trabaja_viernes = dias_config['viernes']
-                    perfil.trabaja_sabado = dias_config['sabado']
-                    perfil.trabaja_domingo = dias_config['domingo']
-
-                    perfil.save()
-
-            messages.success(request, f"Proceso terminado: {creados} nuevos, {actualizados} actualizados.")
 
-        except Exception as e:
-            messages.error(request, f"Error al procesar el archivo: {str(e)}")
+@login_required
+def estado_importacion(request, importacion_id):
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Acceso denegado.'}, status=403)
+    return JsonResponse(_json_importacion(get_object_or_404(ImportacionNomina, pk=importacion_id)))
+
+
+@login_required
+def confirmar_importacion(request, importacion_id):
+    """Aplica de verdad una nómina ya simulada (POST)."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Acceso denegado.'}, status=403)
 
-    return render(request, 'asistencia/importar_nomina.html')
\ No newline at end of file
+    carga = get_object_or_404(ImportacionNomina, pk=importacion_id)
+    if not importacion.confirmar(carga):
+        return JsonResponse({'error': 'La importación no está esperando confirmación.'}, status=409)
+    carga.refresh_from_db()
+    return JsonResponse(_json_importacion(carga), status=202)
\ No newline at end of file
@@ -61,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.asistencia.contexto.ContextoEmpresaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -160,9 +161,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+# Para probar contra un SMTP local (ej: python -m aiosmtpd -n -l localhost:1025):
+# EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=0 python manage.py procesar_tareas
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
 EMAIL_HOST_USER = 'carlos.esteban.l.f@gmail.com'
 EMAIL_HOST_PASSWORD = 'xupv jzyk xipf lsax ' # La de 16 letras de Google
-DEFAULT_FROM_EMAIL = 'Sistema Asistencia <carlos.esteban.l.f@gmail.com>'
\ No newline at end of file
+DEFAULT_FROM_EMAIL = 'Sistema Asistencia <carlos.esteban.l.f@gmail.com>'
+
+# ---------------------------------------------------------------
+# Geocoding (caché delante de Nominatim)
+# ---------------------------------------------------------------
+GEOCODING_PRECISION = 4          # Decimales de lat/lon para la clave (4 ≈ 11 metros)
+GEOCODING_TTL_DIAS = 30          # Vigencia de una dirección en caché
+GEOCODING_LRU_TAMANO = 1024      # Entradas en memoria por proceso
+GEOCODING_TASA_POR_SEGUNDO = 1.0 # Política de Nominatim: 1 req/s (global, vía BD)
+
+
+# ---------------------------------------------------------------
+# Fotos de marcación (se procesan en el worker antes de subirlas)
+# ---------------------------------------------------------------
+FOTO_MAX_LADO = 800          # Píxeles del lado mayor
+FOTO_CALIDAD = 75            # Calidad JPEG
+FOTO_MINIATURA_LADO = 96     # Miniatura cuadrada para el panel
+
+
+# ---------------------------------------------------------------
+# Bandeja de correos (comprobantes y alertas)
+# ---------------------------------------------------------------
+CORREO_BACKOFF_BASE_SEGUNDOS = 60   # Primer reintento tras un error SMTP
+CORREO_BACKOFF_MAX_SEGUNDOS = 3600  # Tope del backoff exponencial
+CORREO_MAX_POR_DESTINATARIO = 100   # Correos por destinatario dentro de la ventana
+CORREO_VENTANA_MINUTOS = 60
+
+
+# ---------------------------------------------------------------
+# Contexto Perfil/Empresa por request (apps.asistencia.contexto)
+# ---------------------------------------------------------------
+# Sin CACHES configurado Django usa LocMemCache (una por proceso): la invalidación
+# al guardar Perfil/Empresa solo llega al proceso que guardó, los demás ven el
+# cambio al vencer este TTL. Con varios workers conviene una caché compartida.
+CONTEXTO_EMPRESA_CACHE_SEGUNDOS = 60
+
+
+# ---------------------------------------------------------------
+# Hora oficial SHOA (apps.asistencia.ntp_time)
+# ---------------------------------------------------------------
+NTP_SERVIDOR = 'ntp.shoa.cl'
+NTP_INTERVALO_SEGUNDOS = 300        # Cada cuánto se re-mide el offset (un worker por vez)
+NTP_MAX_ANTIGUEDAD_SEGUNDOS = 1800  # Después de esto la hora se reporta como no sincronizada
+
+
+# ---------------------------------------------------------------
+# Reportes en segundo plano (apps.asistencia.reportes)
+# ---------------------------------------------------------------
+# Los archivos van al storage por defecto (MEDIA_ROOT/reportes/): el worker de
+# `procesar_tareas` y la web deben ver el mismo directorio.
+REPORTES_REUTILIZAR_HORAS = 24  # Un reporte idéntico y sin datos nuevos se reutiliza por este tiempo
+# Copia local de los logos para WeasyPrint (por defecto en el directorio temporal)
+# LIBROS_CACHE_DIR = BASE_DIR / 'cache' / 'libros'